@@ -1,35 +1,72 @@
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+import time
 from typing import Optional, Dict, Any
 import os
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from app.database import supabase
+from app.database import async_supabase
+from app.services.cache import TTLCache
+from app.services.password_hasher import (
+    pwd_context, password_hasher, PasswordHasherBusy, hash_password, check_password
+)
 
 # Secret key to encode the JWT token
 SECRET_KEY = os.getenv("SECRET_KEY", "your_secret_key_here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# 使用更安全的配置，避免bcrypt版本检测问题
-pwd_context = CryptContext(
-    schemes=["bcrypt"], 
-    deprecated="auto",
-    bcrypt__ident="2b",  # 指定bcrypt版本标识
-    bcrypt__rounds=12      # 指定加密轮数
-)
+# 认证用户（principal）缓存：按用户 ID 缓存 users 记录，避免每个请求查库
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+# 为 true 时，token 已携带全部身份声明则直接使用声明，完全不查库
+AUTH_TRUST_TOKEN_CLAIMS = os.getenv("AUTH_TRUST_TOKEN_CLAIMS", "false").lower() == "true"
+# 登录时写入 token 的身份声明
+PRINCIPAL_CLAIMS = ("sub", "email", "name", "role")
+# 可以访问管理接口（如认证指标）的角色，逗号分隔
+ADMIN_ROLES = {role.strip() for role in os.getenv("ADMIN_ROLES", "admin").split(",") if role.strip()}
+# principal 只包含这些 users 字段（不查询、不缓存 password_hash）
+PRINCIPAL_FIELDS = ("id", "email", "name", "avatar_url", "role")
+
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+# 已验证 token 缓存：token -> payload，条目在 token 的 exp 时刻之前过期，
+# 重连风暴时同一 token 不再重复做 HMAC 校验
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
 security = HTTPBearer()
 
 def verify_password(plain_password, hashed_password):
-    # 截断密码到72字节（bcrypt限制）
-    plain_password = plain_password[:72]
-    return pwd_context.verify(plain_password, hashed_password)
+    """同步校验密码（脚本使用；请求处理中请使用 verify_password_async）"""
+    return check_password(plain_password, hashed_password)
 
 def get_password_hash(password):
-    # 截断密码到72字节（bcrypt限制）
-    password = password[:72]
-    return pwd_context.hash(password)
+    """同步计算密码哈希（脚本使用；请求处理中请使用 get_password_hash_async）"""
+    return hash_password(password)
+
+def _hasher_busy_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server busy, please retry",
+        headers={"Retry-After": "1"},
+    )
+
+async def verify_password_async(plain_password, hashed_password):
+    """在密码哈希进程池中校验密码"""
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise _hasher_busy_exception()
+
+async def get_password_hash_async(password):
+    """在密码哈希进程池中计算密码哈希"""
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise _hasher_busy_exception()
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -41,6 +78,41 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def decode_token(token: str) -> Dict[str, Any]:
+    """
+    解码并验证 JWT，结果按 token 缓存（返回副本，调用方修改不会影响缓存）
+    
+    Raises:
+        JWTError: token 无效或已过期
+    """
+    payload = token_cache.get(token)
+    if payload is not None:
+        return dict(payload)
+    
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    
+    # 缓存时间不超过 token 剩余有效期
+    ttl = TOKEN_CACHE_TTL
+    exp = payload.get("exp")
+    if exp is not None:
+        ttl = min(ttl, exp - time.time())
+    if ttl > 0:
+        token_cache.set(token, payload, ttl=ttl)
+    return dict(payload)
+
+def invalidate_principal(user_id: str):
+    """用户资料变更后调用，清除缓存的 principal"""
+    principal_cache.pop(user_id)
+
+def _principal_from_claims(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """由 token 声明构造 principal（只包含身份字段）"""
+    return {
+        "id": payload["sub"],
+        "email": payload["email"],
+        "name": payload["name"],
+        "role": payload["role"],
+    }
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -48,18 +120,29 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(credentials.credentials)
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
     
+    # token 自带完整声明时无需查库
+    if AUTH_TRUST_TOKEN_CLAIMS and all(payload.get(claim) for claim in PRINCIPAL_CLAIMS):
+        return _principal_from_claims(payload)
+    
+    # 缓存条目在请求间共享，每次返回副本，调用方修改不会影响缓存
+    user = principal_cache.get(user_id)
+    if user is not None:
+        return dict(user)
+    
     # Get user from database
-    response = supabase.table("users").select("*").eq("id", user_id).execute()
+    response = await async_supabase.table("users").select(", ".join(PRINCIPAL_FIELDS)).eq("id", user_id).execute()
     if not response.data:
         raise credentials_exception
-    return response.data[0]
+    user = response.data[0]
+    principal_cache.set(user_id, user)
+    return dict(user)
 
 
 def verify_token(token: str) -> Dict[str, Any]:
@@ -76,11 +159,16 @@ def verify_token(token: str) -> Dict[str, Any]:
         HTTPException: token 无效
     """
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
+        return decode_token(token)
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token",
             headers={"WWW-Authenticate": "Bearer"},
-        )
\ No newline at end of file
+        )
+
+async def get_current_admin(user = Depends(get_current_user)):
+    """管理接口依赖：要求当前用户的角色在 ADMIN_ROLES 中"""
+    if user.get("role") not in ADMIN_ROLES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return user
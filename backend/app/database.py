@@ -1,4 +1,77 @@
-from supabase import create_client, Client
-from app.config import SUPABASE_URL, SUPABASE_KEY
+import os
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from supabase import Client
+from app.services.db_metrics import InstrumentedClient
+from app.storage import create_storage_backend
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# 存储后端由 STORAGE_BACKEND 选择（supabase / sqlite），路由中的查询链式调用不变
+storage_backend = create_storage_backend()
+
+# 带调用监控的客户端（记录每个请求的查询次数、耗时与表名）
+supabase: Client = InstrumentedClient(storage_backend)
+
+# 异步数据访问层使用的专用线程池大小
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", "16"))
+
+_db_executor = ThreadPoolExecutor(max_workers=DB_THREADPOOL_SIZE, thread_name_prefix="db")
+
+
+class AsyncQuery:
+    """
+    同步查询构造器的异步包装
+
+    链式调用与同步客户端完全一致，只有 execute() 变为协程，
+    在专用线程池中执行 HTTP 请求，不阻塞事件循环
+    """
+
+    def __init__(self, builder: Any):
+        self._builder = builder
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # 仍是查询构造器则继续包装，支持链式调用
+            if hasattr(result, "execute"):
+                return AsyncQuery(result)
+            return result
+        return call
+
+    async def execute(self):
+        loop = asyncio.get_running_loop()
+        # 复制上下文，使请求级的数据库调用统计在线程中可见
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(_db_executor, context.run, self._builder.execute)
+
+
+class AsyncSupabase:
+    """
+    异步数据访问层，供所有 async 路由、WebSocket/SSE 和后台任务使用
+
+    用法:
+        res = await async_supabase.table("messages").select("*").eq("id", id).execute()
+    """
+
+    def __init__(self, client: Client):
+        self._client = client
+
+    def table(self, name: str) -> AsyncQuery:
+        return AsyncQuery(self._client.table(name))
+
+    def rpc(self, fn: str, params: dict = None) -> AsyncQuery:
+        return AsyncQuery(self._client.rpc(fn, params or {}))
+
+
+async_supabase = AsyncSupabase(supabase)
+
+
+def shutdown_db_executor():
+    """关闭数据访问线程池与存储后端连接"""
+    _db_executor.shutdown(wait=False, cancel_futures=True)
+    storage_backend.close()
@@ -1,7 +1,43 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from app.services.job_queue import job_queue
+from app.services.password_hasher import password_hasher
+from app.services.http_pool import http_pool
+from app.services.realtime_bus import realtime_bus
+from app.services.message_writer import message_writer
+from app.services.presence import presence
+from app.websocket import manager as ws_manager
+from app.routers.sse import sse_manager
+from app.database import shutdown_db_executor
+from app.services.db_metrics import DBMetricsMiddleware
+from app.storage.resilient import StorageUnavailableError
 
-app = FastAPI(title="PawPal API", description="Backend for PawPal Adoption App")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动后台任务队列（恢复上次未完成的任务）
+    await job_queue.start()
+    # 连接跨 worker 实时总线（WebSocket / SSE 广播）
+    await realtime_bus.start()
+    # 聊天消息批量写入（关闭时先写完积压的消息）
+    await message_writer.start()
+    # 在线状态同步（跨 worker）
+    await presence.start()
+    yield
+    await presence.stop()
+    await message_writer.stop()
+    await ws_manager.stop()
+    await sse_manager.stop()
+    await realtime_bus.stop()
+    await job_queue.stop()
+    password_hasher.shutdown()
+    await http_pool.aclose()
+    shutdown_db_executor()
+
+
+app = FastAPI(title="PawPal API", description="Backend for PawPal Adoption App", lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",
@@ -17,14 +53,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 数据库调用监控与 N+1 检测（纯 ASGI 中间件，不包装 SSE 等流式响应）
+app.add_middleware(DBMetricsMiddleware)
+
+
+@app.exception_handler(StorageUnavailableError)
+async def storage_unavailable_handler(request: Request, exc: StorageUnavailableError):
+    """数据库超时或熔断且没有可兜底的数据时返回 503，而不是挂起请求"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "数据服务繁忙，请稍后再试"},
+        headers={"Retry-After": str(int(exc.retry_after + 0.999))}
+    )
+
 from app.routers import pets, users, chats, applications, auth, websocket as ws_router
 from app.routers import sse as sse_router
 from app.routers import ai as ai_router
 from app.routers import ai_v2 as ai_v2_router  # 新的 AI V2 路由
-from app.routers.chats import set_sse_manager
-
-# 设置 SSE 管理器到 chats 模块
-set_sse_manager(sse_router.sse_manager)
+from app.routers import jobs as jobs_router
+from app.routers import metrics as metrics_router
 
 app.include_router(pets.router)
 app.include_router(users.router)
@@ -39,6 +86,10 @@ app.include_router(sse_router.router)
 app.include_router(ai_router.router)
 # AI 功能路由 V2（新实现，对齐 PRD）
 app.include_router(ai_v2_router.router)
+# 后台任务队列状态
+app.include_router(jobs_router.router)
+# 运行指标
+app.include_router(metrics_router.router)
 
 @app.get("/")
 def read_root():
@@ -56,6 +107,8 @@ def read_root():
             "websocket": "/ws/chat",
             "sse": "/api/sse/connect?user_id=xxx",
             "ai_v1": "/api/ai",
-            "ai_v2": "/api/ai/v2"
+            "ai_v2": "/api/ai/v2",
+            "jobs": "/api/jobs",
+            "metrics": "/api/metrics"
         }
     }
@@ -26,6 +26,10 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+class UserUpdate(BaseModel):
+    name: Optional[str] = None
+    avatar_url: Optional[str] = None
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -8,7 +8,8 @@ from pydantic import BaseModel
 import logging
 
 from app.services.ai_service import ai_service, UserProfile, PetProfile
-from app.database import supabase
+from app.database import async_supabase
+from app.services.job_queue import job_queue
 
 logger = logging.getLogger(__name__)
 
@@ -147,7 +148,7 @@ async def get_match_recommendations(request: MatchRequest):
     """
     try:
         # 获取所有可领养宠物
-        pets_res = supabase.table("pets").select("*").eq("is_adopted", False).execute()
+        pets_res = await async_supabase.table("pets").select("*").eq("is_adopted", False).execute()
         
         if not pets_res.data:
             return []
@@ -233,7 +234,7 @@ async def calculate_single_match(
     """
     try:
         # 获取宠物信息
-        pet_res = supabase.table("pets").select("*").eq("id", pet_id).execute()
+        pet_res = await async_supabase.table("pets").select("*").eq("id", pet_id).execute()
         if not pet_res.data:
             raise HTTPException(status_code=404, detail="宠物不存在")
         
@@ -284,6 +285,71 @@ async def calculate_single_match(
 
 # ==================== 功能3：AI 预审助手 API ====================
 
+async def _run_precheck(request: PreCheckRequest) -> PreCheckResponse:
+    """执行预审并生成审核报告"""
+    # 获取宠物信息
+    pet_res = await async_supabase.table("pets").select("*").eq("id", request.pet_id).execute()
+    if not pet_res.data:
+        raise HTTPException(status_code=404, detail="宠物不存在")
+    
+    pet_data = pet_res.data[0]
+    tags = pet_data.get("tags", []) or []
+    
+    pet = PetProfile(
+        id=pet_data["id"],
+        name=pet_data["name"],
+        species=pet_data.get("category", "dog"),
+        breed=pet_data.get("breed", ""),
+        age_months=pet_data.get("age_value", 12),
+        size=_estimate_size(pet_data.get("weight", "10kg")),
+        energy_level=_estimate_energy_level(pet_data.get("age_value", 12), tags),
+        temperament=tags,
+        special_needs=[],
+        good_with_kids=True,
+        good_with_pets=True,
+        training_level="basic"
+    )
+    
+    # 创建用户画像
+    user_profile = UserProfile(
+        living_space=request.user_profile.get("living_space", ""),
+        experience_level=request.user_profile.get("experience_level", ""),
+        daily_time_available=request.user_profile.get("daily_time_available", 2),
+        family_status=request.user_profile.get("family_status", ""),
+        other_pets=request.user_profile.get("other_pets", []),
+        activity_level=request.user_profile.get("activity_level", ""),
+        preferences=request.user_profile.get("preferences", {})
+    )
+    
+    # 获取用户历史申请
+    history_res = await async_supabase.table("applications").select("*").eq("user_id", request.application_data.get("user_id")).execute()
+    user_history = history_res.data if history_res.data else []
+    
+    # 执行预审
+    precheck_result = await ai_service.precheck_application(
+        application_data=request.application_data,
+        user_profile=user_profile,
+        pet=pet,
+        user_history=user_history
+    )
+    
+    # 生成审核报告
+    review_report = await ai_service.generate_review_report(
+        application_id=request.application_id,
+        precheck_result=precheck_result
+    )
+    
+    return PreCheckResponse(
+        passed=precheck_result.passed,
+        score=precheck_result.score,
+        risk_level=precheck_result.risk_level,
+        risk_points=precheck_result.risk_points,
+        suggestions=precheck_result.suggestions,
+        auto_approved=precheck_result.auto_approved,
+        review_report=review_report
+    )
+
+
 @router.post("/precheck", response_model=PreCheckResponse)
 async def precheck_application(request: PreCheckRequest):
     """
@@ -292,67 +358,7 @@ async def precheck_application(request: PreCheckRequest):
     返回审核结果、风险等级和建议
     """
     try:
-        # 获取宠物信息
-        pet_res = supabase.table("pets").select("*").eq("id", request.pet_id).execute()
-        if not pet_res.data:
-            raise HTTPException(status_code=404, detail="宠物不存在")
-        
-        pet_data = pet_res.data[0]
-        tags = pet_data.get("tags", []) or []
-        
-        pet = PetProfile(
-            id=pet_data["id"],
-            name=pet_data["name"],
-            species=pet_data.get("category", "dog"),
-            breed=pet_data.get("breed", ""),
-            age_months=pet_data.get("age_value", 12),
-            size=_estimate_size(pet_data.get("weight", "10kg")),
-            energy_level=_estimate_energy_level(pet_data.get("age_value", 12), tags),
-            temperament=tags,
-            special_needs=[],
-            good_with_kids=True,
-            good_with_pets=True,
-            training_level="basic"
-        )
-        
-        # 创建用户画像
-        user_profile = UserProfile(
-            living_space=request.user_profile.get("living_space", ""),
-            experience_level=request.user_profile.get("experience_level", ""),
-            daily_time_available=request.user_profile.get("daily_time_available", 2),
-            family_status=request.user_profile.get("family_status", ""),
-            other_pets=request.user_profile.get("other_pets", []),
-            activity_level=request.user_profile.get("activity_level", ""),
-            preferences=request.user_profile.get("preferences", {})
-        )
-        
-        # 获取用户历史申请
-        history_res = supabase.table("applications").select("*").eq("user_id", request.application_data.get("user_id")).execute()
-        user_history = history_res.data if history_res.data else []
-        
-        # 执行预审
-        precheck_result = await ai_service.precheck_application(
-            application_data=request.application_data,
-            user_profile=user_profile,
-            pet=pet,
-            user_history=user_history
-        )
-        
-        # 生成审核报告
-        review_report = await ai_service.generate_review_report(
-            application_id=request.application_id,
-            precheck_result=precheck_result
-        )
-        
-        return PreCheckResponse(
-            passed=precheck_result.passed,
-            score=precheck_result.score,
-            risk_level=precheck_result.risk_level,
-            risk_points=precheck_result.risk_points,
-            suggestions=precheck_result.suggestions,
-            auto_approved=precheck_result.auto_approved,
-            review_report=review_report
-        )
+        return await _run_precheck(request)
     
     except HTTPException:
         raise
@@ -361,6 +367,31 @@ async def precheck_application(request: PreCheckRequest):
         raise HTTPException(status_code=500, detail=f"AI 服务错误: {str(e)}")
 
 
+@router.post("/precheck/async")
+async def precheck_application_async(request: PreCheckRequest):
+    """
+    异步 AI 预审：立即返回任务 ID，预审与审核报告在后台任务队列中生成
+    
+    结果写入 ai_precheck_results，可通过 /precheck/status/{application_id} 查询，
+    任务进度可通过 /api/jobs/{job_id} 查询
+    """
+    job_id = await job_queue.enqueue_async("ai.precheck", request.model_dump())
+    return {"status": "queued", "job_id": job_id, "application_id": request.application_id}
+
+
+@job_queue.register("ai.precheck")
+async def precheck_job(payload: dict):
+    """后台预审任务：执行预审并保存结果"""
+    request = PreCheckRequest(**payload)
+    result = await _run_precheck(request)
+    
+    record = result.model_dump()
+    record["score"] = int(round(result.score))
+    record["application_id"] = request.application_id
+    await async_supabase.table("ai_precheck_results").upsert(record, on_conflict="application_id").execute()
+    logger.info(f"后台预审完成: application_id={request.application_id}")
+
+
 @router.get("/precheck/status/{application_id}")
 async def get_precheck_status(application_id: str):
     """
@@ -368,7 +399,7 @@ async def get_precheck_status(application_id: str):
     """
     try:
         # 从数据库获取预审结果
-        result_res = supabase.table("ai_precheck_results").select("*").eq("application_id", application_id).execute()
+        result_res = await async_supabase.table("ai_precheck_results").select("*").eq("application_id", application_id).execute()
         
         if not result_res.data:
             return {"status": "pending", "message": "预审尚未完成"}
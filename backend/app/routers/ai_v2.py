@@ -15,7 +15,7 @@ from app.models.profile_schema import (
     AdopterProfile, PetProfile, MatchResult, 
     AdoptionFeedback
 )
-from app.database import supabase
+from app.database import async_supabase
 from app.services.longcat_service import longcat_service
 
 logger = logging.getLogger(__name__)
@@ -384,7 +384,7 @@ async def get_match_recommendations(request: MatchRequest):
     """智能匹配推荐"""
     try:
         # 获取所有可领养宠物
-        pets_res = supabase.table("pets").select("*").eq("is_adopted", False).execute()
+        pets_res = await async_supabase.table("pets").select("*").eq("is_adopted", False).execute()
         
         if not pets_res.data:
             return []
@@ -1,8 +1,14 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from typing import List
 from app.database import supabase
 from app.constants import TEST_USER_ID
 from app.models.applications_schema import ApplicationCreate, Application
+from app.services.job_queue import job_queue
+from app.services.dataloader import Loaders, get_loaders
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/applications", tags=["applications"])
 
@@ -24,87 +30,18 @@ def create_application(application: ApplicationCreate):
     
     new_app = response.data[0]
     
-    # 2. Auto-Reply Logic
-    try:
-        print(f"DEBUG: Starting auto-reply for pet_id={app_data['pet_id']}, user_id={app_data['user_id']}")
-        # Fetch Pet Owner (Coordinator)
-        pet_res = supabase.table("pets").select("owner_id").eq("id", app_data['pet_id']).single().execute()
-        if pet_res.data:
-            owner_id = pet_res.data['owner_id']
-            user_id = app_data['user_id']
-            print(f"DEBUG: Found owner_id={owner_id}")
-            
-            # Check for existing conversation
-            # Note: We use .select("*") and then filter, or better yet, just use eq
-            conv_res = supabase.table("conversations").select("id")\
-                .eq("user_id", user_id)\
-                .eq("pet_id", app_data['pet_id'])\
-                .execute()
-                
-            conversation_id = None
-            if conv_res.data and len(conv_res.data) > 0:
-                conversation_id = conv_res.data[0]['id']
-                print(f"DEBUG: Found existing conversation_id={conversation_id}")
-            else:
-                # Create new conversation
-                print("DEBUG: Creating new conversation")
-                new_conv = {
-                    "user_id": user_id,
-                    "pet_id": app_data['pet_id']
-                }
-                conv_insert = supabase.table("conversations").insert(new_conv).execute()
-                if conv_insert.data and len(conv_insert.data) > 0:
-                    conversation_id = conv_insert.data[0]['id']
-                    print(f"DEBUG: Created new conversation_id={conversation_id}")
-            
-            # Send Auto-Reply
-            if conversation_id:
-                print(f"DEBUG: Sending message to conversation_id={conversation_id}")
-                
-                # 获取申请人信息，使回复更个性化
-                user_res = supabase.table("users").select("name").eq("id", user_id).single().execute()
-                applicant_name = user_res.data.get('name', '申请人') if user_res.data else '申请人'
-                
-                # 获取宠物信息
-                pet_res = supabase.table("pets").select("name").eq("id", app_data['pet_id']).single().execute()
-                pet_name = pet_res.data.get('name', '宠物') if pet_res.data else '宠物'
-                
-                message = {
-                    "conversation_id": conversation_id,
-                    "sender_id": owner_id,
-                    "content": f"您好{applicant_name}！感谢您对{pet_name}的领养申请。我已经收到了您的申请，会尽快进行审核。请随时通过这里与我沟通，了解更多信息。",
-                    "read": False
-                }
-                supabase.table("messages").insert(message).execute()
-                print("DEBUG: Auto-reply message inserted successfully")
-                
-                # 更新对话时间戳，确保显示在列表顶部
-                supabase.table("conversations").update({"updated_at": "now()"}).eq("id", conversation_id).execute()
-                print("DEBUG: Conversation timestamp updated")
-            else:
-                print("DEBUG: FAILED to get or create conversation_id")
-        else:
-            print("DEBUG: FAILED to find pet owner")
-                
-    except Exception as e:
-        print(f"Auto-reply failed: {e}")
-        import traceback
-        traceback.print_exc()
-        # Continue even if auto-reply fails, as the application itself was successful
-        
-    # 3. 实时通知送养人
-    try:
-        # 获取送养人的所有活跃对话
-        owner_conv_res = supabase.table("conversations").select("id, updated_at").eq("user_id", owner_id).execute()
-        
-        # 更新所有对话的时间戳，确保新申请显示在顶部
-        if owner_conv_res.data:
-            for conv in owner_conv_res.data:
-                supabase.table("conversations").update({"updated_at": "now()"}).eq("id", conv['id']).execute()
-        
-        print("DEBUG: Owner conversation timestamps updated for real-time notification")
-    except Exception as e:
-        print(f"DEBUG: Failed to update owner conversation timestamps: {e}")
+    # 2. 自动回复与送养人通知放入后台任务队列，不阻塞请求；
+    # 申请已经创建成功，任务日志写入失败只记录错误，不影响响应（否则客户端重试会重复创建）
+    job_payload = {
+        "application_id": new_app['id'],
+        "pet_id": app_data['pet_id'],
+        "user_id": app_data['user_id']
+    }
+    for job_name in ("applications.auto_reply", "applications.notify_owner"):
+        try:
+            job_queue.enqueue(job_name, job_payload)
+        except Exception as e:
+            logger.error(f"后台任务提交失败: {job_name}, application_id={new_app['id']}: {e}")
         
     return new_app
 
@@ -217,7 +154,7 @@ def delete_application(id: str, user_id: str = None):
     return {"status": "success", "message": "领养记录已删除"}
 
 @router.get("/notifications", response_model=List[dict])
-def get_notifications(user_id: str = None):
+def get_notifications(user_id: str = None, loaders: Loaders = Depends(get_loaders)):
     """
     获取送养人的实时通知
     """
@@ -238,14 +175,16 @@ def get_notifications(user_id: str = None):
         .limit(10)\
         .execute()
     
+    # 一次查询批量获取所有申请人信息
+    applicants = loaders.users.load_many_sync(app['user_id'] for app in recent_apps_res.data)
+    pets_by_id = {p['id']: p for p in pets_res.data}
+    
     notifications = []
-    for app in recent_apps_res.data:
-        # 获取申请人信息
-        user_res = supabase.table("users").select("name").eq("id", app['user_id']).single().execute()
-        applicant_name = user_res.data.get('name', '申请人') if user_res.data else '申请人'
+    for app, applicant in zip(recent_apps_res.data, applicants):
+        applicant_name = applicant.get('name', '申请人') if applicant else '申请人'
         
         # 获取宠物信息
-        pet_info = next((p for p in pets_res.data if p['id'] == app['pet_id']), None)
+        pet_info = pets_by_id.get(app['pet_id'])
         pet_name = pet_info.get('name', '宠物') if pet_info else '宠物'
         
         notifications.append({
@@ -259,4 +198,85 @@ def get_notifications(user_id: str = None):
             "applicant_id": app['user_id']
         })
     
-    return notifications
\ No newline at end of file
+    return notifications
+
+
+# ==================== 后台任务 ====================
+
+def auto_reply_message_id(application_id: str) -> str:
+    """申请的自动回复消息 ID"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"applications.auto_reply:{application_id}"))
+
+
+@job_queue.register("applications.auto_reply")
+def auto_reply_job(payload: dict):
+    """
+    申请提交后的自动回复：找到（或创建）申请人与送养人的对话并发送欢迎消息
+
+    消息 ID 由申请 ID 确定，重试或重启后重新执行时 upsert 同一条消息，不会重复发送
+    """
+    pet_id = payload['pet_id']
+    user_id = payload['user_id']
+    logger.info(f"开始自动回复: pet_id={pet_id}, user_id={user_id}")
+
+    # Fetch Pet Owner (Coordinator)
+    pet_res = supabase.table("pets").select("owner_id, name").eq("id", pet_id).single().execute()
+    if not pet_res.data:
+        logger.warning(f"自动回复跳过，未找到宠物主人: pet_id={pet_id}")
+        return
+    owner_id = pet_res.data['owner_id']
+    pet_name = pet_res.data.get('name') or '宠物'
+
+    # Check for existing conversation
+    conv_res = supabase.table("conversations").select("id")\
+        .eq("user_id", user_id)\
+        .eq("pet_id", pet_id)\
+        .execute()
+
+    conversation_id = None
+    if conv_res.data:
+        conversation_id = conv_res.data[0]['id']
+    else:
+        conv_insert = supabase.table("conversations").insert({
+            "user_id": user_id,
+            "pet_id": pet_id
+        }).execute()
+        if conv_insert.data:
+            conversation_id = conv_insert.data[0]['id']
+
+    if not conversation_id:
+        # 抛出异常以触发重试
+        raise RuntimeError(f"无法获取或创建对话: user_id={user_id}, pet_id={pet_id}")
+
+    # 获取申请人信息，使回复更个性化
+    user_res = supabase.table("users").select("name").eq("id", user_id).single().execute()
+    applicant_name = user_res.data.get('name', '申请人') if user_res.data else '申请人'
+
+    supabase.table("messages").upsert({
+        "id": auto_reply_message_id(payload['application_id']),
+        "conversation_id": conversation_id,
+        "sender_id": owner_id,
+        "content": f"您好{applicant_name}！感谢您对{pet_name}的领养申请。我已经收到了您的申请，会尽快进行审核。请随时通过这里与我沟通，了解更多信息。",
+        "read": False
+    }, ignore_duplicates=True).execute()
+
+    # 更新对话时间戳，确保显示在列表顶部
+    supabase.table("conversations").update({"updated_at": "now()"}).eq("id", conversation_id).execute()
+    logger.info(f"自动回复已发送: conversation_id={conversation_id}")
+
+
+@job_queue.register("applications.notify_owner")
+def notify_owner_job(payload: dict):
+    """
+    实时通知送养人：刷新送养人所有对话的时间戳，确保新申请显示在顶部
+    """
+    pet_res = supabase.table("pets").select("owner_id").eq("id", payload['pet_id']).single().execute()
+    if not pet_res.data:
+        return
+    owner_id = pet_res.data['owner_id']
+
+    owner_conv_res = supabase.table("conversations").select("id").eq("user_id", owner_id).execute()
+    conv_ids = [conv['id'] for conv in owner_conv_res.data or []]
+    if conv_ids:
+        supabase.table("conversations").update({"updated_at": "now()"}).in_("id", conv_ids).execute()
+    logger.info(f"送养人 {owner_id} 的对话时间戳已更新")
@@ -1,18 +1,98 @@
-from fastapi import APIRouter, HTTPException, Depends
-from app.database import supabase
+from fastapi import APIRouter, HTTPException, Depends, Request
+from contextlib import asynccontextmanager
+import math
+import os
+from app.database import async_supabase
 from app.models.schemas import UserCreate, UserLogin, Token, User
-from app.auth_utils import get_password_hash, verify_password, create_access_token
+from app.auth_utils import (
+    get_password_hash_async, verify_password_async, create_access_token,
+    get_current_admin, principal_cache, token_cache
+)
+from app.services.password_hasher import password_hasher
+from app.services.rate_limiter import TokenBucketLimiter
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
+# bcrypt 在独立进程池中执行，数据库查询走异步数据访问层，
+# 路由本身是异步的，不再占用同步接口共用的线程池等待哈希结果
+
+# ==================== 准入控制 ====================
+# 撞库/注册洪峰会让服务器满负荷跑 bcrypt，在任何查库和哈希之前先做廉价的限流检查
+
+# 每个 IP：桶容量（突发量）与每分钟补充量
+AUTH_IP_BURST = float(os.getenv("AUTH_IP_BURST", "20"))
+AUTH_IP_PER_MINUTE = float(os.getenv("AUTH_IP_PER_MINUTE", "20"))
+# 每个邮箱
+AUTH_EMAIL_BURST = float(os.getenv("AUTH_EMAIL_BURST", "5"))
+AUTH_EMAIL_PER_MINUTE = float(os.getenv("AUTH_EMAIL_PER_MINUTE", "5"))
+# 全局同时进行的哈希运算上限（只覆盖哈希本身，数据库变慢不会占满名额）
+AUTH_MAX_IN_FLIGHT = int(os.getenv("AUTH_MAX_IN_FLIGHT", "32"))
+# 部署在反向代理后时，从 X-Forwarded-For 读取客户端 IP
+AUTH_TRUST_PROXY_HEADERS = os.getenv("AUTH_TRUST_PROXY_HEADERS", "false").lower() == "true"
+
+ip_limiter = TokenBucketLimiter("auth_ip", rate=AUTH_IP_PER_MINUTE / 60, capacity=AUTH_IP_BURST)
+email_limiter = TokenBucketLimiter("auth_email", rate=AUTH_EMAIL_PER_MINUTE / 60, capacity=AUTH_EMAIL_BURST)
+
+_auth_in_flight = 0
+_auth_overloaded = 0
+
+
+def _client_ip(request: Request) -> str:
+    if AUTH_TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def _too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many attempts, please retry later",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def _admit(request: Request, email: str):
+    """按 IP 和邮箱限流，被拒绝时抛出 429"""
+    allowed, retry_after = ip_limiter.check(_client_ip(request))
+    if not allowed:
+        raise _too_many_requests(retry_after)
+    
+    allowed, retry_after = email_limiter.check(email.strip().lower())
+    if not allowed:
+        raise _too_many_requests(retry_after)
+
+
+@asynccontextmanager
+async def _auth_slot():
+    """占用一个全局哈希运算名额，已满时直接返回 503"""
+    global _auth_in_flight, _auth_overloaded
+    if _auth_in_flight >= AUTH_MAX_IN_FLIGHT:
+        _auth_overloaded += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    _auth_in_flight += 1
+    try:
+        yield
+    finally:
+        _auth_in_flight -= 1
+
+
 @router.post("/register", response_model=User)
-def register(user: UserCreate):
+async def register(request: Request, user: UserCreate):
+    _admit(request, user.email)
+    
     # Check if user exists
-    existing = supabase.table("users").select("*").eq("email", user.email).execute()
+    existing = await async_supabase.table("users").select("*").eq("email", user.email).execute()
     if existing.data:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = get_password_hash(user.password)
+    async with _auth_slot():
+        hashed_password = await get_password_hash_async(user.password)
     new_user = {
         "email": user.email,
         "password_hash": hashed_password,
@@ -21,28 +101,53 @@ def register(user: UserCreate):
         "avatar_url": user.avatar_url
     }
 
-    response = supabase.table("users").insert(new_user).execute()
+    response = await async_supabase.table("users").insert(new_user).execute()
     if not response.data:
          raise HTTPException(status_code=500, detail="Failed to register user")
     
     return response.data[0]
 
 @router.post("/login", response_model=Token)
-def login(user_credentials: UserLogin):
+async def login(request: Request, user_credentials: UserLogin):
+    _admit(request, user_credentials.email)
+    
     # Get user
-    response = supabase.table("users").select("*").eq("email", user_credentials.email).execute()
+    response = await async_supabase.table("users").select("*").eq("email", user_credentials.email).execute()
     if not response.data:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     user = response.data[0]
-    if not verify_password(user_credentials.password, user['password_hash']):
+    async with _auth_slot():
+        verified = await verify_password_async(user_credentials.password, user['password_hash'])
+    if not verified:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-        
+    
     # Create token
-    access_token = create_access_token(data={"sub": user['id'], "role": user['role']})
+    access_token = create_access_token(data={
+        "sub": user['id'],
+        "email": user['email'],
+        "name": user.get('name'),
+        "role": user['role']
+    })
     
     return {
         "access_token": access_token, 
         "token_type": "bearer",
         "user": user
     }
+
+@router.get("/metrics")
+async def get_auth_metrics(admin = Depends(get_current_admin)):
+    """密码哈希进程池、准入控制、principal 缓存与 token 缓存指标（仅管理员，避免暴露限流状态）"""
+    return {
+        "password_hasher": password_hasher.stats(),
+        "admission": {
+            "in_flight": _auth_in_flight,
+            "max_in_flight": AUTH_MAX_IN_FLIGHT,
+            "overloaded": _auth_overloaded,
+            "ip_limiter": ip_limiter.stats(),
+            "email_limiter": email_limiter.stats()
+        },
+        "principal_cache": principal_cache.stats(),
+        "token_cache": token_cache.stats()
+    }
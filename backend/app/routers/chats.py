@@ -1,24 +1,16 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from typing import List
-from app.database import supabase
+from app.database import supabase, async_supabase
 from app.constants import TEST_USER_ID
 from app.models.schemas import ChatSession, Message, MessageCreate
+from app.services.dataloader import Loaders, get_loaders
+from app.services.realtime_hub import realtime_hub
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/chats", tags=["chats"])
 
-# SSE 管理器引用（将在 main.py 中设置）
-sse_manager = None
-
-
-def set_sse_manager(manager):
-    """设置 SSE 管理器"""
-    global sse_manager
-    sse_manager = manager
-
-
 @router.get("/", response_model=List[ChatSession])
 def get_chats(user_id: str = None):
     # Use provided user_id or fallback to TEST_USER_ID
@@ -120,15 +112,14 @@ def get_chats(user_id: str = None):
 
 
 @router.get("/{id}/messages", response_model=List[Message])
-def get_messages(id: str, user_id: str = None):
+def get_messages(id: str, user_id: str = None, loaders: Loaders = Depends(get_loaders)):
     target_id = user_id if user_id else TEST_USER_ID
     
     # 获取对话信息以确定参与者角色
-    conv_res = supabase.table("conversations").select("*, pets!inner(*)").eq("id", id).execute()
-    if not conv_res.data:
+    conv = loaders.conversations.load_sync(id)
+    if not conv:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    conv = conv_res.data[0]
     pet_owner_id = conv['pets']['owner_id']
     applicant_id = conv['user_id']
     
@@ -156,44 +147,40 @@ def get_messages(id: str, user_id: str = None):
 
 
 @router.put("/{id}/read")
-async def mark_as_read(id: str, user_id: str = None):
+async def mark_as_read(id: str, user_id: str = None, loaders: Loaders = Depends(get_loaders)):
     target_id = user_id if user_id else TEST_USER_ID
     
     # 获取对话信息
-    conv_res = supabase.table("conversations").select("*, pets!inner(*)").eq("id", id).execute()
-    if not conv_res.data:
+    if not await loaders.conversations.load(id):
         raise HTTPException(status_code=404, detail="Conversation not found")
     
     # 标记消息为已读
-    response = supabase.table("messages")\
+    response = await async_supabase.table("messages")\
         .update({"read": True})\
         .eq("conversation_id", id)\
         .neq("sender_id", target_id)\
         .execute()
     
-    # 通过 SSE 广播已读状态
-    if sse_manager:
-        await sse_manager.broadcast_to_chat(id, {
-            "type": "messages_read",
-            "chat_id": id,
-            "user_id": target_id,
-            "count": len(response.data) if response.data else 0
-        })
+    # 广播已读状态（WebSocket 与 SSE 客户端）
+    await realtime_hub.broadcast_to_chat(id, {
+        "type": "messages_read",
+        "chat_id": id,
+        "user_id": target_id,
+        "count": len(response.data) if response.data else 0
+    })
         
     return {"status": "success", "updated_count": len(response.data) if response.data else 0}
 
 
 @router.post("/{id}/messages")
-async def send_message(id: str, message: MessageCreate, user_id: str = None):
+async def send_message(id: str, message: MessageCreate, user_id: str = None, loaders: Loaders = Depends(get_loaders)):
     target_id = user_id if user_id else TEST_USER_ID
     
     # 获取对话信息
-    conv_res = supabase.table("conversations").select("*, pets!inner(*)").eq("id", id).execute()
-    if not conv_res.data:
+    conv = await loaders.conversations.load(id)
+    if not conv:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    conv = conv_res.data[0]
-    
     data = {
         "conversation_id": id,
         "sender_id": target_id,
@@ -202,35 +189,34 @@ async def send_message(id: str, message: MessageCreate, user_id: str = None):
     }
     
     # 保存消息
-    response = supabase.table("messages").insert(data).execute()
+    response = await async_supabase.table("messages").insert(data).execute()
     
     if response.data:
         message_record = response.data[0]
         
         # 更新对话时间
-        supabase.table("conversations").update({
+        await async_supabase.table("conversations").update({
             "updated_at": "now()"
         }).eq("id", id).execute()
         
-        # 通过 SSE 广播新消息
-        if sse_manager:
-            await sse_manager.broadcast_to_chat(id, {
-                "type": "new_message",
-                "chat_id": id,
-                "message": {
-                    "id": message_record["id"],
-                    "sender_id": target_id,
-                    "text": message.text,
-                    "timestamp": message_record["created_at"],
-                    "isRead": False
-                }
-            })
-            
-            # 通知聊天列表更新
-            await sse_manager.broadcast_to_chat(id, {
-                "type": "chat_updated",
-                "chat_id": id
-            })
+        # 广播新消息（WebSocket 与 SSE 客户端）
+        await realtime_hub.broadcast_to_chat(id, {
+            "type": "new_message",
+            "chat_id": id,
+            "message": {
+                "id": message_record["id"],
+                "sender_id": target_id,
+                "text": message.text,
+                "timestamp": message_record["created_at"],
+                "isRead": False
+            }
+        })
+        
+        # 通知聊天列表更新
+        await realtime_hub.broadcast_to_chat(id, {
+            "type": "chat_updated",
+            "chat_id": id
+        })
     
     return response.data
 
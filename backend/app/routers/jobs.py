@@ -0,0 +1,24 @@
+"""
+后台任务路由
+查询任务队列状态与单个任务进度
+"""
+from fastapi import APIRouter, HTTPException
+from app.services.job_queue import job_queue
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+
+# 同步路由：任务日志查询在线程池中执行，不阻塞事件循环
+@router.get("/")
+def get_job_queue_stats():
+    """任务队列统计：worker 数、队列深度、各状态任务数"""
+    return job_queue.stats()
+
+
+@router.get("/{job_id}")
+def get_job_status(job_id: str):
+    """查询单个任务状态"""
+    job = job_queue.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
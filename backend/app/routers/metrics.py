@@ -0,0 +1,28 @@
+"""
+运行指标路由
+"""
+from fastapi import APIRouter
+from app.services.db_metrics import db_metrics
+from app.services.http_pool import http_pool
+from app.database import storage_backend
+
+router = APIRouter(prefix="/api/metrics", tags=["metrics"])
+
+
+@router.get("/db")
+async def get_db_metrics():
+    """数据库调用指标：按表统计次数/耗时，按接口统计查询次数与 N+1 次数"""
+    return db_metrics.snapshot()
+
+
+@router.get("/storage")
+async def get_storage_metrics():
+    """存储后端指标：熔断器状态、过期数据兜底次数、超时次数等"""
+    stats = storage_backend.stats() if hasattr(storage_backend, "stats") else {}
+    return {"backend": storage_backend.name, **stats}
+
+
+@router.get("/http")
+async def get_http_metrics():
+    """出站 HTTP 连接池指标：连接数、空闲连接、按主机的并发与排队情况"""
+    return http_pool.stats()
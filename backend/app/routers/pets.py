@@ -1,7 +1,12 @@
 from fastapi import APIRouter, HTTPException
 from typing import List
-from app.database import supabase
+from app.database import supabase, async_supabase
 from app.models.schemas import Pet, PetCreate
+from app.services.job_queue import job_queue
+from app.services.embedding_service import embedding_service, pet_profile_to_text
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/pets", tags=["pets"])
 
@@ -30,6 +35,12 @@ def create_pet(pet: PetCreate):
         print(f"DEBUG: Exception in create_pet: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     
+    # 宠物档案向量在后台计算；宠物已经创建成功，任务提交失败只记录错误
+    try:
+        job_queue.enqueue("pets.embedding", {"pet_id": item['id']})
+    except Exception as e:
+        logger.error(f"宠物向量任务提交失败: pet_id={item['id']}: {e}")
+    
     # Transformation to match Pet response model
     if 'age_text' in item:
         item['age'] = item.pop('age_text') or '未知'
@@ -201,4 +212,30 @@ def delete_pet(pet_id: str):
     if hasattr(response, 'error') and response.error:
         raise HTTPException(status_code=500, detail=str(response.error))
         
-    return {"message": "Pet deleted successfully"}
\ No newline at end of file
+    return {"message": "Pet deleted successfully"}
+
+
+@job_queue.register("pets.embedding")
+async def pet_embedding_job(payload: dict):
+    """
+    后台任务：计算宠物档案向量并写入 pets.pet_embedding
+    
+    模型 / API 不可用时抛出异常由任务队列重试，不写入降级的随机或零向量
+    """
+    pet_res = await async_supabase.table("pets").select("*").eq("id", payload['pet_id']).execute()
+    if not pet_res.data:
+        return
+    
+    pet = pet_res.data[0]
+    text = pet_profile_to_text({
+        "breed": pet.get("breed", ""),
+        "age_months": pet.get("age_value") or 0,
+        "size_category": pet.get("size_category"),
+        "temperament": pet.get("tags") or [],
+        "energy_level": pet.get("energy_level"),
+        "shedding_level": pet.get("shedding_level"),
+        "good_with_kids": pet.get("good_with_kids"),
+        "good_with_dogs": pet.get("good_with_dogs")
+    })
+    embedding = await embedding_service.get_embedding(text, strict=True)
+    await async_supabase.table("pets").update({"pet_embedding": embedding}).eq("id", pet['id']).execute()
@@ -1,124 +1,352 @@
 """
 Server-Sent Events (SSE) 路由
 用于 Vercel 等不支持 WebSocket 的环境
+
+聊天室订阅、用户索引与广播由实时推送中心负责（与 WebSocket 共用，见 app/services/realtime_hub.py），
+这里是 SSE 传输层的适配：推送给聊天室 / 用户的消息同时到达 WebSocket 与 SSE 客户端。
+
+同一用户可以同时保持多个连接（多个标签页 / 设备），每个连接有自己的订阅和有界事件队列。
+队列满（客户端接收过慢）时按 SSE_OVERFLOW_POLICY 处理：
+- drop_oldest: 丢弃最旧的事件，保留最新的（默认）
+- disconnect: 断开该连接，由 EventSource 自动重连
+
+推送中心的聊天室索引直接记录订阅了该聊天室的连接，广播只触达这些连接；
+每条事件只编码一次 SSE 帧，所有接收者的队列与重放缓冲共享同一个字符串。
+
+推送事件带递增的事件 ID，并按用户 / 聊天室保留最近的事件（见 app/services/event_replay.py）。
+客户端重连时带上 Last-Event-ID 请求头（或 last_event_id 参数）和要订阅的聊天室（chats 参数），
+服务器只重放遗漏的事件；无法确认没有遗漏时推送 resync 事件，由客户端全量同步。
+
+心跳集中在一个后台协程：连接按下一次到期时间挂在时间轮上（与 WebSocket 相同），
+超过 SSE_HEARTBEAT_INTERVAL 没有写出任何数据的连接写入一个预先编码的注释帧。
+不再逐个连接轮询 request.is_disconnected()：客户端断开后写出失败，响应随即结束并清理连接。
 """
 from fastapi import APIRouter, Request, Query
 from fastapi.responses import StreamingResponse
-from typing import Optional, Dict, Set
+from typing import Optional, Dict, List, Set
+import os
+import time
+import uuid
 import asyncio
 import json
 import logging
 from datetime import datetime
 
+from app.services.realtime_hub import realtime_hub
+from app.services.presence import presence, PRESENCE_PAGE_SIZE
+from app.services.event_replay import ReplayBuffer
+from app.websocket import TimerWheel
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/sse", tags=["sse"])
 
-# 存储客户端连接
-# user_id -> Queue
-clients: Dict[str, asyncio.Queue] = {}
+# 每个连接最多积压的待发送事件数
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "256"))
+# 队列满时的处理方式：drop_oldest / disconnect
+SSE_OVERFLOW_POLICY = os.getenv("SSE_OVERFLOW_POLICY", "drop_oldest").lower()
+if SSE_OVERFLOW_POLICY not in ("drop_oldest", "disconnect"):
+    raise ValueError(f"未知的 SSE_OVERFLOW_POLICY: {SSE_OVERFLOW_POLICY}（可选 drop_oldest / disconnect）")
+# 连接空闲多久（秒）写入心跳，需小于代理的空闲超时
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "25"))
+# 心跳时间轮的刻度（秒）
+SSE_HEARTBEAT_TICK = float(os.getenv("SSE_HEARTBEAT_TICK", "1"))
+
+# 心跳帧：SSE 注释行，EventSource 不会触发 onmessage；所有连接共用同一个字符串
+HEARTBEAT_FRAME = ": heartbeat\n\n"
+
+
+def encode_event(data: dict, event_id: Optional[int] = None) -> str:
+    """把事件编码成 SSE 帧；不带事件 ID 的帧（连接、心跳、presence）不会改变客户端的 Last-Event-ID"""
+    if event_id is None:
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return f"id: {event_id}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class SSEConnection:
+    """单个 SSE 连接：订阅的聊天室、有界事件队列（已编码的帧）与计数"""
+
+    wire = "sse"
+
+    def __init__(self, user_id: str, queue_size: int = SSE_QUEUE_SIZE, policy: str = SSE_OVERFLOW_POLICY):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        # 订阅的聊天室（由推送中心维护）
+        self.chats: Set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.policy = policy
+        self.closed = False
+        self.connected_at = time.time()
+        # 最后一次写出数据的时间
+        self.last_sent = time.monotonic()
+        # 计数：入队 / 因队列满丢弃 / 已写出
+        self.enqueued = 0
+        self.dropped = 0
+        self.delivered = 0
 
-# 用户订阅的聊天室
-# user_id -> Set[chat_id]
-user_chats: Dict[str, Set[str]] = {}
+    def put(self, frame: str) -> bool:
+        """放入一个已编码的帧，不等待；按 disconnect 策略处理队列满时返回 False"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.policy == "disconnect":
+                return False
+            self.queue.get_nowait()
+            self.queue.put_nowait(frame)
+        self.enqueued += 1
+        return True
+
+    def deliver(self, frame: str):
+        """推送中心投递已编码的帧；disconnect 策略下队列满即断开"""
+        if not self.put(frame) and not self.closed:
+            SSEManager.overflow_disconnects += 1
+            logger.warning(f"SSE 用户 {self.user_id} 接收过慢（积压 {self.queue.maxsize} 条），断开连接")
+            SSEManager.disconnect(self)
+
+    def heartbeat(self) -> bool:
+        """队列为空时放入心跳帧；队列非空说明马上就会写出数据，不需要心跳"""
+        if self.closed or not self.queue.empty():
+            return False
+        self.queue.put_nowait(HEARTBEAT_FRAME)
+        return True
+
+    def wake(self):
+        """连接被关闭时唤醒等待队列的事件生成器"""
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            # 队列非空，生成器取出下一帧后会检查 closed
+            pass
+
+    def stats(self) -> Dict:
+        return {
+            "connection_id": self.id,
+            "user_id": self.user_id,
+            "chats": sorted(self.chats),
+            "connected_at": datetime.fromtimestamp(self.connected_at).isoformat(),
+            "queue_depth": self.queue.qsize(),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "delivered": self.delivered
+        }
+
+
+# 存储客户端连接（按 user_id / connection_id 查找本 worker 的 SSE 连接；聊天室索引在推送中心）
+# user_id -> Set[SSEConnection]
+clients: Dict[str, Set[SSEConnection]] = {}
+
+# connection_id -> SSEConnection
+connections: Dict[str, SSEConnection] = {}
+
+# 重放缓冲：推送中心记录每条聊天室 / 用户事件已编码的 SSE 帧
+replay_buffer = ReplayBuffer()
+realtime_hub.register_encoder(SSEConnection.wire, encode_event)
+realtime_hub.add_recorder(
+    lambda stream, event_id, exclude_user_id, encoded:
+        replay_buffer.append(stream, event_id, encoded(SSEConnection.wire), exclude_user_id)
+)
 
 
 class SSEManager:
     """SSE 连接管理器"""
+
+    # 已关闭连接的累计计数（活动连接的计数在各连接上）
+    closed_enqueued = 0
+    closed_dropped = 0
+    closed_delivered = 0
+    overflow_disconnects = 0
+    heartbeats_sent = 0
+    
+    # 所有连接共用的心跳时间轮与后台协程
+    heartbeat_wheel = TimerWheel(SSE_HEARTBEAT_TICK, SSE_HEARTBEAT_INTERVAL)
+    _heartbeat_task: Optional[asyncio.Task] = None
+    
+    @staticmethod
+    def connect(user_id: str) -> SSEConnection:
+        """建立 SSE 连接（同一用户的已有连接保持不变）"""
+        connection = SSEConnection(user_id)
+        clients.setdefault(user_id, set()).add(connection)
+        connections[connection.id] = connection
+        realtime_hub.register(connection)
+        SSEManager.heartbeat_wheel.schedule(connection, connection.last_sent + SSE_HEARTBEAT_INTERVAL)
+        if SSEManager._heartbeat_task is None:
+            SSEManager._heartbeat_task = asyncio.create_task(SSEManager._heartbeat_loop())
+        logger.info(f"SSE 用户 {user_id} 已连接，该用户连接数: {len(clients[user_id])}，总连接数: {len(connections)}")
+        return connection
     
     @staticmethod
-    def connect(user_id: str) -> asyncio.Queue:
-        """建立 SSE 连接"""
-        queue = asyncio.Queue()
-        clients[user_id] = queue
-        user_chats[user_id] = set()
-        logger.info(f"SSE 用户 {user_id} 已连接，当前在线: {len(clients)}")
-        return queue
+    def disconnect(connection: SSEConnection):
+        """断开 SSE 连接（重复调用无副作用）"""
+        if connection.closed:
+            return
+        connection.closed = True
+        connection.wake()
+        SSEManager.heartbeat_wheel.remove(connection)
+        user_id = connection.user_id
+        connections.pop(connection.id, None)
+        user_connections = clients.get(user_id)
+        if user_connections is not None:
+            user_connections.discard(connection)
+            if not user_connections:
+                del clients[user_id]
+        realtime_hub.unregister(connection)
+        SSEManager.closed_enqueued += connection.enqueued
+        SSEManager.closed_dropped += connection.dropped
+        SSEManager.closed_delivered += connection.delivered
+        logger.info(f"SSE 用户 {user_id} 的连接已断开，总连接数: {len(connections)}")
     
     @staticmethod
-    def disconnect(user_id: str):
-        """断开 SSE 连接"""
-        if user_id in clients:
-            del clients[user_id]
-        if user_id in user_chats:
-            del user_chats[user_id]
-        logger.info(f"SSE 用户 {user_id} 已断开，当前在线: {len(clients)}")
+    def _targets(user_id: str, connection_id: Optional[str]) -> List[SSEConnection]:
+        """指定 connection_id 时只作用于该连接，否则作用于该用户的所有连接"""
+        if connection_id:
+            connection = connections.get(connection_id)
+            return [connection] if connection is not None and connection.user_id == user_id else []
+        return list(clients.get(user_id, ()))
     
     @staticmethod
-    def subscribe(user_id: str, chat_id: str):
+    def subscribe(user_id: str, chat_id: str, connection_id: Optional[str] = None):
         """订阅聊天室"""
-        if user_id in user_chats:
-            user_chats[user_id].add(chat_id)
-            logger.info(f"用户 {user_id} 订阅聊天室 {chat_id}")
+        for connection in SSEManager._targets(user_id, connection_id):
+            realtime_hub.join(connection, chat_id)
+        logger.info(f"用户 {user_id} 订阅聊天室 {chat_id}")
     
     @staticmethod
-    def unsubscribe(user_id: str, chat_id: str):
+    def unsubscribe(user_id: str, chat_id: str, connection_id: Optional[str] = None):
         """取消订阅聊天室"""
-        if user_id in user_chats:
-            user_chats[user_id].discard(chat_id)
-            logger.info(f"用户 {user_id} 取消订阅聊天室 {chat_id}")
+        for connection in SSEManager._targets(user_id, connection_id):
+            realtime_hub.leave(connection, chat_id)
+        logger.info(f"用户 {user_id} 取消订阅聊天室 {chat_id}")
     
     @staticmethod
     async def send_to_user(user_id: str, data: dict):
-        """向指定用户发送消息"""
-        if user_id in clients:
+        """向指定用户发送消息（所有 worker、WebSocket 与 SSE）"""
+        await realtime_hub.send_to_user(user_id, data)
+    
+    @staticmethod
+    async def broadcast_to_chat(chat_id: str, data: dict, exclude_user_id: Optional[str] = None):
+        """向聊天室广播消息（所有 worker、WebSocket 与 SSE）"""
+        await realtime_hub.broadcast_to_chat(chat_id, data, exclude_user_id)
+    
+    @staticmethod
+    async def _heartbeat_loop():
+        """按时间轮刻度推进，给空闲的连接写入心跳"""
+        while True:
+            await asyncio.sleep(SSEManager.heartbeat_wheel.tick)
             try:
-                await clients[user_id].put(data)
+                SSEManager._on_tick(time.monotonic())
             except Exception as e:
-                logger.error(f"向用户 {user_id} 发送消息失败: {e}")
+                logger.error(f"SSE 心跳出错: {e}")
     
     @staticmethod
-    async def broadcast_to_chat(chat_id: str, data: dict, exclude_user_id: Optional[str] = None):
-        """向聊天室广播消息"""
-        for user_id, chats in user_chats.items():
-            if chat_id in chats:
-                if exclude_user_id and user_id == exclude_user_id:
-                    continue
-                await SSEManager.send_to_user(user_id, data)
+    def _on_tick(now: float):
+        wheel = SSEManager.heartbeat_wheel
+        for connection in wheel.advance(now):
+            if connection.closed:
+                continue
+            if now - connection.last_sent >= SSE_HEARTBEAT_INTERVAL:
+                if connection.heartbeat():
+                    SSEManager.heartbeats_sent += 1
+                wheel.schedule(connection, now + SSE_HEARTBEAT_INTERVAL)
+            else:
+                # 期间写出过数据，按最后一次写出的时间重新排期
+                wheel.schedule(connection, connection.last_sent + SSE_HEARTBEAT_INTERVAL)
+    
+    @staticmethod
+    async def stop():
+        """停止心跳协程"""
+        if SSEManager._heartbeat_task is not None:
+            SSEManager._heartbeat_task.cancel()
+            await asyncio.gather(SSEManager._heartbeat_task, return_exceptions=True)
+            SSEManager._heartbeat_task = None
     
     @staticmethod
     def is_user_online(user_id: str) -> bool:
-        """检查用户是否在线"""
-        return user_id in clients
+        """检查用户是否在线（任一 worker、WebSocket 或 SSE）"""
+        return realtime_hub.is_user_online(user_id)
+    
+    @staticmethod
+    def stats() -> Dict:
+        """连接与事件计数（所有连接合计）"""
+        active = list(connections.values())
+        depths = [connection.queue.qsize() for connection in active]
+        return {
+            "connections": len(active),
+            "users": len(clients),
+            "chat_rooms": len({chat_id for c in active for chat_id in c.chats}),
+            "queue_size": SSE_QUEUE_SIZE,
+            "overflow_policy": SSE_OVERFLOW_POLICY,
+            "max_queue_depth": max(depths) if depths else 0,
+            "enqueued": SSEManager.closed_enqueued + sum(c.enqueued for c in active),
+            "dropped": SSEManager.closed_dropped + sum(c.dropped for c in active),
+            "delivered": SSEManager.closed_delivered + sum(c.delivered for c in active),
+            "overflow_disconnects": SSEManager.overflow_disconnects,
+            "heartbeat_interval": SSE_HEARTBEAT_INTERVAL,
+            "heartbeats_sent": SSEManager.heartbeats_sent,
+            "scheduled": len(SSEManager.heartbeat_wheel),
+            "replay": replay_buffer.stats()
+        }
+    
+    @staticmethod
+    def replay(connection: SSEConnection, last_event_id: str) -> Optional[List[str]]:
+        """连接（已订阅好聊天室）遗漏的事件帧；无法确认没有遗漏时返回 None"""
+        try:
+            last_id = int(last_event_id)
+        except ValueError:
+            return None
+        streams = [f"user:{connection.user_id}"] + [f"chat:{chat_id}" for chat_id in connection.chats]
+        return replay_buffer.since(streams, last_id, connection.user_id)
 
 
 # 创建管理器实例
 sse_manager = SSEManager()
 
 
-async def event_generator(user_id: str, request: Request):
-    """SSE 事件生成器"""
-    queue = sse_manager.connect(user_id)
+async def event_generator(user_id: str, chats: List[str] = (), last_event_id: Optional[str] = None):
+    """SSE 事件生成器：只等待队列，客户端断开由写出失败（或服务器取消响应）结束生成器"""
+    connection = sse_manager.connect(user_id)
+    queue = connection.queue
+    for chat_id in chats:
+        sse_manager.subscribe(user_id, chat_id, connection.id)
+    # 连接与订阅之后立即取出遗漏的事件（中间没有 await），之后的事件都会进入队列，不会重复或遗漏
+    missed = sse_manager.replay(connection, last_event_id) if last_event_id else []
     
     try:
-        # 发送初始连接成功事件
-        yield f"data: {json.dumps({'type': 'connected', 'user_id': user_id, 'time': datetime.now().isoformat()}, ensure_ascii=False)}\n\n"
+        # 发送初始连接成功事件（connection_id 用于只订阅当前连接）
+        yield encode_event({'type': 'connected', 'user_id': user_id, 'connection_id': connection.id, 'time': datetime.now().isoformat()})
         
-        while True:
-            # 检查客户端是否断开连接
-            if await request.is_disconnected():
+        if missed is None:
+            yield encode_event({'type': 'resync', 'reason': '部分事件已不在重放缓冲中，请重新拉取'})
+        else:
+            for frame in missed:
+                yield frame
+        
+        while not connection.closed:
+            # 心跳由后台协程放入队列，这里不需要超时
+            frame = await queue.get()
+            if frame is None:
                 break
-            
-            try:
-                # 等待消息，设置超时以便定期检查连接状态
-                data = await asyncio.wait_for(queue.get(), timeout=30)
-                yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
-            except asyncio.TimeoutError:
-                # 发送心跳保持连接
-                yield f"data: {json.dumps({'type': 'heartbeat', 'time': datetime.now().isoformat()})}\n\n"
+            yield frame
+            connection.last_sent = time.monotonic()
+            if frame is not HEARTBEAT_FRAME:
+                connection.delivered += 1
     
     except Exception as e:
         logger.error(f"SSE 事件生成器错误: {e}")
     
     finally:
-        sse_manager.disconnect(user_id)
+        sse_manager.disconnect(connection)
 
 
 @router.get("/connect")
 async def sse_connect(
     request: Request,
     user_id: Optional[str] = Query(None),
-    token: Optional[str] = Query(None)
+    token: Optional[str] = Query(None),
+    chats: Optional[str] = Query(None, description="连接时订阅的聊天室，逗号分隔"),
+    last_event_id: Optional[str] = Query(None, description="最后收到的事件 ID（优先使用 Last-Event-ID 请求头）")
 ):
     """
     SSE 连接端点
@@ -130,12 +358,21 @@ async def sse_connect(
         const data = JSON.parse(event.data);
         console.log(data);
     };
+    
+    同一用户可以同时保持多个连接；connected 事件中的 connection_id 可传给
+    subscribe / unsubscribe，只改变当前连接的订阅。
+    
+    断线重连：EventSource 自动重连时会带上 Last-Event-ID 请求头；自行新建连接时
+    传入 last_event_id=event.lastEventId 与 chats=聊天室ID列表，只会收到遗漏的事件。
+    收到 {"type": "resync"} 时需要全量重新拉取。
     """
     if not user_id:
         return {"error": "缺少 user_id 参数"}
     
+    chat_ids = [chat_id for chat_id in (chats or "").split(",") if chat_id]
+    resume_from = request.headers.get("last-event-id") or last_event_id
     return StreamingResponse(
-        event_generator(user_id, request),
+        event_generator(user_id, chat_ids, resume_from),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -146,33 +383,54 @@ async def sse_connect(
 
 
 @router.post("/subscribe/{chat_id}")
-async def subscribe_chat(chat_id: str, user_id: Optional[str] = Query(None)):
+async def subscribe_chat(
+    chat_id: str,
+    user_id: Optional[str] = Query(None),
+    connection_id: Optional[str] = Query(None, description="只订阅该连接，不传则订阅该用户的所有连接")
+):
     """订阅聊天室消息"""
     if not user_id:
         return {"error": "缺少 user_id 参数"}
     
-    sse_manager.subscribe(user_id, chat_id)
+    sse_manager.subscribe(user_id, chat_id, connection_id)
     return {"status": "success", "message": f"已订阅聊天室 {chat_id}"}
 
 
 @router.post("/unsubscribe/{chat_id}")
-async def unsubscribe_chat(chat_id: str, user_id: Optional[str] = Query(None)):
+async def unsubscribe_chat(
+    chat_id: str,
+    user_id: Optional[str] = Query(None),
+    connection_id: Optional[str] = Query(None, description="只取消该连接的订阅，不传则取消该用户所有连接的订阅")
+):
     """取消订阅聊天室"""
     if not user_id:
         return {"error": "缺少 user_id 参数"}
     
-    sse_manager.unsubscribe(user_id, chat_id)
+    sse_manager.unsubscribe(user_id, chat_id, connection_id)
     return {"status": "success", "message": f"已取消订阅聊天室 {chat_id}"}
 
 
 @router.get("/online-users")
-async def get_online_users():
-    """获取在线用户列表"""
-    return {
-        "online_users": list(clients.keys()),
-        "count": len(clients),
-        "subscriptions": {uid: list(chats) for uid, chats in user_chats.items()}
+async def get_online_users(
+    cursor: Optional[str] = Query(None, description="上一页最后一个用户ID"),
+    limit: int = Query(PRESENCE_PAGE_SIZE, ge=1)
+):
+    """获取在线用户列表（WebSocket 与 SSE 合计，按用户ID分页）；subscriptions 只包含本页中在本 worker 上订阅的聊天室"""
+    page = presence.online_users(cursor, limit)
+    page["subscriptions"] = {
+        uid: sorted(set().union(*(c.chats for c in clients[uid])))
+        for uid in page["online_users"] if uid in clients
     }
+    return page
+
+
+@router.get("/stats")
+async def get_sse_stats(user_id: Optional[str] = Query(None, description="同时返回该用户各连接的计数")):
+    """SSE 连接与事件计数（入队 / 丢弃 / 已写出）"""
+    result = sse_manager.stats()
+    if user_id:
+        result["user_connections"] = [c.stats() for c in clients.get(user_id, ())]
+    return result
 
 
 # 导出管理器供其他模块使用
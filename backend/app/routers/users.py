@@ -1,27 +1,43 @@
 from fastapi import APIRouter, HTTPException, Depends, status
 from typing import List
 from app.database import supabase
-from app.auth_utils import get_current_user
+from app.auth_utils import get_current_user, invalidate_principal
+from app.models.schemas import User, UserUpdate
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
+@router.put("/me", response_model=User)
+def update_profile(profile: UserUpdate, current_user = Depends(get_current_user)):
+    # Only update fields that were provided
+    update_data = profile.model_dump(exclude_unset=True)
+    if not update_data:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    
+    response = supabase.table("users").update(update_data).eq("id", current_user['id']).execute()
+    if not response.data:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    # 资料已变更，清除缓存的 principal
+    invalidate_principal(current_user['id'])
+    return response.data[0]
+
 @router.get("/favorites", response_model=List[str])
 def get_favorites(current_user = Depends(get_current_user)):
     # Return list of pet IDs for the authenticated user
-    response = supabase.table("favorites").select("pet_id").eq("user_id", current_user.id).execute()
+    response = supabase.table("favorites").select("pet_id").eq("user_id", current_user['id']).execute()
     return [item['pet_id'] for item in response.data]
 
 @router.post("/favorites/{pet_id}")
 def toggle_favorite(pet_id: str, current_user = Depends(get_current_user)):
     # Check if exists for the authenticated user
-    response = supabase.table("favorites").select("*").eq("user_id", current_user.id).eq("pet_id", pet_id).execute()
+    response = supabase.table("favorites").select("*").eq("user_id", current_user['id']).eq("pet_id", pet_id).execute()
     
     if response.data:
         # Remove
-        supabase.table("favorites").delete().eq("user_id", current_user.id).eq("pet_id", pet_id).execute()
+        supabase.table("favorites").delete().eq("user_id", current_user['id']).eq("pet_id", pet_id).execute()
         return {"status": "removed"}
     else:
         # Add
-        supabase.table("favorites").insert({"user_id": current_user.id, "pet_id": pet_id}).execute()
+        supabase.table("favorites").insert({"user_id": current_user['id'], "pet_id": pet_id}).execute()
         return {"status": "added"}
\ No newline at end of file
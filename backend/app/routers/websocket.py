@@ -3,17 +3,39 @@ WebSocket 路由
 处理实时聊天连接
 """
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
-from typing import Optional
-import json
+from typing import Optional, Set
+from datetime import datetime, timezone
+import os
+import uuid
+import asyncio
 import logging
-from app.websocket import manager
-from app.database import supabase
+from app.websocket import manager, typing_debouncer
+from app.ws_codec import decode, format_error
+from app.database import async_supabase
 from app.auth_utils import verify_token
+from app.services.dataloader import Loaders
+from app.services.rate_limiter import TokenBucket
+from app.services.message_writer import message_writer, MessageWriterOverloaded
+from app.services.presence import presence, PRESENCE_PAGE_SIZE
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["websocket"])
 
+# ==================== 入站限流 ====================
+# 每个连接：每秒补充的消息数与突发量，超出的消息直接丢弃（在解析 JSON 之前）
+WS_INBOUND_RATE = float(os.getenv("WS_INBOUND_RATE", "10"))
+WS_INBOUND_BURST = float(os.getenv("WS_INBOUND_BURST", "30"))
+# 连续被限流的消息数达到该值时关闭连接（1008: Policy Violation）
+WS_INBOUND_MAX_VIOLATIONS = int(os.getenv("WS_INBOUND_MAX_VIOLATIONS", "50"))
+
+# 令牌桶保存在每个连接上（不经过共享的限流存储后端），这里只汇总指标
+inbound_counts = {"allowed": 0, "rejected": 0}
+
+
+def inbound_stats() -> dict:
+    return {"rate_per_sec": WS_INBOUND_RATE, "capacity": WS_INBOUND_BURST, **inbound_counts}
+
 
 @router.websocket("/ws/chat")
 async def websocket_endpoint(
@@ -30,10 +52,16 @@ async def websocket_endpoint(
     
     消息格式:
     - 加入聊天室: {"type": "join", "chat_id": "xxx"}
-    - 发送消息: {"type": "message", "chat_id": "xxx", "text": "消息内容"}
+    - 发送消息: {"type": "message", "chat_id": "xxx", "text": "消息内容", "temp_id": "客户端临时ID"}
+      立即回复 message_ack（含 temp_id 与服务器消息ID）并广播 new_message，
+      写入数据库后回复 message_sent，写入失败时推送 message_failed
     - 离开聊天室: {"type": "leave", "chat_id": "xxx"}
     - 已读回执: {"type": "read", "chat_id": "xxx"}
+    - 正在输入: {"type": "typing", "chat_id": "xxx"}（服务端按间隔合并，空闲后推送 typing_stopped）
     - 心跳: {"type": "ping"}
+    
+    通过子协议 pawpal.msgpack 协商 MessagePack 二进制帧，默认 JSON 文本帧（见 app/ws_codec.py）。
+    每个连接的入站消息受令牌桶限流，持续超限会以 1008 关闭连接。
     """
     
     # 验证用户身份
@@ -57,9 +85,13 @@ async def websocket_endpoint(
     # 接受连接
     await manager.connect(websocket, authenticated_user_id)
     
+    # 限流按连接计数；violations 为连续被限流的消息数
+    inbound_bucket = TokenBucket(WS_INBOUND_RATE, WS_INBOUND_BURST)
+    violations = 0
+    
     try:
         # 发送连接成功消息
-        await websocket.send_json({
+        await manager.send_json(websocket, {
             "type": "connected",
             "user_id": authenticated_user_id,
             "message": "WebSocket 连接成功"
@@ -74,32 +106,64 @@ async def websocket_endpoint(
         while True:
             # 接收消息
             try:
-                data = await websocket.receive_text()
-                message_data = json.loads(data)
+                data = await manager.receive(websocket)
+                
+                allowed, retry_after = inbound_bucket.take()
+                if not allowed:
+                    inbound_counts["rejected"] += 1
+                    violations += 1
+                    if violations >= WS_INBOUND_MAX_VIOLATIONS:
+                        logger.warning(f"用户 {authenticated_user_id} 消息过于频繁，关闭连接")
+                        await websocket.close(code=1008, reason="消息过于频繁")
+                        break
+                    # 每轮连续限流只提示一次，避免错误消息反过来放大流量
+                    if violations == 1:
+                        await manager.send_json(websocket, {
+                            "type": "error",
+                            "message": "消息过于频繁，请稍后再试",
+                            "retry_after": round(retry_after, 2)
+                        })
+                    continue
+                inbound_counts["allowed"] += 1
+                violations = 0
+                # loader 按消息创建：缓存只在处理这一条消息期间有效，
+                # 长连接上不会一直沿用已删除的对话或已变更的参与者
+                loaders = Loaders()
+                
+                try:
+                    message_data = decode(data)
+                except ValueError:
+                    await manager.send_json(websocket, {
+                        "type": "error",
+                        "message": format_error(data)
+                    })
+                    continue
                 
                 message_type = message_data.get("type")
                 chat_id = message_data.get("chat_id")
                 
                 # 处理心跳
                 if message_type == "ping":
-                    await websocket.send_json({"type": "pong"})
+                    await manager.send_json(websocket, {"type": "pong"})
                     continue
                 
                 # 处理加入聊天室
                 if message_type == "join":
                     if not chat_id:
-                        await websocket.send_json({
+                        await manager.send_json(websocket, {
                             "type": "error",
                             "message": "缺少 chat_id 参数"
                         })
                         continue
                     
                     # 验证用户是否属于该聊天室
-                    if await verify_chat_participant(chat_id, authenticated_user_id):
+                    if await verify_chat_participant(chat_id, authenticated_user_id, loaders):
                         manager.join_chat(websocket, chat_id)
-                        await websocket.send_json({
+                        await manager.send_json(websocket, {
                             "type": "joined",
-                            "chat_id": chat_id
+                            "chat_id": chat_id,
+                            # 当前在线的成员，之后的变化通过 presence 事件推送
+                            "online": presence.room_members(chat_id)
                         })
                         
                         # 通知其他用户有人加入（可选）
@@ -109,7 +173,7 @@ async def websocket_endpoint(
                             "chat_id": chat_id
                         }, exclude_user_id=authenticated_user_id)
                     else:
-                        await websocket.send_json({
+                        await manager.send_json(websocket, {
                             "type": "error",
                             "message": "您没有权限加入该聊天室"
                         })
@@ -118,66 +182,74 @@ async def websocket_endpoint(
                 elif message_type == "message":
                     text = message_data.get("text")
                     if not chat_id or not text:
-                        await websocket.send_json({
+                        await manager.send_json(websocket, {
                             "type": "error",
                             "message": "缺少 chat_id 或 text 参数"
                         })
                         continue
                     
                     # 验证用户是否属于该聊天室
-                    if not await verify_chat_participant(chat_id, authenticated_user_id):
-                        await websocket.send_json({
+                    if not await verify_chat_participant(chat_id, authenticated_user_id, loaders):
+                        await manager.send_json(websocket, {
                             "type": "error",
                             "message": "您没有权限在该聊天室发送消息"
                         })
                         continue
                     
-                    # 保存消息到数据库
+                    # 消息 ID 与时间戳由服务器生成，立即确认并广播，写库交给批量写入器
+                    temp_id = message_data.get("temp_id")
+                    message_id = str(uuid.uuid4())
+                    created_at = datetime.now(timezone.utc).isoformat()
                     try:
-                        result = supabase.table("messages").insert({
+                        persisted = message_writer.submit({
+                            "id": message_id,
                             "conversation_id": chat_id,
                             "sender_id": authenticated_user_id,
                             "content": text,
-                            "read": False
-                        }).execute()
-                        
-                        if result.data:
-                            message_record = result.data[0]
-                            
-                            # 更新对话的更新时间
-                            supabase.table("conversations").update({
-                                "updated_at": "now()"
-                            }).eq("id", chat_id).execute()
-                            
-                            # 广播消息给聊天室所有人
-                            await manager.broadcast_to_chat(chat_id, {
-                                "type": "new_message",
-                                "chat_id": chat_id,
-                                "message": {
-                                    "id": message_record["id"],
-                                    "sender_id": authenticated_user_id,
-                                    "text": text,
-                                    "timestamp": message_record["created_at"],
-                                    "isRead": False
-                                }
-                            })
-                            
-                            # 发送确认给发送者
-                            await websocket.send_json({
-                                "type": "message_sent",
-                                "chat_id": chat_id,
-                                "message_id": message_record["id"],
-                                "timestamp": message_record["created_at"]
-                            })
-                            
-                            logger.info(f"用户 {authenticated_user_id} 在聊天室 {chat_id} 发送消息")
-                    
-                    except Exception as e:
+                            "read": False,
+                            "created_at": created_at
+                        })
+                    except MessageWriterOverloaded as e:
                         logger.error(f"保存消息失败: {e}")
-                        await websocket.send_json({
+                        await manager.send_json(websocket, {
                             "type": "error",
+                            "temp_id": temp_id,
                             "message": "发送消息失败，请重试"
                         })
+                        continue
+                    
+                    # 确认收到（客户端用 temp_id 对应本地的待发送消息）
+                    await manager.send_json(websocket, {
+                        "type": "message_ack",
+                        "chat_id": chat_id,
+                        "temp_id": temp_id,
+                        "message_id": message_id,
+                        "timestamp": created_at
+                    })
+                    
+                    # 广播消息给聊天室所有人
+                    await manager.broadcast_to_chat(chat_id, {
+                        "type": "new_message",
+                        "chat_id": chat_id,
+                        "message": {
+                            "id": message_id,
+                            "temp_id": temp_id,
+                            "sender_id": authenticated_user_id,
+                            "text": text,
+                            "timestamp": created_at,
+                            "isRead": False
+                        }
+                    })
+                    
+                    # 消息已发出，结束发送者的打字状态
+                    await typing_debouncer.stop(chat_id, authenticated_user_id)
+                    
+                    # 写库完成后发送确认（message_sent）或失败通知
+                    _track(asyncio.create_task(_confirm_persisted(
+                        websocket, authenticated_user_id, chat_id, temp_id, message_id, persisted
+                    )))
+                    
+                    logger.info(f"用户 {authenticated_user_id} 在聊天室 {chat_id} 发送消息")
                 
                 # 处理已读回执
                 elif message_type == "read":
@@ -186,7 +258,7 @@ async def websocket_endpoint(
                     
                     try:
                         # 标记消息为已读
-                        result = supabase.table("messages").update({
+                        result = await async_supabase.table("messages").update({
                             "read": True
                         }).eq("conversation_id", chat_id).neq("sender_id", authenticated_user_id).execute()
                         
@@ -207,7 +279,7 @@ async def websocket_endpoint(
                 elif message_type == "leave":
                     if chat_id:
                         manager.leave_chat(websocket, chat_id)
-                        await websocket.send_json({
+                        await manager.send_json(websocket, {
                             "type": "left",
                             "chat_id": chat_id
                         })
@@ -219,30 +291,26 @@ async def websocket_endpoint(
                             "chat_id": chat_id
                         }, exclude_user_id=authenticated_user_id)
                 
-                # 处理打字状态
+                # 处理打字状态（按间隔合并，空闲后自动广播 typing_stopped）
                 elif message_type == "typing":
                     if chat_id:
-                        await manager.broadcast_to_chat(chat_id, {
-                            "type": "typing",
-                            "chat_id": chat_id,
-                            "user_id": authenticated_user_id
-                        }, exclude_user_id=authenticated_user_id)
+                        await typing_debouncer.typing(chat_id, authenticated_user_id)
                 
                 else:
-                    await websocket.send_json({
+                    await manager.send_json(websocket, {
                         "type": "error",
                         "message": f"未知的消息类型: {message_type}"
                     })
             
-            except json.JSONDecodeError:
-                await websocket.send_json({
-                    "type": "error",
-                    "message": "无效的 JSON 格式"
-                })
+            except WebSocketDisconnect:
+                raise
             
             except Exception as e:
+                # 连接已被管理器断开（如接收过慢），不再继续读取
+                if websocket not in manager.connection_info:
+                    break
                 logger.error(f"处理 WebSocket 消息时出错: {e}")
-                await websocket.send_json({
+                await manager.send_json(websocket, {
                     "type": "error",
                     "message": "处理消息时出错"
                 })
@@ -254,19 +322,17 @@ async def websocket_endpoint(
         manager.disconnect(websocket)
 
 
-async def verify_chat_participant(chat_id: str, user_id: str) -> bool:
+async def verify_chat_participant(chat_id: str, user_id: str, loaders: Optional[Loaders] = None) -> bool:
     """
     验证用户是否是聊天室的参与者
     """
     try:
         # 获取对话信息
-        conv_res = supabase.table("conversations").select("*, pets!inner(*)").eq("id", chat_id).execute()
+        conv = await (loaders or Loaders()).conversations.load(chat_id)
         
-        if not conv_res.data:
+        if not conv:
             return False
         
-        conv = conv_res.data[0]
-        
         # 检查用户是否是申请人
         if conv["user_id"] == user_id:
             return True
@@ -282,10 +348,59 @@ async def verify_chat_participant(chat_id: str, user_id: str) -> bool:
         return False
 
 
+# 等待写库确认的后台任务（保留引用，避免任务被提前回收）
+_pending_confirmations: Set[asyncio.Task] = set()
+
+
+def _track(task: asyncio.Task):
+    _pending_confirmations.add(task)
+    task.add_done_callback(_pending_confirmations.discard)
+
+
+async def _confirm_persisted(websocket: WebSocket, user_id: str, chat_id: str,
+                             temp_id: Optional[str], message_id: str, persisted: asyncio.Future):
+    """等待消息写入数据库，成功后向发送者确认，最终失败时通知聊天室撤回该消息"""
+    try:
+        record = await persisted
+    except Exception as e:
+        logger.error(f"保存消息失败: {e}")
+        failed = {
+            "type": "message_failed",
+            "chat_id": chat_id,
+            "temp_id": temp_id,
+            "message_id": message_id,
+            "message": "发送消息失败，请重试"
+        }
+        await manager.send_json(websocket, failed)
+        # 其他参与者已经收到广播，通知他们移除该消息
+        await manager.broadcast_to_chat(chat_id, failed, exclude_user_id=user_id)
+        return
+    
+    await manager.send_json(websocket, {
+        "type": "message_sent",
+        "chat_id": chat_id,
+        "temp_id": temp_id,
+        "message_id": record["id"],
+        "timestamp": record["created_at"]
+    })
+
+
 @router.get("/ws/online-users")
-async def get_online_users():
-    """获取当前在线用户列表（管理用途）"""
+async def get_online_users(
+    cursor: Optional[str] = Query(None, description="上一页最后一个用户ID"),
+    limit: int = Query(PRESENCE_PAGE_SIZE, ge=1)
+):
+    """获取当前在线用户列表（管理用途；WebSocket 与 SSE 合计，跨 worker，按用户ID分页）"""
+    return presence.online_users(cursor, limit)
+
+
+@router.get("/ws/stats")
+async def get_websocket_stats():
+    """WebSocket 连接、发送队列、扇出延迟、打字状态合并与入站限流指标"""
     return {
-        "online_users": manager.get_online_users(),
-        "count": len(manager.get_online_users())
+        **manager.stats(),
+        "typing": typing_debouncer.stats(),
+        "persistence": message_writer.stats(),
+        "presence": presence.stats(),
+        "inbound": inbound_stats()
     }
@@ -0,0 +1,129 @@
+"""
+请求级 DataLoader
+把同一轮事件循环内的 load(id) 调用合并为每张表一次 in_() 查询，并对重复 key 去重
+"""
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.database import supabase, async_supabase
+
+
+class DataLoader:
+    """
+    按 key 批量加载某张表的记录
+
+    异步用法（同一轮事件循环内的多次 load 合并为一次查询）:
+        user, pet = await asyncio.gather(loaders.users.load(uid), loaders.pets.load(pid))
+
+    同步用法（同步路由中一次性批量加载）:
+        users = loaders.users.load_many_sync(user_ids)
+
+    结果在 loader 生命周期内缓存，不存在的记录返回 None。
+    """
+
+    def __init__(self, table: str, columns: str = "*", key: str = "id"):
+        self.table = table
+        self.columns = columns
+        self.key = key
+        # key -> 记录（或 None）
+        self._cache: Dict[Any, Optional[Dict]] = {}
+        # key -> 等待批量查询结果的 Future
+        self._pending: Dict[Any, asyncio.Future] = {}
+        self._scheduled = False
+        # 指标
+        self.queries = 0
+        self.loads = 0
+
+    def prime(self, key: Any, value: Optional[Dict]):
+        """预先放入已知记录"""
+        self._cache[key] = value
+
+    def clear(self, key: Any = None):
+        """清除缓存（写操作后调用）"""
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+    # ==================== 异步 ====================
+
+    async def load(self, key: Any) -> Optional[Dict]:
+        """加载单条记录，与同一轮事件循环内的其他 load 合并查询"""
+        self.loads += 1
+        if key in self._cache:
+            return self._cache[key]
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[key] = future
+            if not self._scheduled:
+                self._scheduled = True
+                loop.call_soon(lambda: asyncio.ensure_future(self._dispatch()))
+        return await future
+
+    async def load_many(self, keys: Iterable[Any]) -> List[Optional[Dict]]:
+        """批量加载，结果顺序与 keys 一致"""
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    async def _dispatch(self):
+        pending, self._pending = self._pending, {}
+        self._scheduled = False
+        try:
+            rows = await self._query_async(list(pending))
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in pending.items():
+            value = rows.get(key)
+            self._cache[key] = value
+            if not future.done():
+                future.set_result(value)
+
+    async def _query_async(self, keys: List[Any]) -> Dict[Any, Dict]:
+        self.queries += 1
+        res = await async_supabase.table(self.table).select(self.columns).in_(self.key, keys).execute()
+        return {row[self.key]: row for row in res.data or []}
+
+    # ==================== 同步 ====================
+
+    def load_many_sync(self, keys: Iterable[Any]) -> List[Optional[Dict]]:
+        """同步批量加载（只查询缓存中没有的 key），结果顺序与 keys 一致"""
+        keys = list(keys)
+        self.loads += len(keys)
+        missing = list({key for key in keys if key not in self._cache})
+        if missing:
+            self.queries += 1
+            res = supabase.table(self.table).select(self.columns).in_(self.key, missing).execute()
+            rows = {row[self.key]: row for row in res.data or []}
+            for key in missing:
+                self._cache[key] = rows.get(key)
+        return [self._cache[key] for key in keys]
+
+    def load_sync(self, key: Any) -> Optional[Dict]:
+        """同步加载单条记录"""
+        return self.load_many_sync([key])[0]
+
+
+class Loaders:
+    """请求级 loader 集合，每个请求（或每个 WebSocket 连接）创建一个"""
+
+    def __init__(self):
+        self.users = DataLoader("users", "id, name, avatar_url, role")
+        self.pets = DataLoader("pets", "id, name, image_url, owner_id")
+        # 对话及其宠物（用于判断参与者）
+        self.conversations = DataLoader("conversations", "*, pets!inner(*)")
+
+    def stats(self) -> Dict:
+        return {
+            name: {"loads": loader.loads, "queries": loader.queries}
+            for name, loader in vars(self).items()
+            if isinstance(loader, DataLoader)
+        }
+
+
+def get_loaders() -> Loaders:
+    """FastAPI 依赖：为当前请求创建 loader 集合"""
+    return Loaders()
@@ -0,0 +1,222 @@
+"""
+数据库调用监控
+包装 supabase 客户端，记录每个请求的查询次数、耗时与表名，并自动检测 N+1 查询
+"""
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 单个请求对同一张表查询超过该次数时记录 N+1 警告
+DB_N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", "5"))
+# 调试模式：在响应头中返回本次请求的数据库调用统计
+DB_METRICS_DEBUG = os.getenv("DB_METRICS_DEBUG", "false").lower() == "true"
+
+
+class RequestQueryStats:
+    """单个请求内的数据库调用统计（同一请求的查询可能在多个线程池线程中并发执行，记录时加锁）"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.tables: Dict[str, int] = defaultdict(int)
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def close(self):
+        """结束统计，之后的查询不再计入（如 SSE 流式响应在响应头发出后的查询）"""
+        with self._lock:
+            self.closed = True
+
+    def record(self, table: str, elapsed: float):
+        with self._lock:
+            if self.closed:
+                return
+            self.count += 1
+            self.total_time += elapsed
+            self.tables[table] += 1
+
+    def table_counts(self) -> Dict[str, int]:
+        """各表查询次数（副本）"""
+        with self._lock:
+            return dict(self.tables)
+
+    def repeated_tables(self, threshold: int = DB_N_PLUS_ONE_THRESHOLD) -> Dict[str, int]:
+        """查询次数超过阈值的表"""
+        with self._lock:
+            return {table: count for table, count in self.tables.items() if count > threshold}
+
+
+_request_stats: contextvars.ContextVar[Optional[RequestQueryStats]] = contextvars.ContextVar(
+    "db_request_stats", default=None
+)
+
+
+class DBMetrics:
+    """进程级数据库调用指标"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # 表 -> {count, errors, total_ms, max_ms}
+            self.tables: Dict[str, Dict[str, float]] = defaultdict(
+                lambda: {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+            )
+            # 接口 -> {requests, queries, max_queries, n_plus_one}
+            self.endpoints: Dict[str, Dict[str, int]] = defaultdict(
+                lambda: {"requests": 0, "queries": 0, "max_queries": 0, "n_plus_one": 0}
+            )
+
+    def record_query(self, table: str, elapsed: float, error: bool = False):
+        elapsed_ms = elapsed * 1000
+        with self._lock:
+            stats = self.tables[table]
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            if error:
+                stats["errors"] += 1
+
+        request_stats = _request_stats.get()
+        if request_stats is not None:
+            request_stats.record(table, elapsed)
+
+    def record_request(self, endpoint: str, stats: RequestQueryStats, n_plus_one: bool):
+        with self._lock:
+            entry = self.endpoints[endpoint]
+            entry["requests"] += 1
+            entry["queries"] += stats.count
+            entry["max_queries"] = max(entry["max_queries"], stats.count)
+            if n_plus_one:
+                entry["n_plus_one"] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            tables = {
+                table: {
+                    **stats,
+                    "total_ms": round(stats["total_ms"], 2),
+                    "max_ms": round(stats["max_ms"], 2),
+                    "avg_ms": round(stats["total_ms"] / stats["count"], 2) if stats["count"] else 0.0
+                }
+                for table, stats in self.tables.items()
+            }
+            endpoints = {
+                endpoint: {
+                    **stats,
+                    "avg_queries": round(stats["queries"] / stats["requests"], 2) if stats["requests"] else 0.0
+                }
+                for endpoint, stats in self.endpoints.items()
+            }
+        return {"n_plus_one_threshold": DB_N_PLUS_ONE_THRESHOLD, "tables": tables, "endpoints": endpoints}
+
+
+db_metrics = DBMetrics()
+
+
+class InstrumentedQuery:
+    """查询构造器包装：链式调用透传，execute() 时记录耗时"""
+
+    def __init__(self, builder: Any, table: str):
+        self._builder = builder
+        self._table = table
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if hasattr(result, "execute"):
+                return InstrumentedQuery(result, self._table)
+            return result
+        return call
+
+    def execute(self):
+        start = time.perf_counter()
+        try:
+            result = self._builder.execute()
+        except Exception:
+            db_metrics.record_query(self._table, time.perf_counter() - start, error=True)
+            raise
+        db_metrics.record_query(self._table, time.perf_counter() - start)
+        return result
+
+
+class InstrumentedClient:
+    """supabase 客户端包装：table()/rpc() 返回带监控的查询构造器，其余属性透传"""
+
+    def __init__(self, client: Any):
+        self._client = client
+
+    def table(self, name: str) -> InstrumentedQuery:
+        return InstrumentedQuery(self._client.table(name), name)
+
+    def rpc(self, fn: str, params: dict = None) -> InstrumentedQuery:
+        return InstrumentedQuery(self._client.rpc(fn, params or {}), f"rpc:{fn}")
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
+
+
+class DBMetricsMiddleware:
+    """
+    ASGI 中间件：为每个 HTTP 请求建立独立的统计上下文，响应头发出时结束统计，
+    检测 N+1 查询，调试模式下写入响应头
+
+    纯 ASGI 实现，不包装、不缓冲响应体；SSE 等流式响应在响应头发出后不再计数，
+    长连接不会在整个连接期间持续累计查询次数。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestQueryStats()
+        token = _request_stats.set(stats)
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                headers = _finish_request(scope, stats)
+                if headers:
+                    message = {**message, "headers": [*message.get("headers", []), *headers]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            _request_stats.reset(token)
+
+
+def _finish_request(scope, stats: RequestQueryStats) -> List[Tuple[bytes, bytes]]:
+    """结束请求统计并计入接口指标，返回调试模式下要追加的响应头"""
+    stats.close()
+    route = scope.get("route")
+    endpoint = f"{scope['method']} {getattr(route, 'path', scope['path'])}"
+    repeated = stats.repeated_tables()
+    if repeated:
+        logger.warning(f"检测到可能的 N+1 查询: {endpoint} 共 {stats.count} 次查询，重复表: {repeated}")
+    db_metrics.record_request(endpoint, stats, n_plus_one=bool(repeated))
+
+    if not DB_METRICS_DEBUG:
+        return []
+    tables = ",".join(f"{table}={count}" for table, count in stats.table_counts().items())
+    return [
+        (b"x-db-query-count", str(stats.count).encode()),
+        (b"x-db-query-time-ms", f"{stats.total_time * 1000:.1f}".encode()),
+        (b"x-db-tables", tables.encode("latin-1", "replace")),
+    ]
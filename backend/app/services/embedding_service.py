@@ -9,6 +9,8 @@ import numpy as np
 from numpy.linalg import norm
 import httpx
 
+from app.services.http_pool import http_pool
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -23,11 +25,16 @@ EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "1024"))
 _local_model = None
 
 
+class EmbeddingUnavailableError(Exception):
+    """无法得到真实的 Embedding 向量（strict 模式下代替随机 / 零向量降级）"""
+
+
 class LocalEmbeddingModel:
     """本地 Embedding 模型封装"""
     
     def __init__(self, model_name: str = "BAAI/bge-large-zh-v1.5"):
         self.model_name = model_name
+        self.dimension = EMBEDDING_DIMENSION
         self.model = None
         self._load_model()
     
@@ -115,7 +122,6 @@ class EmbeddingService:
         self.base_url = EMBEDDING_BASE_URL
         self.model_name = EMBEDDING_MODEL_NAME
         self.dimension = EMBEDDING_DIMENSION
-        self.client = httpx.AsyncClient(timeout=30.0)
         
         # 本地模型实例
         self._local_model: Optional[LocalEmbeddingModel] = None
@@ -125,19 +131,26 @@ class EmbeddingService:
         
         logger.info(f"Embedding 服务初始化完成，模式: {self.mode}")
     
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """共享连接池中的客户端"""
+        return http_pool.async_client("embedding", timeout=30.0)
+
     def _get_local_model(self) -> LocalEmbeddingModel:
         """获取本地模型（懒加载）"""
         if self._local_model is None:
             self._local_model = LocalEmbeddingModel(self.model_name)
         return self._local_model
     
-    async def get_embedding(self, text: str, use_cache: bool = True) -> List[float]:
+    async def get_embedding(self, text: str, use_cache: bool = True, strict: bool = False) -> List[float]:
         """
         获取文本的 Embedding 向量
         
         Args:
             text: 输入文本
             use_cache: 是否使用缓存
+            strict: 为 True 时模型 / API 不可用直接抛出 EmbeddingUnavailableError，
+                不降级为随机或零向量（向量需要持久化时使用，调用方可以重试）
         
         Returns:
             向量列表
@@ -145,16 +158,16 @@ class EmbeddingService:
         if not text or not text.strip():
             return [0.0] * self.dimension
         
-        # 检查缓存
+        # 检查缓存（非 strict 调用可能缓存了降级向量，strict 调用不读缓存）
         cache_key = hash(text)
-        if use_cache and cache_key in self._cache:
+        if use_cache and not strict and cache_key in self._cache:
             return self._cache[cache_key]
         
         # 根据模式选择获取方式
         if self.mode == "local":
-            embedding = await self._get_local_embedding(text)
+            embedding = await self._get_local_embedding(text, strict)
         else:
-            embedding = await self._call_embedding_api(text)
+            embedding = await self._call_embedding_api(text, strict)
         
         # 缓存结果
         if use_cache:
@@ -171,14 +184,22 @@ class EmbeddingService:
             tasks = [self.get_embedding(text) for text in texts]
             return await asyncio.gather(*tasks)
     
-    async def _get_local_embedding(self, text: str) -> List[float]:
+    async def _get_local_embedding(self, text: str, strict: bool = False) -> List[float]:
         """使用本地模型获取 Embedding"""
         try:
-            model = self._get_local_model()
-            embeddings = model.encode([text])
+            import asyncio
+            # 在线程中加载模型并编码，避免阻塞事件循环
+            model = await asyncio.to_thread(self._get_local_model)
+            if strict and model.model is None and self.model_name != "mocker":
+                raise EmbeddingUnavailableError(f"本地模型未加载: {self.model_name}")
+            embeddings = await asyncio.to_thread(model.encode, [text])
             return embeddings[0]
+        except EmbeddingUnavailableError:
+            raise
         except Exception as e:
             logger.error(f"本地模型编码失败: {e}")
+            if strict:
+                raise EmbeddingUnavailableError(f"本地模型编码失败: {e}") from e
             # 降级为随机向量（避免系统崩溃）
             import random
             return [random.uniform(-0.1, 0.1) for _ in range(self.dimension)]
@@ -205,9 +226,11 @@ class EmbeddingService:
             import random
             return [[random.uniform(-0.1, 0.1) for _ in range(self.dimension)] for _ in texts]
     
-    async def _call_embedding_api(self, text: str) -> List[float]:
+    async def _call_embedding_api(self, text: str, strict: bool = False) -> List[float]:
         """调用 API 获取 Embedding"""
         if not self.api_key:
+            if strict:
+                raise EmbeddingUnavailableError("未配置 EMBEDDING_API_KEY")
             logger.warning("未配置 EMBEDDING_API_KEY，返回零向量")
             return [0.0] * self.dimension
         
@@ -231,10 +254,16 @@ class EmbeddingService:
                 return result["data"][0]["embedding"]
             
             logger.error(f"Embedding API 返回格式异常: {result}")
+            if strict:
+                raise EmbeddingUnavailableError("Embedding API 返回格式异常")
             return [0.0] * self.dimension
             
+        except EmbeddingUnavailableError:
+            raise
         except Exception as e:
             logger.error(f"API 调用失败: {e}")
+            if strict:
+                raise EmbeddingUnavailableError(f"Embedding API 调用失败: {e}") from e
             return [0.0] * self.dimension
     
     def cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
@@ -0,0 +1,126 @@
+"""
+SSE 事件重放缓冲
+
+移动端网络切换时 SSE 连接经常断开，重连前推送的事件会丢失，前端只能全量重新拉取聊天与消息。
+这里给每条推送事件分配递增的事件 ID，并按流（每个用户、每个聊天室）保留最近的事件；
+客户端重连时带上最后收到的事件 ID（Last-Event-ID），服务器只重放其后的事件。
+
+- 事件 ID 由发布事件的 worker 生成（微秒时间戳，进程内严格递增），随总线消息分发，
+  所有 worker 记录的同一事件 ID 相同，重连到任一 worker 都可以重放
+- 每个流最多保留 SSE_REPLAY_BUFFER 条，最多保留 SSE_REPLAY_MAX_STREAMS 个流（最久未写入的先淘汰）
+- 无法确认没有遗漏时（缓冲已被淘汰、worker 重启后的旧 ID、ID 无法解析）返回 None，
+  由调用方通知客户端全量同步
+
+多 worker 时，不同 worker 在同一瞬间发布的事件到达顺序可能与 ID 顺序不同，
+恰好在此时断开的客户端可能漏掉其中较早的一条。
+"""
+import os
+import time
+import heapq
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+# 每个流保留的事件数
+SSE_REPLAY_BUFFER = int(os.getenv("SSE_REPLAY_BUFFER", "200"))
+# 最多保留的流数（用户流 + 聊天室流）
+SSE_REPLAY_MAX_STREAMS = int(os.getenv("SSE_REPLAY_MAX_STREAMS", "20000"))
+
+# (事件ID, 已编码的帧, 排除的用户ID)
+Entry = Tuple[int, str, Optional[str]]
+
+
+class EventIdGenerator:
+    """事件 ID：微秒时间戳，进程内严格递增"""
+
+    def __init__(self):
+        self._last = 0
+
+    def next(self) -> int:
+        self._last = max(time.time_ns() // 1000, self._last + 1)
+        return self._last
+
+
+class _Stream:
+    __slots__ = ("events", "floor")
+
+    def __init__(self, size: int):
+        self.events: Deque[Entry] = deque(maxlen=size)
+        # 因缓冲已满被挤出的最新事件 ID
+        self.floor = 0
+
+
+class ReplayBuffer:
+    """按流保存最近的事件，按 Last-Event-ID 取出遗漏的事件"""
+
+    def __init__(self, size: int = SSE_REPLAY_BUFFER, max_streams: int = SSE_REPLAY_MAX_STREAMS):
+        self.size = size
+        self.max_streams = max_streams
+        self._streams: "OrderedDict[str, _Stream]" = OrderedDict()
+        # 早于该 ID 的事件不在本进程的缓冲中（进程启动前的事件、被淘汰的流）
+        self._start_id = time.time_ns() // 1000
+        self._evicted_floor = 0
+
+        # 指标
+        self.recorded = 0
+        self.replays = 0
+        self.replayed_events = 0
+        self.resyncs = 0
+        self.streams_evicted = 0
+
+    def append(self, stream: str, event_id: int, frame: str, exclude_user_id: Optional[str] = None):
+        entry = self._streams.get(stream)
+        if entry is None:
+            entry = self._streams[stream] = _Stream(self.size)
+            if len(self._streams) > self.max_streams:
+                _, evicted = self._streams.popitem(last=False)
+                if evicted.events:
+                    self._evicted_floor = max(self._evicted_floor, evicted.events[-1][0])
+                self.streams_evicted += 1
+        else:
+            self._streams.move_to_end(stream)
+        if len(entry.events) == entry.events.maxlen:
+            entry.floor = entry.events[0][0]
+        entry.events.append((event_id, frame, exclude_user_id))
+        self.recorded += 1
+
+    def since(self, streams: Iterable[str], last_id: int, user_id: Optional[str] = None) -> Optional[List[str]]:
+        """
+        返回这些流中事件 ID 大于 last_id 的帧（按 ID 排序，跳过排除了 user_id 的事件）；
+        可能有事件已不在缓冲中时返回 None
+        """
+        if last_id < self._start_id:
+            return self._resync()
+        sources = []
+        for stream in streams:
+            entry = self._streams.get(stream)
+            if entry is None:
+                if last_id < self._evicted_floor:
+                    return self._resync()
+                continue
+            if last_id < entry.floor:
+                return self._resync()
+            sources.append([item for item in entry.events if item[0] > last_id])
+
+        frames = [
+            frame for _, frame, exclude_user_id in heapq.merge(*sources, key=lambda item: item[0])
+            if not (user_id and exclude_user_id == user_id)
+        ]
+        self.replays += 1
+        self.replayed_events += len(frames)
+        return frames
+
+    def _resync(self) -> None:
+        self.resyncs += 1
+        return None
+
+    def stats(self) -> Dict:
+        return {
+            "buffer_size": self.size,
+            "streams": len(self._streams),
+            "max_streams": self.max_streams,
+            "recorded": self.recorded,
+            "replays": self.replays,
+            "replayed_events": self.replayed_events,
+            "resyncs": self.resyncs,
+            "streams_evicted": self.streams_evicted
+        }
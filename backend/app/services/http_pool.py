@@ -0,0 +1,356 @@
+"""
+出站 HTTP 连接池
+LongCat、Embedding API 与 Supabase 共用调优过的连接池：
+- 可配置的连接数 / keepalive 连接数 / keepalive 过期时间
+- 支持时启用 HTTP/2（需要安装 h2）
+- 按主机限制并发请求数，超过时排队等待（等待超过 HTTP_POOL_TIMEOUT 抛出 httpx.PoolTimeout）；
+  同步与异步客户端各自计算名额
+- 由应用 lifespan 关闭连接；关闭后再次使用会重新建立连接
+- 按主机统计并发、排队与错误，供 /api/metrics/http 查看
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+# 等待连接 / 主机并发名额的最长时间（秒）
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "10"))
+HTTP_HTTP2 = os.getenv("HTTP_HTTP2", "true").lower() == "true"
+# 每个主机的默认并发上限，以及单独配置，如 "api.longcat.chat=8,api.openai.com=16"
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "32"))
+HTTP_HOST_LIMITS = os.getenv("HTTP_HOST_LIMITS", "")
+
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+
+def _parse_host_limits(value: str) -> Dict[str, int]:
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            host, limit = item.split("=", 1)
+            limits[host.strip()] = int(limit)
+    return limits
+
+
+class HostStats:
+    """单个主机的请求统计"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.queued = 0
+        self.wait_ms_total = 0.0
+
+    def snapshot(self) -> Dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "utilization": round(self.in_flight / self.limit, 3) if self.limit else 0.0,
+            "requests": self.requests,
+            "errors": self.errors,
+            "queued": self.queued,
+            "avg_wait_ms": round(self.wait_ms_total / self.queued, 2) if self.queued else 0.0
+        }
+
+
+class _HostLimiter:
+    """按主机的并发名额与统计（同步、异步传输层共用）"""
+
+    def __init__(self, default_limit: int, host_limits: Dict[str, int]):
+        self.default_limit = default_limit
+        self.host_limits = host_limits
+        self.hosts: Dict[str, HostStats] = {}
+        self._thread_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        # 主机 -> (事件循环, 信号量)；asyncio 信号量不能跨事件循环使用
+        self._async_semaphores: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, host: str) -> HostStats:
+        stats = self.hosts.get(host)
+        if stats is None:
+            stats = self.hosts[host] = HostStats(self.host_limits.get(host, self.default_limit))
+        return stats
+
+    def thread_semaphore(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaphore = self._thread_semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._thread_semaphores[host] = threading.BoundedSemaphore(self._stats(host).limit)
+            return semaphore
+
+    def async_semaphore(self, host: str) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._async_semaphores.get(host)
+            if entry is None or entry[0] is not loop:
+                entry = self._async_semaphores[host] = (loop, asyncio.Semaphore(self._stats(host).limit))
+            return entry[1]
+
+    def acquired(self, host: str, waited: float):
+        with self._lock:
+            stats = self._stats(host)
+            stats.requests += 1
+            stats.in_flight += 1
+            stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+            if waited > 0.001:
+                stats.queued += 1
+                stats.wait_ms_total += waited * 1000
+
+    def released(self, host: str, error: bool = False):
+        with self._lock:
+            stats = self._stats(host)
+            stats.in_flight -= 1
+            if error:
+                stats.errors += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {host: stats.snapshot() for host, stats in self.hosts.items()}
+
+
+class _ReleasingSyncStream(httpx.SyncByteStream):
+    """响应体读完或关闭时释放主机名额（流式响应在读取期间占用名额）"""
+
+    def __init__(self, stream: httpx.SyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+class _ReleasingAsyncStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+def _once(func: Callable[[], None]) -> Callable[[], None]:
+    done = []
+
+    def wrapper():
+        if not done:
+            done.append(True)
+            func()
+    return wrapper
+
+
+class _HostLimitedTransport(httpx.BaseTransport):
+    """同步传输层：按主机限制并发"""
+
+    def __init__(self, transport: httpx.HTTPTransport, limiter: _HostLimiter, pool_timeout: float):
+        self.transport = transport
+        self._limiter = limiter
+        self._pool_timeout = pool_timeout
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        semaphore = self._limiter.thread_semaphore(host)
+        start = time.perf_counter()
+        if not semaphore.acquire(timeout=self._pool_timeout):
+            raise httpx.PoolTimeout(f"等待主机并发名额超时: {host}", request=request)
+        self._limiter.acquired(host, time.perf_counter() - start)
+
+        def release(error: bool = False):
+            semaphore.release()
+            self._limiter.released(host, error)
+
+        try:
+            response = self.transport.handle_request(request)
+        except Exception:
+            release(error=True)
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingSyncStream(response.stream, _once(release)),
+            extensions=response.extensions,
+            request=request
+        )
+
+    def close(self):
+        self.transport.close()
+
+
+class _AsyncHostLimitedTransport(httpx.AsyncBaseTransport):
+    """异步传输层：按主机限制并发"""
+
+    def __init__(self, transport: httpx.AsyncHTTPTransport, limiter: _HostLimiter, pool_timeout: float):
+        self.transport = transport
+        self._limiter = limiter
+        self._pool_timeout = pool_timeout
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        semaphore = self._limiter.async_semaphore(host)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self._pool_timeout)
+        except asyncio.TimeoutError:
+            raise httpx.PoolTimeout(f"等待主机并发名额超时: {host}", request=request)
+        self._limiter.acquired(host, time.perf_counter() - start)
+
+        def release(error: bool = False):
+            semaphore.release()
+            self._limiter.released(host, error)
+
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            release(error=True)
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingAsyncStream(response.stream, _once(release)),
+            extensions=response.extensions,
+            request=request
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def _pool_connections(transport) -> Dict:
+    """连接池中的连接状态（读取 httpcore 连接池）"""
+    pool = getattr(getattr(transport, "transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    return {
+        "connections": len(connections),
+        "idle": sum(1 for c in connections if c.is_idle()),
+        "http2": sum(1 for c in connections if "HTTP/2" in c.info()),
+    }
+
+
+class HTTPPool:
+    """
+    出站 HTTP 连接池管理
+
+    用法:
+        client = http_pool.async_client("longcat", timeout=60.0)
+        response = await client.post(url, json=payload)
+    同名客户端只创建一次，共享同一个连接池。
+    """
+
+    def __init__(self):
+        self.http2 = HTTP_HTTP2 and _HTTP2_AVAILABLE
+        if HTTP_HTTP2 and not _HTTP2_AVAILABLE:
+            logger.warning("未安装 h2，出站请求使用 HTTP/1.1")
+        self.limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+        self._limiter = _HostLimiter(HTTP_MAX_PER_HOST, _parse_host_limits(HTTP_HOST_LIMITS))
+        self._sync_transport: Optional[_HostLimitedTransport] = None
+        self._async_transport: Optional[_AsyncHostLimitedTransport] = None
+        self._sync_clients: Dict[str, httpx.Client] = {}
+        self._async_clients: Dict[str, httpx.AsyncClient] = {}
+        self._lock = threading.Lock()
+
+    def _timeout(self, timeout: float) -> httpx.Timeout:
+        return httpx.Timeout(timeout, connect=min(timeout, HTTP_CONNECT_TIMEOUT), pool=HTTP_POOL_TIMEOUT)
+
+    def _get_sync_transport(self) -> _HostLimitedTransport:
+        if self._sync_transport is None:
+            self._sync_transport = _HostLimitedTransport(
+                httpx.HTTPTransport(http2=self.http2, limits=self.limits, retries=1),
+                self._limiter, HTTP_POOL_TIMEOUT
+            )
+        return self._sync_transport
+
+    def _get_async_transport(self) -> _AsyncHostLimitedTransport:
+        if self._async_transport is None:
+            self._async_transport = _AsyncHostLimitedTransport(
+                httpx.AsyncHTTPTransport(http2=self.http2, limits=self.limits, retries=1),
+                self._limiter, HTTP_POOL_TIMEOUT
+            )
+        return self._async_transport
+
+    def sync_client(self, name: str, timeout: float = 30.0, **kwargs) -> httpx.Client:
+        """同步客户端（如 supabase / PostgREST，在线程池中调用）"""
+        with self._lock:
+            client = self._sync_clients.get(name)
+            if client is None:
+                client = self._sync_clients[name] = httpx.Client(
+                    transport=self._get_sync_transport(),
+                    timeout=self._timeout(timeout),
+                    **kwargs
+                )
+            return client
+
+    def async_client(self, name: str, timeout: float = 30.0, **kwargs) -> httpx.AsyncClient:
+        """异步客户端（如 LongCat、Embedding API）"""
+        with self._lock:
+            client = self._async_clients.get(name)
+            if client is None or client.is_closed:
+                client = self._async_clients[name] = httpx.AsyncClient(
+                    transport=self._get_async_transport(),
+                    timeout=self._timeout(timeout),
+                    **kwargs
+                )
+            return client
+
+    async def aclose(self):
+        """关闭所有连接（应用关闭时调用）；客户端对象保留，之后使用会重新建立连接"""
+        with self._lock:
+            sync_transport, async_transport = self._sync_transport, self._async_transport
+        if async_transport is not None:
+            await async_transport.aclose()
+        if sync_transport is not None:
+            sync_transport.close()
+        logger.info("出站 HTTP 连接池已关闭")
+
+    def stats(self) -> Dict:
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "clients": {
+                "sync": sorted(self._sync_clients),
+                "async": sorted(self._async_clients)
+            },
+            "pools": {
+                "sync": _pool_connections(self._sync_transport) if self._sync_transport else None,
+                "async": _pool_connections(self._async_transport) if self._async_transport else None
+            },
+            "hosts": self._limiter.snapshot()
+        }
+
+
+http_pool = HTTPPool()
@@ -0,0 +1,377 @@
+"""
+后台任务队列
+进程内 asyncio 任务队列：有界 worker 并发、指数退避重试、SQLite 日志持久化（重启后继续执行）
+
+- 事件循环中的日志读写都放到线程中执行（协程中请使用 enqueue_async）
+- 处理函数抛出 PermanentJobError 或 4xx HTTPException（408 / 429 除外）时直接失败，不再重试
+- 成功的任务保留 JOB_QUEUE_RETENTION 秒后从日志中删除
+"""
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import asyncio
+import logging
+import inspect
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from starlette.exceptions import HTTPException
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 任务队列配置（任务日志默认放在 backend 目录下，与启动时的工作目录无关）
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+JOB_QUEUE_DB_PATH = os.getenv("JOB_QUEUE_DB_PATH") or os.path.join(_BACKEND_DIR, "job_queue.db")
+JOB_QUEUE_WORKERS = int(os.getenv("JOB_QUEUE_WORKERS", "4"))
+JOB_QUEUE_MAX_ATTEMPTS = int(os.getenv("JOB_QUEUE_MAX_ATTEMPTS", "5"))
+JOB_QUEUE_BACKOFF_BASE = float(os.getenv("JOB_QUEUE_BACKOFF_BASE", "1.0"))  # 秒
+JOB_QUEUE_BACKOFF_MAX = float(os.getenv("JOB_QUEUE_BACKOFF_MAX", "300"))  # 秒
+# 成功任务在日志中的保留时间与清理间隔（秒）
+JOB_QUEUE_RETENTION = float(os.getenv("JOB_QUEUE_RETENTION", "86400"))
+JOB_QUEUE_PRUNE_INTERVAL = float(os.getenv("JOB_QUEUE_PRUNE_INTERVAL", "600"))
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+JobHandler = Callable[[Dict[str, Any]], Union[Any, Awaitable[Any]]]
+
+# 可以重试的 4xx（请求超时、限流），其余 4xx 视为永久失败
+_RETRYABLE_HTTP_STATUS = {408, 429}
+
+
+class PermanentJobError(Exception):
+    """任务无法完成且重试无意义（如依赖的数据已不存在），抛出后直接标记为失败"""
+
+
+def is_permanent_failure(exc: BaseException) -> bool:
+    """异常是否表示重试也不会成功"""
+    if isinstance(exc, PermanentJobError):
+        return True
+    if isinstance(exc, HTTPException):
+        return 400 <= exc.status_code < 500 and exc.status_code not in _RETRYABLE_HTTP_STATUS
+    return False
+
+
+class JobJournal:
+    """SQLite 任务日志（WAL 模式），所有写操作都很小，直接加锁同步执行"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                run_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON jobs(status, run_at)")
+
+    def insert(self, job_id: str, name: str, payload: Dict, max_attempts: int, run_at: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, name, payload, status, attempts, max_attempts, run_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?)",
+                (job_id, name, json.dumps(payload, ensure_ascii=False), JOB_QUEUED, max_attempts, run_at, now, now)
+            )
+
+    def update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def pending(self) -> List[Dict]:
+        """取出所有待执行任务；上次进程退出时仍在运行的任务视为待执行"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ? WHERE status = ?", (JOB_QUEUED, JOB_RUNNING)
+            )
+            rows = self._conn.execute(
+                "SELECT id, run_at FROM jobs WHERE status = ? ORDER BY run_at", (JOB_QUEUED,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def prune(self, before: float) -> int:
+        """删除 before 之前完成的成功任务，返回删除的行数"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status = ? AND updated_at < ?", (JOB_SUCCEEDED, before)
+            )
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobQueue:
+    """
+    后台任务队列
+
+    用法:
+        @job_queue.register("applications.auto_reply")
+        def auto_reply(payload: dict): ...
+
+        job_queue.enqueue("applications.auto_reply", {"application_id": "xxx"})
+        await job_queue.enqueue_async(...)  # 协程中调用
+
+    处理函数可以是同步函数（在线程池中执行）或协程函数；
+    抛出异常即视为失败，按指数退避重试直到 max_attempts，重试也不会成功的异常直接失败，
+    因此处理函数需要是幂等的（重试、重启恢复都可能重复执行已部分完成的任务）。
+    """
+
+    def __init__(
+        self,
+        db_path: str = JOB_QUEUE_DB_PATH,
+        workers: int = JOB_QUEUE_WORKERS,
+        max_attempts: int = JOB_QUEUE_MAX_ATTEMPTS,
+        backoff_base: float = JOB_QUEUE_BACKOFF_BASE,
+        backoff_max: float = JOB_QUEUE_BACKOFF_MAX,
+        retention: float = JOB_QUEUE_RETENTION,
+        prune_interval: float = JOB_QUEUE_PRUNE_INTERVAL
+    ):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retention = retention
+        self.prune_interval = prune_interval
+
+        self._handlers: Dict[str, JobHandler] = {}
+        self._journal: Optional[JobJournal] = None
+        self._journal_lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+        self._running_count = 0
+        self.pruned = 0
+
+    @property
+    def journal(self) -> JobJournal:
+        """任务日志（懒加载，允许在 start 之前入队）"""
+        if self._journal is None:
+            with self._journal_lock:
+                if self._journal is None:
+                    self._journal = JobJournal(self.db_path)
+        return self._journal
+
+    def register(self, name: str):
+        """注册任务处理函数（装饰器）"""
+        def decorator(func: JobHandler) -> JobHandler:
+            self._handlers[name] = func
+            return func
+        return decorator
+
+    def enqueue(
+        self,
+        name: str,
+        payload: Optional[Dict] = None,
+        max_attempts: Optional[int] = None,
+        delay: float = 0
+    ) -> str:
+        """
+        提交任务，先写日志再投递，线程安全（同步路由在线程池中调用；协程中请使用 enqueue_async）
+
+        Returns:
+            任务 ID
+        """
+        if name not in self._handlers:
+            raise ValueError(f"未注册的任务类型: {name}")
+
+        job_id = str(uuid.uuid4())
+        run_at = time.time() + delay
+        self.journal.insert(job_id, name, payload or {}, max_attempts or self.max_attempts, run_at)
+        self._schedule(job_id, delay)
+        return job_id
+
+    async def enqueue_async(
+        self,
+        name: str,
+        payload: Optional[Dict] = None,
+        max_attempts: Optional[int] = None,
+        delay: float = 0
+    ) -> str:
+        """协程中提交任务：日志在线程中写入，不阻塞事件循环"""
+        return await asyncio.to_thread(self.enqueue, name, payload, max_attempts, delay)
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """查询任务状态"""
+        job = self.journal.get(job_id)
+        if job:
+            job["payload"] = json.loads(job["payload"])
+        return job
+
+    def stats(self) -> Dict:
+        """队列统计"""
+        return {
+            "workers": self.workers,
+            "started": bool(self._tasks),
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "running": self._running_count,
+            "pruned": self.pruned,
+            "jobs": self.journal.counts()
+        }
+
+    async def start(self):
+        """启动 worker，并恢复日志中未完成的任务"""
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+
+        now = time.time()
+        pending = await asyncio.to_thread(self.journal.pending)
+        for job in pending:
+            self._schedule(job["id"], max(0.0, job["run_at"] - now))
+
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._pruner()))
+        logger.info(f"任务队列已启动，worker 数: {self.workers}，恢复任务: {len(pending)}")
+
+    async def stop(self):
+        """停止 worker；执行中的任务保留在日志中，下次启动时重新执行"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._loop = None
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        logger.info("任务队列已停止")
+
+    def _schedule(self, job_id: str, delay: float):
+        """把任务 ID 投递到内存队列；未启动时只保留在日志中"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+
+        def put():
+            if self._queue is None:
+                return
+            if delay > 0:
+                loop.call_later(delay, self._put_nowait, job_id)
+            else:
+                self._put_nowait(job_id)
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is loop:
+            put()
+        else:
+            loop.call_soon_threadsafe(put)
+
+    def _put_nowait(self, job_id: str):
+        if self._queue is not None:
+            self._queue.put_nowait(job_id)
+
+    def _backoff(self, attempts: int) -> float:
+        """指数退避 + 抖动"""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _pruner(self):
+        """定期删除超过保留时间的成功任务"""
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.journal.prune, time.time() - self.retention)
+                if removed:
+                    self.pruned += removed
+                    logger.info(f"已清理 {removed} 条成功任务记录")
+            except Exception as e:
+                logger.error(f"清理任务日志失败: {e}")
+            await asyncio.sleep(self.prune_interval)
+
+    async def _worker(self, index: int):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                logger.error(f"任务 worker-{index} 处理 {job_id} 时出错: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _update(self, job_id: str, **fields):
+        await asyncio.to_thread(self.journal.update, job_id, **fields)
+
+    async def _run(self, job_id: str):
+        job = await asyncio.to_thread(self.journal.get, job_id)
+        if not job or job["status"] != JOB_QUEUED:
+            return
+
+        handler = self._handlers.get(job["name"])
+        if handler is None:
+            await self._update(job_id, status=JOB_FAILED, last_error=f"未注册的任务类型: {job['name']}")
+            return
+
+        attempts = job["attempts"] + 1
+        await self._update(job_id, status=JOB_RUNNING, attempts=attempts)
+        self._running_count += 1
+        try:
+            payload = json.loads(job["payload"])
+            if inspect.iscoroutinefunction(handler):
+                await handler(payload)
+            else:
+                await asyncio.to_thread(handler, payload)
+        except asyncio.CancelledError:
+            # 进程关闭，保持 running 状态，重启后恢复
+            raise
+        except Exception as e:
+            error = str(e) or repr(e)
+            if is_permanent_failure(e):
+                await self._update(job_id, status=JOB_FAILED, last_error=error)
+                logger.error(f"任务 {job['name']}({job_id}) 失败，不再重试: {error}")
+            elif attempts < job["max_attempts"]:
+                delay = self._backoff(attempts)
+                await self._update(job_id, status=JOB_QUEUED, run_at=time.time() + delay, last_error=error)
+                self._schedule(job_id, delay)
+                logger.warning(f"任务 {job['name']}({job_id}) 第 {attempts} 次执行失败，{delay:.1f}s 后重试: {error}")
+            else:
+                await self._update(job_id, status=JOB_FAILED, last_error=error)
+                logger.error(f"任务 {job['name']}({job_id}) 重试 {attempts} 次后失败: {error}")
+        else:
+            await self._update(job_id, status=JOB_SUCCEEDED, last_error=None)
+        finally:
+            self._running_count -= 1
+
+
+# 全局任务队列实例
+job_queue = JobQueue()
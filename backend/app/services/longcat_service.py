@@ -8,6 +8,8 @@ import logging
 from typing import Dict, List, Optional, Any, AsyncGenerator
 import httpx
 
+from app.services.http_pool import http_pool
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -26,7 +28,11 @@ class LongCatService:
         self.secret_key = LONGCAT_SECRET_KEY
         self.base_url = LONGCAT_BASE_URL
         self.model = LONGCAT_MODEL
-        self.client = httpx.AsyncClient(timeout=60.0)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """共享连接池中的客户端"""
+        return http_pool.async_client("longcat", timeout=60.0)
     
     def _get_headers(self) -> Dict[str, str]:
         """获取请求头"""
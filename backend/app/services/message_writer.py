@@ -0,0 +1,211 @@
+"""
+聊天消息批量写入
+
+WebSocket 收到消息后不再在接收循环中等待数据库：消息 ID 与时间戳由服务器预先生成，
+立即广播，写库交给这里的后台协程。后台协程每次取出队列中积压的全部消息（最多 batch_size 条）
+用一次 upsert 写入，并批量更新对应对话的 updated_at；数据库越慢，每批合并的消息越多。
+
+写入使用预先生成的消息 ID 做 upsert，失败重试不会产生重复消息。
+整批写入因数据本身出错（如对话已删除）时逐条重写，只让出错的消息失败。
+进程退出时会先写完队列中的消息；进程崩溃时尚未写入的消息会丢失（不超过一批）。
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from app.database import async_supabase
+from app.storage.resilient import is_unavailable
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 每批最多写入的消息数
+MESSAGE_WRITER_BATCH_SIZE = int(os.getenv("MESSAGE_WRITER_BATCH_SIZE", "100"))
+# 取到第一条消息后再等待多久凑批（秒），默认 0：只合并写库期间积压的消息
+MESSAGE_WRITER_LINGER = float(os.getenv("MESSAGE_WRITER_LINGER", "0"))
+# 待写入消息上限，超过后拒绝新消息
+MESSAGE_WRITER_MAX_PENDING = int(os.getenv("MESSAGE_WRITER_MAX_PENDING", "10000"))
+# 每批最多尝试次数与退避基数（秒）
+MESSAGE_WRITER_MAX_ATTEMPTS = int(os.getenv("MESSAGE_WRITER_MAX_ATTEMPTS", "5"))
+MESSAGE_WRITER_BACKOFF_BASE = float(os.getenv("MESSAGE_WRITER_BACKOFF_BASE", "0.2"))
+MESSAGE_WRITER_BACKOFF_MAX = float(os.getenv("MESSAGE_WRITER_BACKOFF_MAX", "5"))
+
+
+class MessageWriterOverloaded(Exception):
+    """待写入消息过多"""
+
+
+class MessageWriter:
+    """
+    消息批量写入器
+
+    用法:
+        future = message_writer.submit({"id": ..., "conversation_id": ..., ...})
+        record = await future   # 写入成功后返回该记录，最终失败时抛出异常
+    """
+
+    def __init__(
+        self,
+        batch_size: int = MESSAGE_WRITER_BATCH_SIZE,
+        linger: float = MESSAGE_WRITER_LINGER,
+        max_pending: int = MESSAGE_WRITER_MAX_PENDING,
+        max_attempts: int = MESSAGE_WRITER_MAX_ATTEMPTS,
+        backoff_base: float = MESSAGE_WRITER_BACKOFF_BASE,
+        backoff_max: float = MESSAGE_WRITER_BACKOFF_MAX
+    ):
+        self.batch_size = batch_size
+        self.linger = linger
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # 指标
+        self.submitted = 0
+        self.written = 0
+        self.failed = 0
+        self.rejected = 0
+        self.batches = 0
+        self.retries = 0
+        self.max_batch = 0
+        self.last_batch_ms = 0.0
+
+    def submit(self, record: Dict) -> asyncio.Future:
+        """提交一条消息记录（需包含 id），返回写入完成时结束的 future；未启动时自动启动"""
+        if self._task is None:
+            self._start()
+        if self._queue.qsize() >= self.max_pending:
+            self.rejected += 1
+            raise MessageWriterOverloaded(f"待写入消息超过 {self.max_pending} 条")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((record, future))
+        self.submitted += 1
+        return future
+
+    async def start(self):
+        if self._task is None:
+            self._start()
+
+    def _start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"消息写入器已启动，每批最多 {self.batch_size} 条")
+
+    async def stop(self, timeout: float = 10):
+        """写完队列中剩余的消息后停止"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"消息写入器停止超时，{self._queue.qsize()} 条消息未写入")
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._queue = None
+        logger.info("消息写入器已停止")
+
+    def stats(self) -> Dict:
+        return {
+            "started": self._task is not None,
+            "pending": self._queue.qsize() if self._queue else 0,
+            "submitted": self.submitted,
+            "written": self.written,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "retries": self.retries,
+            "avg_batch": round(self.written / self.batches, 2) if self.batches else 0,
+            "max_batch": self.max_batch,
+            "last_batch_ms": round(self.last_batch_ms, 2)
+        }
+
+    # ==================== 后台写入 ====================
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            if self.linger > 0:
+                await asyncio.sleep(self.linger)
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._write_batch(batch)
+            except Exception as e:
+                logger.error(f"消息写入器处理批次时出错: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write_batch(self, batch: List[Tuple[Dict, asyncio.Future]]):
+        start = time.perf_counter()
+        rows = [record for record, _ in batch]
+        try:
+            await self._upsert_with_retry(rows)
+        except Exception as e:
+            if len(batch) == 1 or is_unavailable(e):
+                self._fail(batch, e)
+                return
+            # 数据本身有误：逐条写入，只让出错的消息失败
+            logger.warning(f"批量写入消息失败，改为逐条写入: {e}")
+            ok = []
+            for item in batch:
+                try:
+                    await self._upsert_with_retry([item[0]])
+                    ok.append(item)
+                except Exception as item_error:
+                    self._fail([item], item_error)
+            batch = ok
+        if not batch:
+            return
+
+        # 对话排序依赖 updated_at，每批每个对话只更新一次；失败不影响消息本身
+        chat_ids = sorted({record["conversation_id"] for record, _ in batch})
+        try:
+            await async_supabase.table("conversations").update({
+                "updated_at": "now()"
+            }).in_("id", chat_ids).execute()
+        except Exception as e:
+            logger.warning(f"更新对话时间失败: {e}")
+
+        self.batches += 1
+        self.written += len(batch)
+        self.max_batch = max(self.max_batch, len(batch))
+        self.last_batch_ms = (time.perf_counter() - start) * 1000
+        for record, future in batch:
+            if not future.done():
+                future.set_result(record)
+
+    async def _upsert_with_retry(self, rows: List[Dict]):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await async_supabase.table("messages").upsert(rows).execute()
+                return
+            except Exception as e:
+                # 数据本身有误时重试没有意义
+                if attempt >= self.max_attempts or not is_unavailable(e):
+                    raise
+                self.retries += 1
+                delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))) * random.uniform(0.5, 1.0)
+                logger.warning(f"写入 {len(rows)} 条消息失败，{delay:.2f}s 后第 {attempt + 1} 次尝试: {e}")
+                await asyncio.sleep(delay)
+
+    def _fail(self, batch: List[Tuple[Dict, asyncio.Future]], error: Exception):
+        self.failed += len(batch)
+        logger.error(f"{len(batch)} 条消息写入失败: {error}")
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+
+# 全局消息写入器实例
+message_writer = MessageWriter()
@@ -0,0 +1,136 @@
+"""
+密码哈希服务
+bcrypt（12 轮，约 250ms CPU）在独立的有界进程池中执行，
+避免登录高峰占满所有同步接口共用的线程池
+"""
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from passlib.context import CryptContext
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 进程池配置
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# 等待进程池的最大请求数，超过后直接拒绝
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+# 使用更安全的配置，避免bcrypt版本检测问题
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__ident="2b",  # 指定bcrypt版本标识
+    bcrypt__rounds=12      # 指定加密轮数
+)
+
+
+def hash_password(password: str) -> str:
+    """同步计算密码哈希（在子进程中执行）"""
+    # 截断密码到72字节（bcrypt限制）
+    return pwd_context.hash(password[:72])
+
+
+def check_password(plain_password: str, hashed_password: str) -> bool:
+    """同步校验密码（在子进程中执行）"""
+    # 截断密码到72字节（bcrypt限制）
+    return pwd_context.verify(plain_password[:72], hashed_password)
+
+
+class PasswordHasherBusy(Exception):
+    """等待哈希的请求过多"""
+
+
+class PasswordHasher:
+    """有界进程池密码哈希器，附带队列深度指标"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        # 指标
+        self.pending = 0  # 等待进程池空位
+        self.in_flight = 0  # 正在子进程中执行
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.max_pending_seen = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            logger.info(f"密码哈希进程池已启动，进程数: {self.workers}")
+        return self._executor
+
+    async def _submit(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHasherBusy("密码哈希队列已满")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+
+        loop = asyncio.get_running_loop()
+        queued_at = time.perf_counter()
+        self.pending += 1
+        self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.pending -= 1
+
+        started_at = time.perf_counter()
+        self._total_wait += started_at - queued_at
+        self.in_flight += 1
+        try:
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._total_run += time.perf_counter() - started_at
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        """计算密码哈希"""
+        return await self._submit(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """校验密码"""
+        return await self._submit(check_password, plain_password, hashed_password)
+
+    def stats(self) -> Dict:
+        """进程池指标"""
+        completed = self.completed or 1
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "max_pending_seen": self.max_pending_seen,
+            "avg_wait_ms": round(self._total_wait / completed * 1000, 2),
+            "avg_run_ms": round(self._total_run / completed * 1000, 2)
+        }
+
+    def shutdown(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._slots = None
+
+
+# 全局密码哈希器实例
+password_hasher = PasswordHasher()
@@ -0,0 +1,388 @@
+"""
+在线状态服务
+
+- 引用计数：每个用户在本 worker 上的连接数（WebSocket 与 SSE 合计），
+  以及每个（聊天室, 用户）加入 / 订阅该聊天室的连接数
+- 批量同步：状态从无到有或从有到无的键先记为待同步，每 PRESENCE_FLUSH_INTERVAL 秒
+  合并成一条差异经实时总线发给所有 worker；窗口内断开又重连不会产生事件
+- 全局视图：每个 worker 按收到的差异维护 键 -> 报告在线的 worker 集合，
+  集合从空变为非空（或反之）即为全局上线 / 下线，不需要扫描全部用户
+- 聊天室事件：成员上线 / 下线按聊天室合并，每次同步每个聊天室最多推送一条 presence 事件，
+  每个 worker 只投递给自己持有的连接
+- 在线用户列表按用户ID有序保存，按游标分页查询
+
+worker 之间定期发送存活信号；第一次见到某个 worker 时互相发送全量快照，
+超过 PRESENCE_WORKER_TTL 秒没有消息的 worker 视为已退出，其报告的在线状态全部清除。
+"""
+import os
+import time
+import heapq
+import bisect
+import socket
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.services.realtime_bus import RealtimeBus, realtime_bus
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 合并同步的间隔（秒）
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "1.0"))
+# worker 多久没有消息视为已退出（秒），存活信号每 1/3 该时间发送一次
+PRESENCE_WORKER_TTL = float(os.getenv("PRESENCE_WORKER_TTL", "15"))
+# 在线用户分页的默认 / 最大每页数量
+PRESENCE_PAGE_SIZE = int(os.getenv("PRESENCE_PAGE_SIZE", "100"))
+PRESENCE_MAX_PAGE_SIZE = int(os.getenv("PRESENCE_MAX_PAGE_SIZE", "1000"))
+
+PRESENCE_BUS_CHANNEL = "presence"
+
+Member = Tuple[str, str]
+RoomListener = Callable[[str, Dict], Awaitable[None]]
+
+
+class PresenceService:
+    """在线状态服务"""
+
+    def __init__(self, bus: RealtimeBus = realtime_bus, flush_interval: float = PRESENCE_FLUSH_INTERVAL,
+                 worker_ttl: float = PRESENCE_WORKER_TTL):
+        self.bus = bus
+        self.flush_interval = flush_interval
+        self.worker_ttl = worker_ttl
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+
+        # 本 worker：用户 -> 连接数；（聊天室, 用户）-> 连接数
+        self._local_users: Dict[str, int] = {}
+        self._local_members: Dict[Member, int] = {}
+        # 自上次同步后在本 worker 上出现 / 消失过的键
+        self._dirty_users: Set[str] = set()
+        self._dirty_members: Set[Member] = set()
+
+        # 全局视图：键 -> 报告在线的 worker；worker -> 其报告的键
+        self._user_workers: Dict[str, Set[str]] = {}
+        self._member_workers: Dict[Member, Set[str]] = {}
+        self._worker_users: Dict[str, Set[str]] = {}
+        self._worker_members: Dict[str, Set[Member]] = {}
+        self._worker_seen: Dict[str, float] = {}
+        # 全局在线用户（有序，用于分页）与各聊天室的在线成员
+        self._online_sorted: List[str] = []
+        self._room_members: Dict[str, Set[str]] = {}
+
+        self._listeners: List[RoomListener] = []
+        self._task: Optional[asyncio.Task] = None
+        self._last_beacon = 0.0
+        bus.subscribe(PRESENCE_BUS_CHANNEL, self._on_bus_message)
+
+        # 指标
+        self.flushes = 0
+        self.room_events = 0
+        self.workers_expired = 0
+
+    def add_room_listener(self, listener: RoomListener):
+        """注册聊天室 presence 事件的本地投递函数（实时推送中心）"""
+        self._listeners.append(listener)
+
+    # ==================== 本 worker 的连接变化（O(1)） ====================
+
+    def connected(self, user_id: str):
+        count = self._local_users.get(user_id, 0)
+        self._local_users[user_id] = count + 1
+        if count == 0:
+            self._mark_user(user_id)
+
+    def disconnected(self, user_id: str):
+        count = self._local_users.get(user_id, 0)
+        if count <= 1:
+            if self._local_users.pop(user_id, None) is not None:
+                self._mark_user(user_id)
+        else:
+            self._local_users[user_id] = count - 1
+
+    def joined(self, chat_id: str, user_id: str):
+        key = (chat_id, user_id)
+        count = self._local_members.get(key, 0)
+        self._local_members[key] = count + 1
+        if count == 0:
+            self._mark_member(key)
+
+    def left(self, chat_id: str, user_id: str):
+        key = (chat_id, user_id)
+        count = self._local_members.get(key, 0)
+        if count <= 1:
+            if self._local_members.pop(key, None) is not None:
+                self._mark_member(key)
+        else:
+            self._local_members[key] = count - 1
+
+    def _mark_user(self, user_id: str):
+        self._dirty_users.add(user_id)
+        self._ensure_started()
+
+    def _mark_member(self, key: Member):
+        self._dirty_members.add(key)
+        self._ensure_started()
+
+    # ==================== 查询 ====================
+
+    def is_online(self, user_id: str) -> bool:
+        """用户是否在任一 worker 上在线"""
+        return user_id in self._user_workers
+
+    def online_count(self) -> int:
+        return len(self._online_sorted)
+
+    def online_users(self, cursor: Optional[str] = None, limit: int = PRESENCE_PAGE_SIZE) -> Dict:
+        """按用户ID分页返回在线用户，cursor 为上一页最后一个用户ID"""
+        limit = max(1, min(limit, PRESENCE_MAX_PAGE_SIZE))
+        start = bisect.bisect_right(self._online_sorted, cursor) if cursor else 0
+        page = self._online_sorted[start:start + limit]
+        has_more = start + limit < len(self._online_sorted)
+        return {
+            "online_users": page,
+            "count": len(self._online_sorted),
+            "next_cursor": page[-1] if page and has_more else None
+        }
+
+    def room_members(self, chat_id: str) -> List[str]:
+        """聊天室当前在线的成员"""
+        return sorted(self._room_members.get(chat_id, ()))
+
+    # ==================== 同步 ====================
+
+    async def start(self):
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._task is None:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.flush()
+                self._expire_workers(time.monotonic())
+            except Exception as e:
+                logger.error(f"在线状态同步出错: {e}")
+            await asyncio.sleep(self.flush_interval)
+
+    async def flush(self):
+        """把待同步的变化合并成一条差异发布；没有变化时按间隔发送存活信号"""
+        now = time.monotonic()
+        users_on, users_off = self._split(self._dirty_users, self._local_users)
+        members_on, members_off = self._split(self._dirty_members, self._local_members)
+        self._dirty_users = set()
+        self._dirty_members = set()
+
+        if users_on or users_off or members_on or members_off:
+            self.flushes += 1
+            self._last_beacon = now
+            await self.bus.publish(PRESENCE_BUS_CHANNEL, {
+                "op": "diff",
+                "worker": self.worker_id,
+                "users_on": users_on,
+                "users_off": users_off,
+                "members_on": [list(key) for key in members_on],
+                "members_off": [list(key) for key in members_off]
+            })
+        elif now - self._last_beacon >= self.worker_ttl / 3:
+            self._last_beacon = now
+            await self.bus.publish(PRESENCE_BUS_CHANNEL, {"op": "alive", "worker": self.worker_id})
+
+    @staticmethod
+    def _split(dirty, local) -> Tuple[list, list]:
+        on, off = [], []
+        for key in dirty:
+            (on if key in local else off).append(key)
+        return on, off
+
+    async def _publish_snapshot(self, request: bool):
+        await self.bus.publish(PRESENCE_BUS_CHANNEL, {
+            "op": "snapshot",
+            "worker": self.worker_id,
+            "request": request,
+            "users": list(self._local_users),
+            "members": [list(key) for key in self._local_members]
+        })
+
+    async def _on_bus_message(self, message: Dict):
+        worker = message["worker"]
+        op = message["op"]
+        first_seen = worker != self.worker_id and worker not in self._worker_seen
+        self._worker_seen[worker] = time.monotonic()
+        events: Dict[str, Dict[str, List[str]]] = {}
+        online: Tuple[List[str], Set[str]] = ([], set())
+
+        if op == "diff":
+            for user_id in message["users_on"]:
+                self._add_user(worker, user_id, online)
+            for user_id in message["users_off"]:
+                self._remove_user(worker, user_id, online)
+            for chat_id, user_id in message["members_on"]:
+                self._add_member(worker, (chat_id, user_id), events)
+            for chat_id, user_id in message["members_off"]:
+                self._remove_member(worker, (chat_id, user_id), events)
+        elif op == "snapshot":
+            self._replace_worker(worker, set(message["users"]),
+                                 {tuple(key) for key in message["members"]}, events, online)
+            if message.get("request") and worker != self.worker_id:
+                await self._publish_snapshot(request=False)
+
+        self._apply_online(*online)
+
+        if first_seen:
+            # 新 worker（或重新连上的 worker）：发送本 worker 的全量状态，并请求对方的全量状态
+            await self._publish_snapshot(request=True)
+        await self._emit(events)
+
+    # ==================== 全局视图 ====================
+
+    def _add_user(self, worker: str, user_id: str, online: Tuple[List[str], Set[str]]):
+        workers = self._user_workers.get(user_id)
+        if workers is None:
+            workers = self._user_workers[user_id] = set()
+            if user_id in online[1]:
+                online[1].discard(user_id)
+            else:
+                online[0].append(user_id)
+        workers.add(worker)
+        self._worker_users.setdefault(worker, set()).add(user_id)
+
+    def _remove_user(self, worker: str, user_id: str, online: Tuple[List[str], Set[str]]):
+        workers = self._user_workers.get(user_id)
+        if workers is None:
+            return
+        workers.discard(worker)
+        self._worker_users.get(worker, set()).discard(user_id)
+        if not workers:
+            del self._user_workers[user_id]
+            online[1].add(user_id)
+
+    def _apply_online(self, added: List[str], removed: Set[str]):
+        """把一批上线 / 下线合并进有序列表：少量变化逐个插入删除，大量变化（如快照）整体归并"""
+        added = [user_id for user_id in added if user_id in self._user_workers]
+        removed = {user_id for user_id in removed if user_id not in self._user_workers}
+        if len(added) + len(removed) <= 64:
+            for user_id in removed:
+                index = bisect.bisect_left(self._online_sorted, user_id)
+                if index < len(self._online_sorted) and self._online_sorted[index] == user_id:
+                    del self._online_sorted[index]
+            for user_id in added:
+                bisect.insort(self._online_sorted, user_id)
+            return
+        remaining = [user_id for user_id in self._online_sorted if user_id not in removed] \
+            if removed else self._online_sorted
+        self._online_sorted = list(heapq.merge(remaining, sorted(added)))
+
+    def _add_member(self, worker: str, key: Member, events: Dict):
+        workers = self._member_workers.get(key)
+        if workers is None:
+            workers = self._member_workers[key] = set()
+            chat_id, user_id = key
+            self._room_members.setdefault(chat_id, set()).add(user_id)
+            self._record(events, chat_id, "online", user_id)
+        workers.add(worker)
+        self._worker_members.setdefault(worker, set()).add(key)
+
+    def _remove_member(self, worker: str, key: Member, events: Dict):
+        workers = self._member_workers.get(key)
+        if workers is None:
+            return
+        workers.discard(worker)
+        self._worker_members.get(worker, set()).discard(key)
+        if not workers:
+            del self._member_workers[key]
+            chat_id, user_id = key
+            members = self._room_members.get(chat_id)
+            if members is not None:
+                members.discard(user_id)
+                if not members:
+                    del self._room_members[chat_id]
+            self._record(events, chat_id, "offline", user_id)
+
+    @staticmethod
+    def _record(events: Dict, chat_id: str, kind: str, user_id: str):
+        room = events.setdefault(chat_id, {"online": [], "offline": []})
+        # 同一批内先下线又上线（或反之）互相抵消
+        opposite = room["offline" if kind == "online" else "online"]
+        if user_id in opposite:
+            opposite.remove(user_id)
+        else:
+            room[kind].append(user_id)
+
+    def _replace_worker(self, worker: str, users: Set[str], members: Set[Member], events: Dict,
+                        online: Tuple[List[str], Set[str]]):
+        """用全量快照替换某个 worker 报告的状态"""
+        for user_id in self._worker_users.get(worker, set()) - users:
+            self._remove_user(worker, user_id, online)
+        for user_id in users:
+            self._add_user(worker, user_id, online)
+        for key in self._worker_members.get(worker, set()) - members:
+            self._remove_member(worker, key, events)
+        for key in members:
+            self._add_member(worker, key, events)
+
+    def _expire_workers(self, now: float):
+        expired = [
+            worker for worker, seen in self._worker_seen.items()
+            if worker != self.worker_id and now - seen > self.worker_ttl
+        ]
+        if not expired:
+            return
+        events: Dict[str, Dict[str, List[str]]] = {}
+        online: Tuple[List[str], Set[str]] = ([], set())
+        for worker in expired:
+            logger.warning(f"在线状态: worker {worker} 超过 {self.worker_ttl:.0f} 秒无消息，清除其在线用户")
+            self._replace_worker(worker, set(), set(), events, online)
+            self._worker_users.pop(worker, None)
+            self._worker_members.pop(worker, None)
+            del self._worker_seen[worker]
+            self.workers_expired += 1
+        self._apply_online(*online)
+        asyncio.ensure_future(self._emit(events))
+
+    async def _emit(self, events: Dict[str, Dict[str, List[str]]]):
+        """每个聊天室一条 presence 事件，投递给本 worker 上的连接"""
+        for chat_id, change in events.items():
+            if not change["online"] and not change["offline"]:
+                continue
+            self.room_events += 1
+            event = {
+                "type": "presence",
+                "chat_id": chat_id,
+                "online": change["online"],
+                "offline": change["offline"]
+            }
+            for listener in self._listeners:
+                try:
+                    await listener(chat_id, event)
+                except Exception as e:
+                    logger.error(f"推送在线状态事件失败: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "worker_id": self.worker_id,
+            "workers": len(self._worker_seen),
+            "online_users": len(self._online_sorted),
+            "local_users": len(self._local_users),
+            "local_room_members": len(self._local_members),
+            "rooms_with_members": len(self._room_members),
+            "pending_changes": len(self._dirty_users) + len(self._dirty_members),
+            "flushes": self.flushes,
+            "room_events": self.room_events,
+            "workers_expired": self.workers_expired
+        }
+
+
+# 全局在线状态服务实例
+presence = PresenceService()
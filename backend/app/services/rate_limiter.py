@@ -0,0 +1,154 @@
+"""
+限流服务
+令牌桶限流，存储后端可插拔（默认进程内内存存储）；
+只在单个连接内计数的限流（如 WebSocket 入站消息）使用不经过存储后端的 TokenBucket
+"""
+import os
+import time
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+# 内存后端最多跟踪的 key 数（超过后淘汰最久未访问的）
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+
+class RateLimitBackend(ABC):
+    """限流存储后端接口"""
+
+    @abstractmethod
+    def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> Tuple[bool, float]:
+        """
+        从 key 对应的令牌桶中取出 cost 个令牌
+
+        Args:
+            key: 桶标识（如 "ip:1.2.3.4"）
+            rate: 每秒补充的令牌数
+            capacity: 桶容量（允许的突发量）
+            cost: 本次消耗的令牌数
+
+        Returns:
+            (是否放行, 需要等待的秒数)
+        """
+
+    def discard(self, key: str):
+        """删除 key 对应的令牌桶（如连接关闭后），默认不做任何事"""
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """进程内令牌桶存储（多 worker 部署时各进程独立计数）"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        # key -> (剩余令牌, 上次更新时间)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> Tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+
+            if tokens >= cost:
+                allowed, retry_after = True, 0.0
+                tokens -= cost
+            else:
+                allowed = False
+                retry_after = (cost - tokens) / rate if rate > 0 else float("inf")
+
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return allowed, retry_after
+
+    def discard(self, key: str):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+class TokenBucket:
+    """
+    单个令牌桶，不加锁、不经过存储后端
+
+    生命周期与所属对象相同（如每个 WebSocket 连接一个），只在一个协程中使用；
+    不占用共享存储中的 key，不会挤掉登录等限流的令牌桶，也没有远程调用。
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def take(self, cost: float = 1.0) -> Tuple[bool, float]:
+        """取出 cost 个令牌，返回 (是否放行, 需要等待的秒数)"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True, 0.0
+        return False, (cost - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+class TokenBucketLimiter:
+    """
+    令牌桶限流器
+
+    用法:
+        limiter = TokenBucketLimiter("login_ip", rate=10 / 60, capacity=10)
+        allowed, retry_after = limiter.check(client_ip)
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float, backend: RateLimitBackend = None):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.backend = backend
+
+        # 指标
+        self.allowed = 0
+        self.rejected = 0
+
+    def check(self, key: str, cost: float = 1.0) -> Tuple[bool, float]:
+        """检查并消耗令牌"""
+        backend = self.backend or get_rate_limit_backend()
+        allowed, retry_after = backend.take(f"{self.name}:{key}", self.rate, self.capacity, cost)
+        if allowed:
+            self.allowed += 1
+        else:
+            self.rejected += 1
+        return allowed, retry_after
+
+    def discard(self, key: str):
+        """删除 key 对应的令牌桶"""
+        backend = self.backend or get_rate_limit_backend()
+        backend.discard(f"{self.name}:{key}")
+
+    def stats(self) -> Dict:
+        return {
+            "rate_per_sec": self.rate,
+            "capacity": self.capacity,
+            "allowed": self.allowed,
+            "rejected": self.rejected
+        }
+
+
+_backend: RateLimitBackend = InMemoryRateLimitBackend()
+
+
+def get_rate_limit_backend() -> RateLimitBackend:
+    """获取当前限流存储后端"""
+    return _backend
+
+
+def set_rate_limit_backend(backend: RateLimitBackend):
+    """替换限流存储后端（如换成 Redis 等共享存储）"""
+    global _backend
+    _backend = backend
@@ -0,0 +1,305 @@
+"""
+实时消息总线（跨 worker 发布 / 订阅）
+
+WebSocket 与 SSE 管理器的连接都只存在于当前进程，多 worker 部署（uvicorn --workers N）时，
+worker A 上发出的消息到不了连接在 worker B 上的用户。管理器的广播统一发布到总线，
+每个 worker 订阅后只投递给自己持有的连接。
+
+通过 REALTIME_BUS 选择实现：
+- local: 进程内直接回调（单 worker，默认）
+- unix:  同一主机多 worker，经 Unix 域套接字中转。持有锁文件的 worker 作为中转节点监听套接字，
+         其他 worker 连接到它；中转节点退出后其余 worker 重新选举并重连
+
+发布时总是先投递给本进程的订阅者，再转发给其他 worker；消息必须可 JSON 序列化。
+"""
+import os
+import json
+import fcntl
+import errno
+import struct
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REALTIME_BUS = os.getenv("REALTIME_BUS", "local").lower()
+# unix 模式的套接字路径（同一主机上的所有 worker 需一致）
+REALTIME_BUS_SOCKET = os.getenv("REALTIME_BUS_SOCKET", "/tmp/pawpal-realtime.sock")
+# 与中转节点断开后的重连间隔（秒）
+REALTIME_BUS_RECONNECT_DELAY = float(os.getenv("REALTIME_BUS_RECONNECT_DELAY", "1.0"))
+# 对端积压的未发送字节数上限，超过后断开该对端（由其自行重连）
+REALTIME_BUS_MAX_BUFFER = int(os.getenv("REALTIME_BUS_MAX_BUFFER", str(8 * 1024 * 1024)))
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# 帧格式：4 字节大端长度 + JSON {"c": 频道, "m": 消息}
+_HEADER = struct.Struct(">I")
+
+
+class RealtimeBus(ABC):
+    """发布 / 订阅接口"""
+
+    name = "base"
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = {}
+        # 指标
+        self.published = 0
+        self.received = 0
+        self.handler_errors = 0
+
+    def subscribe(self, channel: str, handler: Handler):
+        """注册频道的处理函数（本进程内），可在 start() 之前调用"""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def unsubscribe(self, channel: str, handler: Handler):
+        handlers = self._handlers.get(channel)
+        if handlers and handler in handlers:
+            handlers.remove(handler)
+
+    async def _deliver(self, channel: str, message: Dict[str, Any]):
+        """投递给本进程的订阅者，单个处理函数出错不影响其他订阅者"""
+        for handler in list(self._handlers.get(channel, ())):
+            try:
+                await handler(message)
+            except Exception as e:
+                self.handler_errors += 1
+                logger.error(f"实时总线处理函数出错（频道 {channel}）: {e}")
+
+    @abstractmethod
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        """发布消息到所有 worker 的订阅者"""
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> Dict:
+        return {
+            "bus": self.name,
+            "channels": {channel: len(handlers) for channel, handlers in self._handlers.items()},
+            "published": self.published,
+            "received": self.received,
+            "handler_errors": self.handler_errors
+        }
+
+
+class LocalBus(RealtimeBus):
+    """进程内总线：发布即回调本进程订阅者"""
+
+    name = "local"
+
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        self.published += 1
+        await self._deliver(channel, message)
+
+
+class UnixSocketBus(RealtimeBus):
+    """
+    同一主机多 worker 的总线
+
+    中转节点（hub）：持有 <socket>.lock 的 worker，监听 Unix 套接字，
+    把收到的帧转发给除来源外的所有对端。其他 worker 作为客户端连接到 hub。
+    """
+
+    name = "unix"
+
+    def __init__(self, path: str = REALTIME_BUS_SOCKET,
+                 reconnect_delay: float = REALTIME_BUS_RECONNECT_DELAY,
+                 max_buffer: int = REALTIME_BUS_MAX_BUFFER):
+        super().__init__()
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self.max_buffer = max_buffer
+        self.role = "disconnected"
+        self._lock_file = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        # hub 侧：已连接的对端
+        self._peers: Set[asyncio.StreamWriter] = set()
+        # 客户端侧：到 hub 的连接
+        self._upstream: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        # 指标
+        self.relayed = 0
+        self.dropped_peers = 0
+        self.unrouted = 0
+        self.reconnects = 0
+
+    # ==================== 生命周期 ====================
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping = True
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        await self._close_all()
+        # 让对端读协程处理完连接关闭
+        await asyncio.sleep(0)
+
+    async def _run(self):
+        """选举 / 连接循环：能拿到锁就当 hub，否则连接现有 hub；连接断开后重试"""
+        while not self._stopping:
+            try:
+                if self._try_lock():
+                    await self._serve()
+                else:
+                    await self._connect()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"实时总线连接异常: {e}")
+            await self._close_all()
+            if self._stopping:
+                break
+            self.reconnects += 1
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _try_lock(self) -> bool:
+        lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            lock_file.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        self._lock_file = lock_file
+        return True
+
+    async def _serve(self):
+        # 持有锁说明之前的 hub 已退出，残留的套接字文件可以删除
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._on_peer, path=self.path)
+        self.role = "hub"
+        logger.info(f"实时总线: 作为中转节点监听 {self.path}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        self._upstream = writer
+        self.role = "client"
+        logger.info(f"实时总线: 已连接中转节点 {self.path}")
+        try:
+            while True:
+                channel, message = await self._read_frame(reader)
+                self.received += 1
+                await self._deliver(channel, message)
+        except asyncio.IncompleteReadError:
+            logger.warning("实时总线: 与中转节点的连接已断开")
+
+    async def _close_all(self):
+        for writer in list(self._peers) + ([self._upstream] if self._upstream else []):
+            writer.close()
+        self._peers.clear()
+        self._upstream = None
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+        self.role = "disconnected"
+
+    # ==================== hub ====================
+
+    async def _on_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        try:
+            while True:
+                header = await reader.readexactly(_HEADER.size)
+                body = await reader.readexactly(_HEADER.unpack(header)[0])
+                self.received += 1
+                self._relay(header + body, exclude=writer)
+                frame = json.loads(body)
+                await self._deliver(frame["c"], frame["m"])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    def _relay(self, frame: bytes, exclude: Optional[asyncio.StreamWriter] = None):
+        for peer in list(self._peers):
+            if peer is exclude:
+                continue
+            if peer.transport.get_write_buffer_size() > self.max_buffer:
+                # 对端接收过慢，断开让它重连，避免 hub 内存无限增长
+                self.dropped_peers += 1
+                logger.warning("实时总线: 对端积压过多，断开连接")
+                self._peers.discard(peer)
+                peer.close()
+                continue
+            peer.write(frame)
+            self.relayed += 1
+
+    # ==================== 发布 ====================
+
+    @staticmethod
+    async def _read_frame(reader: asyncio.StreamReader):
+        header = await reader.readexactly(_HEADER.size)
+        frame = json.loads(await reader.readexactly(_HEADER.unpack(header)[0]))
+        return frame["c"], frame["m"]
+
+    @staticmethod
+    def _encode(channel: str, message: Dict[str, Any]) -> bytes:
+        body = json.dumps({"c": channel, "m": message}, ensure_ascii=False).encode("utf-8")
+        return _HEADER.pack(len(body)) + body
+
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        self.published += 1
+        frame = self._encode(channel, message)
+        await self._deliver(channel, message)
+        if self.role == "hub":
+            self._relay(frame)
+        elif self.role == "client" and self._upstream is not None:
+            self._upstream.write(frame)
+        else:
+            # 尚未连接（启动中或 hub 切换），只投递到本进程
+            self.unrouted += 1
+
+    def stats(self) -> Dict:
+        return {
+            **super().stats(),
+            "path": self.path,
+            "role": self.role,
+            "peers": len(self._peers),
+            "relayed": self.relayed,
+            "dropped_peers": self.dropped_peers,
+            "unrouted": self.unrouted,
+            "reconnects": self.reconnects
+        }
+
+
+def create_realtime_bus(kind: str = None) -> RealtimeBus:
+    """按配置创建实时总线"""
+    kind = (kind or REALTIME_BUS).lower()
+    if kind == "local":
+        return LocalBus()
+    if kind == "unix":
+        return UnixSocketBus()
+    raise ValueError(f"未知的实时总线: {kind}（可选 local / unix）")
+
+
+# 全局实时总线实例
+realtime_bus = create_realtime_bus()
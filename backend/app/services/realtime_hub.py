@@ -0,0 +1,230 @@
+"""
+实时推送中心（WebSocket 与 SSE 共用）
+
+聊天室、用户连接索引、广播与事件编码都在这里，WebSocket 与 SSE 只是传输层适配：
+- 连接对象由各传输层提供，需要有 user_id、chats（该连接加入的聊天室集合，由推送中心维护）、
+  wire（消息格式名称）和 deliver(payload)（把已编码的消息放入该连接的发送队列，不等待）
+- 每种消息格式注册一个编码函数 encode(message, event_id)，一次扇出中每种格式只编码一次，
+  同一条消息无论接收者用哪种传输都只扇出一次
+- 广播经实时总线发布（频道 realtime），每个 worker 只投递给自己持有的连接；
+  聊天室 / 用户事件带递增的事件 ID（SSE 断线重放使用），记录函数可以取用同一份编码结果
+- 连接、断开、加入 / 离开聊天室计入在线状态服务，presence 事件同样按格式编码后投递
+
+REST 接口、WebSocket 路由和后台任务都通过 realtime_hub 推送，任何传输的客户端都能收到。
+"""
+import logging
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from app.services.realtime_bus import RealtimeBus, realtime_bus
+from app.services.presence import PresenceService, presence as default_presence
+from app.services.event_replay import EventIdGenerator
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REALTIME_HUB_CHANNEL = "realtime"
+
+Encoder = Callable[[Dict[str, Any], Optional[int]], Any]
+# 记录函数：(流, 事件ID, 排除的用户ID, 按格式取编码结果的函数)
+Recorder = Callable[[str, int, Optional[str], Callable[[str], Any]], None]
+
+
+class _EncodedMessage:
+    """一条消息按格式缓存的编码结果"""
+
+    __slots__ = ("hub", "message", "event_id", "payloads")
+
+    def __init__(self, hub: "RealtimeHub", message: Dict[str, Any], event_id: Optional[int]):
+        self.hub = hub
+        self.message = message
+        self.event_id = event_id
+        self.payloads: Dict[str, Any] = {}
+
+    def __call__(self, wire: str) -> Any:
+        payload = self.payloads.get(wire)
+        if payload is None:
+            payload = self.payloads[wire] = self.hub._encoders[wire](self.message, self.event_id)
+            self.hub.encodes[wire] += 1
+        return payload
+
+
+class RealtimeHub:
+    """实时推送中心"""
+
+    def __init__(self, bus: RealtimeBus = realtime_bus, presence: PresenceService = default_presence,
+                 channel: str = REALTIME_HUB_CHANNEL):
+        self.bus = bus
+        self.channel = channel
+        self.presence = presence
+        bus.subscribe(channel, self._on_bus_message)
+        presence.add_room_listener(self._on_presence)
+        self.event_ids = EventIdGenerator()
+
+        # 本 worker 上的连接（所有传输）
+        self.connections: Set[Any] = set()
+        # 用户ID -> 连接集合（一个用户可能有多个连接，如多设备、多标签页）
+        self.user_connections: Dict[str, Set[Any]] = {}
+        # 聊天室ID -> 加入 / 订阅该聊天室的连接集合
+        self.chat_rooms: Dict[str, Set[Any]] = {}
+
+        self._encoders: Dict[str, Encoder] = {}
+        self._recorders: List[Recorder] = []
+
+        # 指标
+        self.broadcasts = 0
+        self.deliveries: Counter = Counter()
+        self.encodes: Counter = Counter()
+
+    def register_encoder(self, wire: str, encoder: Encoder):
+        """注册消息格式的编码函数"""
+        self._encoders[wire] = encoder
+
+    def add_recorder(self, recorder: Recorder):
+        """注册带事件 ID 的聊天室 / 用户事件的记录函数（不论本 worker 是否有接收者都会调用）"""
+        self._recorders.append(recorder)
+
+    # ==================== 连接与聊天室 ====================
+
+    def register(self, connection):
+        self.connections.add(connection)
+        self.user_connections.setdefault(connection.user_id, set()).add(connection)
+        self.presence.connected(connection.user_id)
+
+    def unregister(self, connection):
+        """移除连接及其加入的全部聊天室（重复调用无副作用）"""
+        if connection not in self.connections:
+            return
+        self.connections.discard(connection)
+        user_id = connection.user_id
+        for chat_id in connection.chats:
+            self._remove_from_room(connection, chat_id)
+            self.presence.left(chat_id, user_id)
+        connection.chats.clear()
+        self.presence.disconnected(user_id)
+        user_connections = self.user_connections.get(user_id)
+        if user_connections is not None:
+            user_connections.discard(connection)
+            if not user_connections:
+                del self.user_connections[user_id]
+
+    def join(self, connection, chat_id: str) -> bool:
+        """连接加入聊天室，重复加入返回 False"""
+        if connection not in self.connections or chat_id in connection.chats:
+            return False
+        connection.chats.add(chat_id)
+        self.chat_rooms.setdefault(chat_id, set()).add(connection)
+        self.presence.joined(chat_id, connection.user_id)
+        return True
+
+    def leave(self, connection, chat_id: str) -> bool:
+        """连接离开聊天室，未加入时返回 False"""
+        if chat_id not in connection.chats:
+            return False
+        connection.chats.discard(chat_id)
+        self._remove_from_room(connection, chat_id)
+        self.presence.left(chat_id, connection.user_id)
+        return True
+
+    def _remove_from_room(self, connection, chat_id: str):
+        room = self.chat_rooms.get(chat_id)
+        if room is not None:
+            room.discard(connection)
+            if not room:
+                del self.chat_rooms[chat_id]
+
+    # ==================== 广播（所有 worker） ====================
+
+    async def send_to_user(self, user_id: str, message: dict):
+        """向指定用户的所有连接发送消息"""
+        await self.bus.publish(self.channel, {
+            "op": "user",
+            "id": self.event_ids.next(),
+            "user_id": user_id,
+            "message": message
+        })
+
+    async def broadcast_to_chat(self, chat_id: str, message: dict, exclude_user_id: Optional[str] = None):
+        """向加入 / 订阅了该聊天室的所有连接广播消息，可以排除某个用户（如发送者）的所有连接"""
+        await self.bus.publish(self.channel, {
+            "op": "chat",
+            "id": self.event_ids.next(),
+            "chat_id": chat_id,
+            "message": message,
+            "exclude_user_id": exclude_user_id
+        })
+
+    async def broadcast(self, message: dict):
+        """向所有在线连接广播消息"""
+        await self.bus.publish(self.channel, {"op": "all", "message": message})
+
+    async def _on_bus_message(self, envelope: dict):
+        """总线消息：记录后投递给本 worker 上的连接"""
+        op = envelope["op"]
+        event_id = envelope.get("id")
+        if op == "chat":
+            chat_id = envelope["chat_id"]
+            exclude_user_id = envelope.get("exclude_user_id")
+            encoded = _EncodedMessage(self, envelope["message"], event_id)
+            self._record(f"chat:{chat_id}", event_id, exclude_user_id, encoded)
+            room = self.chat_rooms.get(chat_id)
+            if room:
+                if exclude_user_id:
+                    targets = [c for c in room if c.user_id != exclude_user_id]
+                else:
+                    targets = list(room)
+                self._fan_out(targets, encoded)
+        elif op == "user":
+            user_id = envelope["user_id"]
+            encoded = _EncodedMessage(self, envelope["message"], event_id)
+            self._record(f"user:{user_id}", event_id, None, encoded)
+            self._fan_out(list(self.user_connections.get(user_id, ())), encoded)
+        elif op == "all":
+            self._fan_out(list(self.connections), _EncodedMessage(self, envelope["message"], None))
+
+    async def _on_presence(self, chat_id: str, event: dict):
+        """在线状态服务按聊天室合并的 presence 事件（不带事件 ID，不进入重放）"""
+        room = self.chat_rooms.get(chat_id)
+        if room:
+            self._fan_out(list(room), _EncodedMessage(self, event, None))
+
+    def _record(self, stream: str, event_id: Optional[int], exclude_user_id: Optional[str],
+                encoded: _EncodedMessage):
+        if event_id is None:
+            return
+        for recorder in self._recorders:
+            try:
+                recorder(stream, event_id, exclude_user_id, encoded)
+            except Exception as e:
+                logger.error(f"实时推送记录函数出错: {e}")
+
+    def _fan_out(self, connections: Iterable, encoded: _EncodedMessage):
+        """每种格式只编码一次，放入所有目标连接的发送队列"""
+        self.broadcasts += 1
+        for connection in connections:
+            wire = connection.wire
+            connection.deliver(encoded(wire))
+            self.deliveries[wire] += 1
+
+    # ==================== 查询 ====================
+
+    def is_user_online(self, user_id: str) -> bool:
+        """用户是否在线（任一 worker、任一传输）"""
+        return self.presence.is_online(user_id)
+
+    def stats(self) -> Dict:
+        transports = Counter(connection.wire for connection in self.connections)
+        return {
+            "connections": len(self.connections),
+            "wires": dict(transports),
+            "users": len(self.user_connections),
+            "chat_rooms": len(self.chat_rooms),
+            "broadcasts": self.broadcasts,
+            "deliveries": dict(self.deliveries),
+            "encodes": dict(self.encodes),
+            "bus": self.bus.stats()
+        }
+
+
+# 全局实时推送中心实例
+realtime_hub = RealtimeHub()
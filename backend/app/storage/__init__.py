@@ -0,0 +1,50 @@
+"""
+可插拔存储后端
+通过 STORAGE_BACKEND 选择：supabase（默认，托管 Postgres）、sqlite（单机部署 / 离线基准测试）
+或 replay（回放录像，离线复现真实流量）；设置 STORAGE_RECORD_PATH 时录制实际后端的调用。
+READ_RESILIENCE_ENABLED=true 时读查询经过容错层（截止时间、按表熔断、过期数据兜底），见 app/storage/resilient.py
+"""
+import os
+
+from app.storage.base import QueryResult, StorageBackend
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase").lower()
+# 录制：把每次查询的调用链、结果与耗时写入该文件（为空则不录制）
+STORAGE_RECORD_PATH = os.getenv("STORAGE_RECORD_PATH", "")
+# 回放：录像文件、是否模拟录制时的延迟、延迟缩放系数
+STORAGE_REPLAY_PATH = os.getenv("STORAGE_REPLAY_PATH", "supabase_cassette.jsonl")
+STORAGE_REPLAY_LATENCY = os.getenv("STORAGE_REPLAY_LATENCY", "false").lower() == "true"
+STORAGE_REPLAY_LATENCY_SCALE = float(os.getenv("STORAGE_REPLAY_LATENCY_SCALE", "1.0"))
+
+
+def create_storage_backend(kind: str = None) -> StorageBackend:
+    """按配置创建存储后端"""
+    kind = (kind or STORAGE_BACKEND).lower()
+    if kind == "replay":
+        from app.storage.recording import ReplayBackend
+        backend = ReplayBackend(
+            STORAGE_REPLAY_PATH,
+            latency=STORAGE_REPLAY_LATENCY,
+            latency_scale=STORAGE_REPLAY_LATENCY_SCALE
+        )
+    elif kind == "sqlite":
+        from app.storage.sqlite_backend import SQLiteBackend, SQLITE_DB_PATH
+        backend = SQLiteBackend(SQLITE_DB_PATH)
+    elif kind == "supabase":
+        from app.config import SUPABASE_URL, SUPABASE_KEY
+        from app.storage.supabase_backend import SupabaseBackend
+        backend = SupabaseBackend(SUPABASE_URL, SUPABASE_KEY)
+    else:
+        raise ValueError(f"未知的存储后端: {kind}（可选 supabase / sqlite / replay）")
+
+    if STORAGE_RECORD_PATH and kind != "replay":
+        from app.storage.recording import RecordingBackend
+        backend = RecordingBackend(backend, STORAGE_RECORD_PATH)
+
+    from app.storage.resilient import READ_RESILIENCE_ENABLED, ResilientBackend
+    if READ_RESILIENCE_ENABLED:
+        backend = ResilientBackend(backend)
+    return backend
+
+
+__all__ = ["QueryResult", "StorageBackend", "create_storage_backend", "STORAGE_BACKEND"]
@@ -0,0 +1,95 @@
+"""
+存储后端接口
+
+所有路由通过 table(name) 返回的查询构造器访问数据，链式接口与 PostgREST 一致：
+    select / insert / upsert / update / delete
+    eq / neq / gt / gte / lt / lte / in_ / is_ / like / ilike
+    order / limit / single / maybe_single
+    execute() -> 结果对象（.data / .count）
+
+包装型后端（录制 / 回放 / 容错）通过 ChainProxy 记录链式调用，在 execute() 时交给包装层处理。
+"""
+import json
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+# 数据体不参与调用匹配的写方法
+WRITE_METHODS = {"insert", "upsert", "update", "delete"}
+_PAYLOAD_METHODS = {"insert", "upsert", "update"}
+
+
+@dataclass
+class QueryResult:
+    """查询结果，与 postgrest APIResponse 的 data / count 属性兼容"""
+    data: Any
+    count: Optional[int] = None
+
+
+class StorageBackend(ABC):
+    """存储后端"""
+
+    name: str = "base"
+
+    @abstractmethod
+    def table(self, name: str) -> Any:
+        """返回指定表的查询构造器"""
+
+    def rpc(self, fn: str, params: dict = None) -> Any:
+        """调用存储过程（不是所有后端都支持）"""
+        raise NotImplementedError(f"{self.name} 存储后端不支持 rpc: {fn}")
+
+    def close(self):
+        """释放连接等资源"""
+
+
+def normalize(value: Any) -> Any:
+    """转换为可 JSON 序列化且顺序稳定的结构"""
+    return json.loads(json.dumps(value, default=str, sort_keys=True, ensure_ascii=False))
+
+
+def call_key(table: str, chain: List[List[Any]]) -> str:
+    """
+    调用链的稳定标识
+
+    写操作的数据体不参与（通常包含时间戳等易变值），
+    in_ 的取值列表排序后参与（路由中常由 set 生成，顺序不固定）
+    """
+    parts = []
+    for method, args, kwargs in chain:
+        if method in _PAYLOAD_METHODS:
+            args = ["<payload>"] + list(args[1:])
+        elif method == "in_" and len(args) == 2:
+            args = [args[0], sorted(args[1], key=str)]
+        parts.append([method, args, kwargs])
+    return json.dumps([table, parts], sort_keys=True, ensure_ascii=False)
+
+
+def is_write(chain: List[List[Any]]) -> bool:
+    """调用链是否为写操作"""
+    return any(method in WRITE_METHODS for method, _, _ in chain)
+
+
+class ChainProxy:
+    """记录链式调用的查询构造器代理，execute() 交给 owner.execute(table, chain, builder)"""
+
+    def __init__(self, owner: Any, table: str, chain: List[List[Any]], builder: Any = None):
+        self._owner = owner
+        self._table = table
+        self._chain = chain
+        self._builder = builder
+
+    def __getattr__(self, name: str):
+        if self._builder is not None:
+            attr = getattr(self._builder, name)
+            if not callable(attr):
+                return attr
+
+        def call(*args, **kwargs):
+            chain = self._chain + [[name, normalize(list(args)), normalize(kwargs)]]
+            builder = getattr(self._builder, name)(*args, **kwargs) if self._builder is not None else None
+            return ChainProxy(self._owner, self._table, chain, builder)
+        return call
+
+    def execute(self):
+        return self._owner.execute(self._table, self._chain, self._builder)
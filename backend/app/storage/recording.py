@@ -0,0 +1,141 @@
+"""
+存储调用录制与回放
+
+录制: RecordingBackend 包装任意后端，把每次 execute() 的调用链、结果与耗时追加写入 JSONL 录像文件
+回放: ReplayBackend 按调用链匹配录像中的响应，可选按录制时的耗时延迟返回
+
+录像中每行一条记录:
+    {"key": ..., "table": ..., "chain": [[方法, 参数, 关键字参数], ...],
+     "data": ..., "count": ..., "error": ..., "latency_ms": ...}
+
+调用链按 base.call_key 匹配（忽略写操作数据体、in_ 取值顺序），
+同一调用链的多条记录按录制顺序依次返回，用完后重复返回最后一条。
+"""
+import json
+import time
+import threading
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from postgrest.exceptions import APIError
+
+from app.storage.base import ChainProxy, QueryResult, StorageBackend, call_key, normalize
+
+
+class CassetteMissError(LookupError):
+    """回放时录像中没有匹配的调用"""
+
+
+class RecordingBackend(StorageBackend):
+    """录制包装：透传到实际后端，同时写入录像文件"""
+
+    def __init__(self, inner: StorageBackend, path: str):
+        self.inner = inner
+        self.path = path
+        self.name = f"recording:{inner.name}"
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        self.recorded = 0
+
+    def table(self, name: str) -> ChainProxy:
+        return ChainProxy(self, name, [], self.inner.table(name))
+
+    def rpc(self, fn: str, params: dict = None) -> ChainProxy:
+        return ChainProxy(self, f"rpc:{fn}", [["rpc", normalize([params or {}]), {}]], self.inner.rpc(fn, params))
+
+    def execute(self, table: str, chain: List[List[Any]], builder: Any):
+        start = time.perf_counter()
+        entry = {"key": call_key(table, chain), "table": table, "chain": chain}
+        try:
+            result = builder.execute()
+        except APIError as e:
+            entry.update(data=None, count=None, error=e.json())
+            self._write(entry, start)
+            raise
+        entry.update(data=normalize(result.data), count=getattr(result, "count", None), error=None)
+        self._write(entry, start)
+        return result
+
+    def _write(self, entry: Dict, start: float):
+        entry["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.recorded += 1
+
+    def __getattr__(self, name: str):
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        self.inner.close()
+
+
+class ReplayBackend(StorageBackend):
+    """
+    回放后端：不访问数据库，按调用链返回录制的结果
+
+    Args:
+        path: 录像文件
+        latency: 是否按录制时的耗时延迟返回
+        latency_scale: 延迟缩放系数
+        strict: 没有匹配记录时抛出 CassetteMissError；否则返回空结果
+    """
+
+    name = "replay"
+
+    def __init__(self, path: str, latency: bool = False, latency_scale: float = 1.0, strict: bool = True):
+        self.path = path
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Deque[Dict]] = defaultdict(deque)
+        self.hits = 0
+        self.misses = 0
+
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]].append(entry)
+
+    def table(self, name: str) -> ChainProxy:
+        return ChainProxy(self, name, [])
+
+    def rpc(self, fn: str, params: dict = None) -> ChainProxy:
+        return ChainProxy(self, f"rpc:{fn}", [["rpc", normalize([params or {}]), {}]])
+
+    def execute(self, table: str, chain: List[List[Any]], builder: Any = None) -> QueryResult:
+        key = call_key(table, chain)
+        with self._lock:
+            queue = self._entries.get(key)
+            entry: Optional[Dict] = None
+            if queue:
+                entry = queue.popleft() if len(queue) > 1 else queue[0]
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is None:
+            if self.strict:
+                raise CassetteMissError(f"录像中没有匹配的调用: {key}")
+            single = any(method in ("single", "maybe_single") for method, _, _ in chain)
+            return QueryResult(data=None if single else [])
+
+        if self.latency and entry.get("latency_ms"):
+            time.sleep(entry["latency_ms"] / 1000 * self.latency_scale)
+        if entry.get("error"):
+            raise APIError(entry["error"])
+        return QueryResult(data=entry["data"], count=entry.get("count"))
+
+    def stats(self) -> Dict:
+        return {
+            "keys": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -0,0 +1,350 @@
+"""
+读路径容错层
+
+包装任意存储后端，对读查询（不含 insert / upsert / update / delete 的调用链）提供：
+- 截止时间：超过 READ_DEADLINE_SECONDS 不再等待，调用线程立即返回
+- 按表熔断：连续不可用（超时 / 连接错误 / 5xx）达到阈值后熔断，冷却期内不再访问数据库
+- 缓存分三段（与 HTTP Cache-Control 的 max-age / stale-while-revalidate / stale-if-error 对应）：
+  - 新鲜期 READ_FRESH_TTL 内直接返回缓存
+  - 之后 READ_STALE_WHILE_REVALIDATE 秒内立即返回缓存，同时在后台刷新（不等待数据库）
+  - 更旧的结果最多保留 READ_STALE_TTL 秒，只在数据库超时、出错或熔断时返回；
+    超时的查询在后台继续执行，完成后刷新缓存
+- 写入后该表的缓存不再直接返回（读到自己的写入），下一次读查询等待数据库
+
+同一查询的并发请求共享一次数据库调用，数据库变慢时不会在线程池中堆积；
+合并等待的请求各自拿到结果的深拷贝（路由会原地修改返回的数据）。
+写操作直接透传，只用于使对应表的新鲜缓存失效。
+
+每次读查询多一次线程切换，默认关闭（READ_RESILIENCE_ENABLED=true 开启）；
+READ_FRESH_TTL、READ_STALE_WHILE_REVALIDATE 与 READ_STALE_TTL 都为 0 时不缓存结果，也不做深拷贝。
+"""
+import os
+import copy
+import time
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from postgrest.exceptions import APIError
+
+from app.services.cache import TTLCache
+from app.storage.base import ChainProxy, QueryResult, StorageBackend, call_key, is_write
+
+logger = logging.getLogger(__name__)
+
+READ_RESILIENCE_ENABLED = os.getenv("READ_RESILIENCE_ENABLED", "false").lower() == "true"
+# 单次读查询的截止时间（秒）
+READ_DEADLINE_SECONDS = float(os.getenv("READ_DEADLINE_SECONDS", "3.0"))
+# 新鲜期（秒）：期内直接返回缓存，不查询数据库
+READ_FRESH_TTL = float(os.getenv("READ_FRESH_TTL", "1"))
+# 新鲜期之后的这段时间（秒）内立即返回缓存并在后台刷新
+READ_STALE_WHILE_REVALIDATE = float(os.getenv("READ_STALE_WHILE_REVALIDATE", "30"))
+# 过期数据最多保留多久用于出错时兜底（秒）
+READ_STALE_TTL = float(os.getenv("READ_STALE_TTL", "300"))
+READ_CACHE_SIZE = int(os.getenv("READ_CACHE_SIZE", "2000"))
+# 执行读查询的线程数
+READ_RESILIENCE_WORKERS = int(os.getenv("READ_RESILIENCE_WORKERS", "16"))
+# 熔断：连续失败次数阈值与冷却时间（秒）
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "10"))
+
+# 表示数据库不可用的 PostgREST 错误码（连接失败、语句超时）
+_UNAVAILABLE_CODES = {"PGRST000", "PGRST001", "PGRST002", "PGRST003", "57014"}
+
+
+class StorageUnavailableError(Exception):
+    """存储暂时不可用且没有可兜底的数据"""
+
+    def __init__(self, message: str, table: str, retry_after: float):
+        super().__init__(message)
+        self.table = table
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(StorageUnavailableError):
+    """表的熔断器处于打开状态"""
+
+
+class DeadlineExceeded(StorageUnavailableError):
+    """读查询超过截止时间"""
+
+
+def is_unavailable(exc: BaseException) -> bool:
+    """异常是否表示数据库不可用（而不是查询本身有误）"""
+    if isinstance(exc, (httpx.TransportError, sqlite3.OperationalError, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(exc, APIError):
+        code = str(exc.code or "")
+        return code in _UNAVAILABLE_CODES or code.startswith("5")
+    return False
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    closed: 正常放行，连续失败达到阈值后 -> open
+    open: 拒绝请求，冷却 reset_timeout 秒后 -> half_open
+    half_open: 只放行一个探测请求，成功 -> closed，失败 -> open
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+        # 指标
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"熔断器恢复: {self.name}")
+            self.state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened += 1
+                    logger.warning(f"熔断器打开: {self.name}（连续失败 {self._failures} 次）")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self.state != "open":
+                return 1.0
+            return max(1.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self._failures,
+                "opened": self.opened,
+                "rejected": self.rejected
+            }
+
+
+class ResilientBackend(StorageBackend):
+    """读路径容错包装"""
+
+    def __init__(self, inner: StorageBackend, deadline: float = READ_DEADLINE_SECONDS,
+                 fresh_ttl: float = READ_FRESH_TTL, revalidate_ttl: float = READ_STALE_WHILE_REVALIDATE,
+                 stale_ttl: float = READ_STALE_TTL, cache_size: int = READ_CACHE_SIZE,
+                 workers: int = READ_RESILIENCE_WORKERS):
+        self.inner = inner
+        self.name = f"resilient:{inner.name}"
+        self.deadline = deadline
+        self.fresh_ttl = fresh_ttl
+        self.revalidate_ttl = revalidate_ttl
+        # 三段时间都为 0 时不缓存结果
+        self.caching = fresh_ttl > 0 or revalidate_ttl > 0 or stale_ttl > 0
+        # key -> (结果数据, count, 获取时间, 表版本)
+        self._cache = TTLCache(maxsize=cache_size, ttl=max(stale_ttl, fresh_ttl + revalidate_ttl))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db-read")
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        # 表 -> 写操作版本号，写入后该表的缓存不再视为新鲜
+        self._versions: Dict[str, int] = {}
+        # key -> 进行中的查询（同一查询共享一次数据库调用）
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+        # 指标
+        self.fresh_hits = 0
+        self.revalidated = 0
+        self.stale_served = 0
+        self.deadline_exceeded = 0
+        self.coalesced = 0
+
+    def table(self, name: str) -> ChainProxy:
+        return ChainProxy(self, name, [], self.inner.table(name))
+
+    def rpc(self, fn: str, params: dict = None) -> Any:
+        return self.inner.rpc(fn, params)
+
+    def breaker(self, table: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(table)
+            if breaker is None:
+                breaker = self._breakers[table] = CircuitBreaker(table)
+            return breaker
+
+    def execute(self, table: str, chain: List[List[Any]], builder: Any):
+        if is_write(chain):
+            result = builder.execute()
+            with self._lock:
+                self._versions[table] = self._versions.get(table, 0) + 1
+            return result
+
+        key = call_key(table, chain)
+        cached = self._cache.get(key) if self.caching else None
+        if cached is not None:
+            age = self._usable_age(table, cached)
+            if age is not None and age < self.fresh_ttl:
+                self.fresh_hits += 1
+                return self._from_cache(cached)
+            if age is not None and age < self.fresh_ttl + self.revalidate_ttl:
+                # stale-while-revalidate：不等待刷新结果
+                self.revalidated += 1
+                self._revalidate(key, table, builder)
+                return self._from_cache(cached)
+
+        # 缓存未命中（或已超过后台刷新期、已被写入失效）：等待数据库
+        breaker = self.breaker(table)
+        if not breaker.allow():
+            if cached is not None:
+                return self._serve_stale(table, cached, "熔断")
+            raise CircuitOpenError(f"存储暂时不可用: {table}", table, breaker.retry_after())
+
+        future, owner = self._submit(key, table, builder)
+        try:
+            result = future.result(timeout=self.deadline)
+            if owner:
+                return result
+            return QueryResult(data=copy.deepcopy(result.data), count=getattr(result, "count", None))
+        except FutureTimeoutError:
+            self.deadline_exceeded += 1
+            # 查询在后台继续执行，完成后刷新缓存
+            self._count_deadline(table, future.flags)
+            if cached is not None:
+                return self._serve_stale(table, cached, "超时")
+            raise DeadlineExceeded(f"读查询超时: {table}", table, breaker.retry_after())
+        except Exception as e:
+            if cached is not None and is_unavailable(e):
+                return self._serve_stale(table, cached, "出错")
+            raise
+
+    def _revalidate(self, key: str, table: str, builder: Any):
+        """在后台刷新缓存；熔断期间不刷新，已有同一查询在执行时不重复提交"""
+        with self._lock:
+            if key in self._in_flight:
+                return
+        if self.breaker(table).allow():
+            self._submit(key, table, builder)
+
+    def _submit(self, key: str, table: str, builder: Any) -> Tuple[Future, bool]:
+        """返回 (查询, 是否由本次调用发起)；合并到进行中查询的调用方需要自行拷贝结果"""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            version = self._versions.get(table, 0)
+            # 同一次查询超时只计一次熔断失败（等待方与后台刷新共用）
+            flags = {"deadline_counted": False}
+            future = self._executor.submit(self._fetch, key, table, builder, version, flags)
+            future.flags = flags
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._finish(key))
+            return future, True
+
+    def _finish(self, key: str):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def _count_deadline(self, table: str, flags: Dict):
+        with self._lock:
+            if flags["deadline_counted"]:
+                return
+            flags["deadline_counted"] = True
+        self.breaker(table).record_failure()
+
+    def _fetch(self, key: str, table: str, builder: Any, version: int, flags: Dict):
+        breaker = self.breaker(table)
+        start = time.monotonic()
+        try:
+            result = builder.execute()
+        except Exception as e:
+            if time.monotonic() - start > self.deadline:
+                self._count_deadline(table, flags)
+            elif is_unavailable(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        if time.monotonic() - start > self.deadline:
+            # 后台刷新没有等待方，超时由这里计入熔断
+            self._count_deadline(table, flags)
+        else:
+            breaker.record_success()
+        if not self.caching:
+            return result
+        # 深拷贝：路由会原地修改返回的数据
+        self._cache.set(key, (copy.deepcopy(result.data), getattr(result, "count", None), time.monotonic(), version))
+        return result
+
+    def _usable_age(self, table: str, cached: tuple) -> Optional[float]:
+        """缓存的年龄（秒）；之后该表有过写入时返回 None（只用于出错兜底）"""
+        _, _, fetched_at, version = cached
+        if version != self._versions.get(table, 0):
+            return None
+        return time.monotonic() - fetched_at
+
+    def _from_cache(self, cached: tuple) -> QueryResult:
+        data, count, _, _ = cached
+        return QueryResult(data=copy.deepcopy(data), count=count)
+
+    def _serve_stale(self, table: str, cached: tuple, reason: str) -> QueryResult:
+        self.stale_served += 1
+        age = time.monotonic() - cached[2]
+        logger.warning(f"返回过期数据（{reason}）: {table}，数据已有 {age:.1f} 秒")
+        return self._from_cache(cached)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            breakers = {table: breaker.stats() for table, breaker in self._breakers.items()}
+            in_flight = len(self._in_flight)
+        inner_stats = self.inner.stats() if hasattr(self.inner, "stats") else None
+        return {
+            "deadline_seconds": self.deadline,
+            "fresh_ttl": self.fresh_ttl,
+            "revalidate_ttl": self.revalidate_ttl,
+            "caching": self.caching,
+            "fresh_hits": self.fresh_hits,
+            "revalidated": self.revalidated,
+            "stale_served": self.stale_served,
+            "deadline_exceeded": self.deadline_exceeded,
+            "coalesced": self.coalesced,
+            "in_flight": in_flight,
+            "cache": self._cache.stats(),
+            "breakers": breakers,
+            "inner": inner_stats
+        }
+
+    def __getattr__(self, name: str):
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.inner.close()
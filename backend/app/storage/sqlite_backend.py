@@ -0,0 +1,611 @@
+"""
+SQLite 存储后端（WAL 模式）
+
+用于单机部署（小型救助站一台机器即可运行）与离线基准测试。
+表结构对应 database_schema.sql 与 supabase/migrations/20250205_ai_features.sql：
+- UUID 主键由应用生成
+- 数组 / JSONB / VECTOR 列以 JSON 文本存储，读取时自动解码
+- BOOLEAN 列以 0/1 存储，读取时转换为 bool
+- 时间戳以 ISO 8601（UTC）文本存储
+
+查询构造器实现路由中用到的 PostgREST 子集，包括多对一的嵌入查询，
+如 "*, pets!inner(*)" 与 "*, owner:users(name, role, avatar_url)"。
+"""
+import os
+import re
+import json
+import uuid
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from postgrest.exceptions import APIError
+
+from app.storage.base import QueryResult, StorageBackend
+
+SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", "pawpal.db")
+
+# ==================== 表结构 ====================
+
+# 列类型: uuid / text / int / real / bool / json / timestamp
+SCHEMA: Dict[str, Dict[str, str]] = {
+    "users": {
+        "id": "uuid", "email": "text", "password_hash": "text", "name": "text",
+        "avatar_url": "text", "role": "text",
+    },
+    "pets": {
+        "id": "uuid", "name": "text", "breed": "text", "age_text": "text", "age_value": "int",
+        "image_url": "text", "category": "text", "price": "text", "gender": "text", "weight": "text",
+        "tags": "json", "description": "text", "location": "text", "owner_id": "uuid",
+        "health_info": "json", "created_at": "timestamp",
+        # AI 功能扩展字段
+        "size_category": "text", "energy_level": "text", "sociability": "text", "trainability": "text",
+        "shedding_level": "text", "grooming_needs": "text", "exercise_needs": "text",
+        "good_with_kids": "bool", "good_with_dogs": "bool", "good_with_cats": "bool",
+        "good_with_strangers": "bool", "special_needs": "json", "min_space_requirement": "text",
+        "needs_yard": "bool", "pet_embedding": "json", "success_rate": "real",
+    },
+    "favorites": {
+        "user_id": "uuid", "pet_id": "uuid",
+    },
+    "conversations": {
+        "id": "uuid", "user_id": "uuid", "pet_id": "uuid", "updated_at": "timestamp",
+    },
+    "applications": {
+        "id": "uuid", "pet_id": "uuid", "user_id": "uuid", "full_name": "text", "phone": "text",
+        "occupation": "text", "housing": "text", "has_experience": "bool", "reason": "text",
+        "status": "text", "created_at": "timestamp",
+    },
+    "messages": {
+        "id": "uuid", "conversation_id": "uuid", "sender_id": "uuid", "content": "text",
+        "read": "bool", "created_at": "timestamp",
+    },
+    "adopter_profiles": {
+        "id": "uuid", "user_id": "uuid", "living_space": "text", "has_yard": "bool",
+        "is_renting": "bool", "landlord_allows_pets": "bool", "budget_level": "text",
+        "income_stability": "text", "daily_time_available": "int", "work_schedule": "text",
+        "work_hours_per_day": "int", "experience_level": "text", "previous_pets": "json",
+        "training_willingness": "text", "family_status": "text", "household_size": "int",
+        "preferred_size": "text", "preferred_age": "text", "preferred_temperament": "json",
+        "activity_level": "text", "other_pets": "json", "noise_tolerance": "text",
+        "shedding_tolerance": "text", "grooming_willingness": "text", "has_allergies": "bool",
+        "allergy_details": "text", "must_have_traits": "json", "deal_breakers": "json",
+        "profile_embedding": "json", "created_at": "timestamp", "updated_at": "timestamp",
+    },
+    "adoption_feedback": {
+        "id": "uuid", "application_id": "uuid", "pet_id": "uuid", "user_id": "uuid",
+        "outcome": "text", "duration_days": "int", "feedback_text": "text", "rating": "int",
+        "issues": "json", "adopter_profile_summary": "json", "profile_embedding": "json",
+        "created_at": "timestamp", "updated_at": "timestamp",
+    },
+    "precheck_sessions": {
+        "id": "uuid", "session_id": "text", "user_id": "uuid", "pet_id": "uuid", "state": "text",
+        "is_complete": "bool", "turn_count": "int", "collected_data": "json",
+        "confirmed_info": "json", "identified_risks": "json", "clarified_risks": "json",
+        "chat_history": "json", "result": "json", "created_at": "timestamp",
+        "updated_at": "timestamp", "expires_at": "timestamp",
+    },
+    "ai_precheck_results": {
+        "id": "uuid", "application_id": "uuid", "passed": "bool", "score": "int",
+        "risk_level": "text", "risk_points": "json", "suggestions": "json",
+        "auto_approved": "bool", "review_report": "text", "session_id": "text",
+        "created_at": "timestamp", "updated_at": "timestamp",
+    },
+}
+
+# 列约束与默认值（未列出的列可为空）
+COLUMN_DDL: Dict[Tuple[str, str], str] = {
+    ("users", "email"): "NOT NULL UNIQUE",
+    ("users", "role"): "DEFAULT 'user'",
+    ("pets", "name"): "NOT NULL",
+    ("pets", "good_with_kids"): "DEFAULT 1",
+    ("pets", "good_with_dogs"): "DEFAULT 1",
+    ("pets", "good_with_cats"): "DEFAULT 1",
+    ("pets", "good_with_strangers"): "DEFAULT 1",
+    ("pets", "needs_yard"): "DEFAULT 0",
+    ("favorites", "user_id"): "NOT NULL",
+    ("conversations", "user_id"): "NOT NULL",
+    ("applications", "pet_id"): "NOT NULL",
+    ("applications", "user_id"): "NOT NULL",
+    ("applications", "full_name"): "NOT NULL",
+    ("applications", "phone"): "NOT NULL",
+    ("applications", "status"): "DEFAULT 'pending'",
+    ("messages", "sender_id"): "NOT NULL",
+    ("messages", "read"): "DEFAULT 0",
+    ("adopter_profiles", "user_id"): "UNIQUE",
+    ("adopter_profiles", "has_yard"): "DEFAULT 0",
+    ("adopter_profiles", "has_allergies"): "DEFAULT 0",
+    ("precheck_sessions", "session_id"): "NOT NULL UNIQUE",
+    ("precheck_sessions", "state"): "NOT NULL",
+    ("precheck_sessions", "is_complete"): "DEFAULT 0",
+    ("precheck_sessions", "turn_count"): "DEFAULT 0",
+    ("ai_precheck_results", "application_id"): "UNIQUE",
+    ("ai_precheck_results", "passed"): "NOT NULL",
+    ("ai_precheck_results", "auto_approved"): "DEFAULT 0",
+}
+
+PRIMARY_KEYS: Dict[str, Tuple[str, ...]] = {
+    table: ("id",) for table in SCHEMA
+}
+PRIMARY_KEYS["favorites"] = ("user_id", "pet_id")
+
+# 路由中的查询模式对应的索引
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_pets_owner_id ON pets(owner_id)",
+    "CREATE INDEX IF NOT EXISTS idx_pets_success_rate ON pets(success_rate)",
+    "CREATE INDEX IF NOT EXISTS idx_favorites_pet_id ON favorites(pet_id)",
+    "CREATE INDEX IF NOT EXISTS idx_conversations_user_id ON conversations(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_conversations_pet_id ON conversations(pet_id, user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_applications_user_id ON applications(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_applications_pet_status ON applications(pet_id, status)",
+    "CREATE INDEX IF NOT EXISTS idx_applications_created_at ON applications(created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_conversation_created ON messages(conversation_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_adoption_feedback_pet_id ON adoption_feedback(pet_id)",
+    "CREATE INDEX IF NOT EXISTS idx_adoption_feedback_user_id ON adoption_feedback(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_adoption_feedback_outcome ON adoption_feedback(outcome)",
+    "CREATE INDEX IF NOT EXISTS idx_precheck_sessions_user_id ON precheck_sessions(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_precheck_sessions_expires ON precheck_sessions(expires_at)",
+    "CREATE INDEX IF NOT EXISTS idx_ai_precheck_results_risk_level ON ai_precheck_results(risk_level)",
+]
+
+# 多对一关系: (表, 关联表) -> 外键列；用于 "pets!inner(*)"、"owner:users(...)" 等嵌入查询
+RELATIONS: Dict[Tuple[str, str], str] = {
+    ("pets", "users"): "owner_id",
+    ("favorites", "pets"): "pet_id",
+    ("conversations", "pets"): "pet_id",
+    ("applications", "pets"): "pet_id",
+    ("messages", "conversations"): "conversation_id",
+    ("adopter_profiles", "users"): "user_id",
+    ("adoption_feedback", "applications"): "application_id",
+    ("adoption_feedback", "pets"): "pet_id",
+    ("precheck_sessions", "pets"): "pet_id",
+    ("ai_precheck_results", "applications"): "application_id",
+}
+
+_SQL_TYPES = {
+    "uuid": "TEXT", "text": "TEXT", "int": "INTEGER", "real": "REAL",
+    "bool": "INTEGER", "json": "TEXT", "timestamp": "TEXT",
+}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _schema_sql() -> List[str]:
+    statements = []
+    for table, columns in SCHEMA.items():
+        column_defs = []
+        for column, column_type in columns.items():
+            ddl = COLUMN_DDL.get((table, column), "")
+            column_defs.append(f'"{column}" {_SQL_TYPES[column_type]} {ddl}'.strip())
+        pk = ", ".join(f'"{column}"' for column in PRIMARY_KEYS[table])
+        column_defs.append(f"PRIMARY KEY ({pk})")
+        statements.append(f'CREATE TABLE IF NOT EXISTS "{table}" ({", ".join(column_defs)})')
+    return statements + INDEXES
+
+
+def _api_error(message: str, code: str) -> APIError:
+    return APIError({"message": message, "code": code, "hint": None, "details": None})
+
+
+# ==================== 查询构造器 ====================
+
+class SQLiteQuery:
+    """PostgREST 风格的查询构造器"""
+
+    def __init__(self, backend: "SQLiteBackend", table: str):
+        if table not in SCHEMA:
+            raise _api_error(f'relation "{table}" does not exist', "42P01")
+        self._backend = backend
+        self._table = table
+        self._columns = SCHEMA[table]
+        self._op = "select"
+        self._select = "*"
+        self._values: Any = None
+        self._on_conflict: Optional[str] = None
+        self._ignore_duplicates = False
+        self._filters: List[Tuple[str, str, Any]] = []
+        self._order: List[Tuple[str, bool]] = []
+        self._limit: Optional[int] = None
+        self._offset: Optional[int] = None
+        self._single = False
+        self._maybe_single = False
+        self._count: Optional[str] = None
+
+    # ---------- 操作 ----------
+
+    def select(self, *columns: str, count: Optional[str] = None):
+        self._op = "select"
+        self._select = ",".join(columns) if columns else "*"
+        self._count = count
+        return self
+
+    def insert(self, values, count: Optional[str] = None, returning: str = "representation", upsert: bool = False, **kwargs):
+        self._op = "upsert" if upsert else "insert"
+        self._values = values
+        return self
+
+    def upsert(self, values, on_conflict: str = "", ignore_duplicates: bool = False, **kwargs):
+        self._op = "upsert"
+        self._values = values
+        self._on_conflict = on_conflict or None
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, values: Dict, **kwargs):
+        self._op = "update"
+        self._values = values
+        return self
+
+    def delete(self, **kwargs):
+        self._op = "delete"
+        return self
+
+    # ---------- 过滤 ----------
+
+    def _filter(self, column: str, operator: str, value: Any):
+        self._filters.append((column, operator, value))
+        return self
+
+    def eq(self, column: str, value: Any):
+        return self._filter(column, "=", value)
+
+    def neq(self, column: str, value: Any):
+        return self._filter(column, "!=", value)
+
+    def gt(self, column: str, value: Any):
+        return self._filter(column, ">", value)
+
+    def gte(self, column: str, value: Any):
+        return self._filter(column, ">=", value)
+
+    def lt(self, column: str, value: Any):
+        return self._filter(column, "<", value)
+
+    def lte(self, column: str, value: Any):
+        return self._filter(column, "<=", value)
+
+    def like(self, column: str, pattern: str):
+        return self._filter(column, "LIKE", pattern.replace("*", "%"))
+
+    def ilike(self, column: str, pattern: str):
+        return self._filter(column, "ILIKE", pattern.replace("*", "%"))
+
+    def in_(self, column: str, values):
+        return self._filter(column, "IN", list(values))
+
+    def is_(self, column: str, value: Any):
+        return self._filter(column, "IS", value)
+
+    def order(self, column: str, desc: bool = False, **kwargs):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, size: int, **kwargs):
+        self._limit = size
+        return self
+
+    def range(self, start: int, end: int, **kwargs):
+        self._offset = start
+        self._limit = end - start + 1
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def maybe_single(self):
+        self._maybe_single = True
+        return self
+
+    # ---------- 执行 ----------
+
+    def execute(self) -> QueryResult:
+        if self._op == "select":
+            rows = self._run_select()
+        elif self._op in ("insert", "upsert"):
+            rows = self._run_insert()
+        elif self._op == "update":
+            rows = self._run_update()
+        else:
+            rows = self._run_delete()
+
+        count = len(rows) if self._count else None
+        if self._single or self._maybe_single:
+            if len(rows) == 1:
+                return QueryResult(data=rows[0], count=count)
+            if self._maybe_single and not rows:
+                return QueryResult(data=None, count=count)
+            raise _api_error(
+                "JSON object requested, multiple (or no) rows returned", "PGRST116"
+            )
+        return QueryResult(data=rows, count=count)
+
+    def _check_column(self, column: str):
+        if column not in self._columns:
+            raise _api_error(f"column {self._table}.{column} does not exist", "42703")
+
+    def _where(self) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        for column, operator, value in self._filters:
+            self._check_column(column)
+            column_sql = f'"{column}"'
+            if operator == "IN":
+                if not value:
+                    clauses.append("0")
+                    continue
+                clauses.append(f"{column_sql} IN ({', '.join('?' * len(value))})")
+                params.extend(self._encode(column, v) for v in value)
+            elif operator == "IS":
+                if value is None or value == "null":
+                    clauses.append(f"{column_sql} IS NULL")
+                else:
+                    clauses.append(f"{column_sql} IS ?")
+                    params.append(self._encode(column, value in (True, "true")))
+            elif operator == "ILIKE":
+                clauses.append(f"{column_sql} LIKE ? COLLATE NOCASE")
+                params.append(value)
+            else:
+                clauses.append(f"{column_sql} {operator} ?")
+                params.append(self._encode(column, value))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _encode(self, column: str, value: Any) -> Any:
+        column_type = self._columns[column]
+        if value is None:
+            return None
+        if column_type == "bool":
+            if isinstance(value, str):
+                return 1 if value.lower() == "true" else 0
+            return 1 if value else 0
+        if column_type == "json":
+            return json.dumps(value, ensure_ascii=False)
+        if column_type == "timestamp" and value == "now()":
+            return _now()
+        if column_type == "timestamp" and isinstance(value, datetime):
+            return value.isoformat()
+        return value
+
+    def _decode_row(self, row: sqlite3.Row, table: str, columns: List[str]) -> Dict:
+        types = SCHEMA[table]
+        result = {}
+        for column in columns:
+            value = row[column]
+            column_type = types[column]
+            if value is not None:
+                if column_type == "bool":
+                    value = bool(value)
+                elif column_type == "json":
+                    value = json.loads(value)
+            result[column] = value
+        return result
+
+    def _run_select(self) -> List[Dict]:
+        columns, embeds = _parse_select(self._table, self._select)
+        where, params = self._where()
+        sql = f'SELECT * FROM "{self._table}"{where}'
+        for column, _ in self._order:
+            self._check_column(column)
+        if self._order:
+            sql += " ORDER BY " + ", ".join(f'"{c}" {"DESC" if d else "ASC"}' for c, d in self._order)
+        if self._limit is not None:
+            sql += f" LIMIT {int(self._limit)}"
+            if self._offset:
+                sql += f" OFFSET {int(self._offset)}"
+
+        conn = self._backend.connection()
+        raw_rows = conn.execute(sql, params).fetchall()
+        rows = [self._decode_row(row, self._table, columns) for row in raw_rows]
+        if embeds:
+            rows = self._backend.embed(self._table, raw_rows, rows, embeds)
+        return rows
+
+    def _prepare_values(self, values: Dict) -> Dict:
+        for column in values:
+            self._check_column(column)
+        record = {column: self._encode(column, value) for column, value in values.items()}
+        # 应用侧生成主键与时间戳默认值
+        if self._columns.get("id") == "uuid" and not record.get("id"):
+            record["id"] = str(uuid.uuid4())
+        for column in ("created_at", "updated_at"):
+            if column in self._columns and record.get(column) is None:
+                record[column] = _now()
+        if self._table == "precheck_sessions" and record.get("expires_at") is None:
+            record["expires_at"] = datetime.fromtimestamp(
+                datetime.now(timezone.utc).timestamp() + 24 * 3600, timezone.utc
+            ).isoformat()
+        return record
+
+    def _run_insert(self) -> List[Dict]:
+        values = self._values if isinstance(self._values, list) else [self._values]
+        conflict_columns = (
+            [c.strip() for c in self._on_conflict.split(",")] if self._on_conflict
+            else list(PRIMARY_KEYS[self._table])
+        )
+        conn = self._backend.connection()
+        keys = []
+        with self._backend.write_lock:
+            try:
+                for value in values:
+                    record = self._prepare_values(value)
+                    columns = list(record)
+                    sql = (
+                        f'INSERT INTO "{self._table}" ({", ".join(f"{chr(34)}{c}{chr(34)}" for c in columns)}) '
+                        f'VALUES ({", ".join("?" * len(columns))})'
+                    )
+                    if self._op == "upsert":
+                        updates = [c for c in columns if c not in conflict_columns and c not in ("id", "created_at")]
+                        target = ", ".join(f'"{c}"' for c in conflict_columns)
+                        if updates and not self._ignore_duplicates:
+                            sql += f" ON CONFLICT ({target}) DO UPDATE SET " + ", ".join(
+                                f'"{c}" = excluded."{c}"' for c in updates
+                            )
+                        else:
+                            sql += f" ON CONFLICT ({target}) DO NOTHING"
+                    conn.execute(sql, [record[c] for c in columns])
+                    keys.append({c: record[c] for c in conflict_columns})
+                conn.commit()
+            except sqlite3.IntegrityError as e:
+                conn.rollback()
+                raise _api_error(str(e), "23505")
+
+        rows = []
+        for key in keys:
+            where = " AND ".join(f'"{c}" = ?' for c in key)
+            row = conn.execute(f'SELECT * FROM "{self._table}" WHERE {where}', list(key.values())).fetchone()
+            if row is not None:
+                rows.append(self._decode_row(row, self._table, list(self._columns)))
+        return rows
+
+    def _run_update(self) -> List[Dict]:
+        for column in self._values:
+            self._check_column(column)
+        record = {column: self._encode(column, value) for column, value in self._values.items()}
+        where, params = self._where()
+        conn = self._backend.connection()
+        with self._backend.write_lock:
+            rowids = [r[0] for r in conn.execute(f'SELECT rowid FROM "{self._table}"{where}', params).fetchall()]
+            if rowids and record:
+                assignments = ", ".join(f'"{c}" = ?' for c in record)
+                placeholders = ", ".join("?" * len(rowids))
+                conn.execute(
+                    f'UPDATE "{self._table}" SET {assignments} WHERE rowid IN ({placeholders})',
+                    list(record.values()) + rowids
+                )
+                conn.commit()
+        if not rowids:
+            return []
+        placeholders = ", ".join("?" * len(rowids))
+        raw_rows = conn.execute(f'SELECT * FROM "{self._table}" WHERE rowid IN ({placeholders})', rowids).fetchall()
+        return [self._decode_row(row, self._table, list(self._columns)) for row in raw_rows]
+
+    def _run_delete(self) -> List[Dict]:
+        where, params = self._where()
+        conn = self._backend.connection()
+        with self._backend.write_lock:
+            raw_rows = conn.execute(f'SELECT * FROM "{self._table}"{where}', params).fetchall()
+            if raw_rows:
+                conn.execute(f'DELETE FROM "{self._table}"{where}', params)
+                conn.commit()
+        return [self._decode_row(row, self._table, list(self._columns)) for row in raw_rows]
+
+
+# ==================== select 解析 ====================
+
+_EMBED_RE = re.compile(r"^(?:(?P<alias>\w+):)?(?P<table>\w+)(?P<inner>!inner)?\((?P<columns>.*)\)$", re.S)
+
+
+def _split_top_level(text: str) -> List[str]:
+    """按顶层逗号拆分 select 字符串（忽略括号内的逗号）"""
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    if "".join(current).strip():
+        parts.append("".join(current).strip())
+    return parts
+
+
+def _parse_select(table: str, select: str) -> Tuple[List[str], List[Dict]]:
+    """
+    解析 select 字符串
+
+    Returns:
+        (本表列名列表, 嵌入查询列表 [{alias, table, inner, select}])
+    """
+    columns, embeds = [], []
+    for part in _split_top_level(select or "*"):
+        match = _EMBED_RE.match(part)
+        if match:
+            target = match.group("table")
+            if (table, target) not in RELATIONS:
+                raise _api_error(f"Could not find a relationship between '{table}' and '{target}'", "PGRST200")
+            embeds.append({
+                "alias": match.group("alias") or target,
+                "table": target,
+                "inner": bool(match.group("inner")),
+                "select": match.group("columns") or "*",
+            })
+        elif part == "*":
+            columns.extend(c for c in SCHEMA[table] if c not in columns)
+        else:
+            if part not in SCHEMA[table]:
+                raise _api_error(f"column {table}.{part} does not exist", "42703")
+            if part not in columns:
+                columns.append(part)
+    return columns, embeds
+
+
+# ==================== 后端 ====================
+
+class SQLiteBackend(StorageBackend):
+    """SQLite 存储后端：每个线程一个连接，写操作加锁串行化"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_DB_PATH):
+        self.path = path
+        self.write_lock = threading.Lock()
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        conn = self.connection()
+        with self.write_lock:
+            for statement in _schema_sql():
+                conn.execute(statement)
+            conn.commit()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=OFF")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def table(self, name: str) -> SQLiteQuery:
+        return SQLiteQuery(self, name)
+
+    def embed(self, table: str, raw_rows: List[sqlite3.Row], rows: List[Dict], embeds: List[Dict]) -> List[Dict]:
+        """为结果行附加多对一嵌入对象，!inner 时过滤掉没有关联记录的行"""
+        keep = [True] * len(rows)
+        for embed in embeds:
+            fk = RELATIONS[(table, embed["table"])]
+            target_ids = list({row[fk] for row in raw_rows if row[fk] is not None})
+            related = {}
+            if target_ids:
+                columns, _ = _parse_select(embed["table"], embed["select"])
+                # 关联查询需要 id 列建立映射，但只返回请求的列
+                select = embed["select"] if "id" in columns else "id," + embed["select"]
+                result = SQLiteQuery(self, embed["table"]).select(select).in_("id", target_ids).execute()
+                for item in result.data:
+                    key = item["id"] if "id" in columns else item.pop("id")
+                    related[key] = item
+            for index, (raw, row) in enumerate(zip(raw_rows, rows)):
+                value = related.get(raw[fk])
+                row[embed["alias"]] = value
+                if embed["inner"] and value is None:
+                    keep[index] = False
+        return [row for row, kept in zip(rows, keep) if kept]
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
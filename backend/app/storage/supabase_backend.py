@@ -0,0 +1,34 @@
+"""
+Supabase 存储后端（托管 Postgres + PostgREST）
+"""
+import os
+from typing import Any
+from supabase import create_client, Client, ClientOptions
+
+from app.services.http_pool import http_pool
+from app.storage.base import StorageBackend
+
+# PostgREST 请求超时（秒）；读查询另有容错层的截止时间
+SUPABASE_HTTP_TIMEOUT = float(os.getenv("SUPABASE_HTTP_TIMEOUT", "30"))
+
+
+class SupabaseBackend(StorageBackend):
+    """直接使用 supabase 客户端的查询构造器，HTTP 请求走共享连接池"""
+
+    name = "supabase"
+
+    def __init__(self, url: str, key: str):
+        http_client = http_pool.sync_client("supabase", timeout=SUPABASE_HTTP_TIMEOUT, follow_redirects=True)
+        self.client: Client = create_client(url, key, options=ClientOptions(httpx_client=http_client))
+
+    def table(self, name: str) -> Any:
+        return self.client.table(name)
+
+    def rpc(self, fn: str, params: dict = None) -> Any:
+        return self.client.rpc(fn, params or {})
+
+    def __getattr__(self, name: str):
+        # auth / storage 等其他 supabase 功能透传
+        if name == "client":
+            raise AttributeError(name)
+        return getattr(self.client, name)
@@ -1,174 +1,498 @@
 """
 WebSocket 连接管理器
-管理所有 WebSocket 连接，支持按用户ID和聊天室ID分组
+管理所有 WebSocket 连接的收发；聊天室、用户索引与广播由实时推送中心负责
+（与 SSE 共用，见 app/services/realtime_hub.py），这里是 WebSocket 传输层的适配。
+
+聊天室索引直接记录加入该聊天室的连接（而不是用户），广播只触达订阅了该聊天室的连接，
+加入 / 离开 / 断开都是 O(1)（断开为 O(该连接加入的聊天室数)）。
+
+每个连接有一个有界发送队列和独立的写协程：
+- 广播只把消息放入各连接的队列，不等待发送完成，慢客户端不会拖慢其他人
+- 队列满（客户端接收过慢）时断开该连接，避免内存无限增长
+- 记录消息从入队到发送完成的延迟（扇出延迟）
+
+广播（聊天室 / 用户 / 全体）经推送中心发布到实时总线，每个 worker 只投递给自己持有的连接，
+同一条消息同时到达 WebSocket 与 SSE 客户端。
+
+消息格式按连接协商（JSON 文本帧或 MessagePack 二进制帧，见 app/ws_codec.py），
+广播时每种格式只编码一次。
+
+连接、断开、加入 / 离开聊天室由推送中心计入在线状态服务（与 SSE 合计，跨 worker）。
+
+存活检测集中在一个后台协程：所有连接按下一次到期时间挂在时间轮上，
+到期时发送心跳，超过 WS_IDLE_TIMEOUT 没有收到任何消息的连接批量断开。
+
+打字状态按（聊天室, 用户）合并：每个间隔最多广播一次 typing，空闲后补发一次 typing_stopped。
 """
-from typing import Dict, List, Set
-from fastapi import WebSocket
-import json
+from typing import Dict, Hashable, List, Optional, Set, Tuple, Union
+from collections import Counter, deque
+from fastapi import WebSocket, WebSocketDisconnect
+import os
+import math
+import time
+import asyncio
 import logging
 
+from app.services.realtime_hub import RealtimeHub, realtime_hub
+from app.ws_codec import JSON_CODEC, MsgPackCodec, negotiate
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 每个连接最多积压的待发送消息数
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# 单条消息的发送超时（秒），超时视为连接失效
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+# 慢客户端断开时使用的关闭码（1013: Try Again Later）
+WS_SLOW_CONSUMER_CLOSE_CODE = 1013
+# 服务器向每个连接发送心跳的间隔（秒），需小于代理的空闲超时
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "25"))
+# 超过该时间（秒）没有收到客户端任何消息的连接视为失效并断开（客户端每 30 秒发送一次 ping）
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "90"))
+# 时间轮的刻度（秒）：心跳与空闲检查的时间精度
+WS_HEARTBEAT_TICK = float(os.getenv("WS_HEARTBEAT_TICK", "1"))
+# 空闲断开时使用的关闭码（1001: Going Away）
+WS_IDLE_CLOSE_CODE = 1001
+# 同一用户在同一聊天室每隔多少秒最多广播一次"正在输入"
+WS_TYPING_INTERVAL = float(os.getenv("WS_TYPING_INTERVAL", "3"))
+# 最后一次 typing 之后空闲多少秒广播"停止输入"
+WS_TYPING_IDLE = float(os.getenv("WS_TYPING_IDLE", "5"))
+
+
+class FanoutMetrics:
+    """扇出延迟统计：保留最近的样本计算分位数"""
+
+    def __init__(self, samples: int = 2048):
+        self._samples: deque = deque(maxlen=samples)
+        self.delivered = 0
+        self.max_ms = 0.0
+
+    def record(self, latency: float):
+        latency_ms = latency * 1000
+        self._samples.append(latency_ms)
+        self.delivered += 1
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def snapshot(self) -> Dict:
+        ordered = sorted(self._samples)
+
+        def percentile(q: float) -> float:
+            if not ordered:
+                return 0.0
+            return round(ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))], 3)
+
+        return {
+            "delivered": self.delivered,
+            "p50_ms": percentile(50),
+            "p95_ms": percentile(95),
+            "p99_ms": percentile(99),
+            "max_ms": round(self.max_ms, 3)
+        }
+
+
+class TimerWheel:
+    """
+    时间轮：按到期时间把对象放入环形槽位，每个刻度只取出到期槽位中的对象
+
+    到期时间超出一圈的对象会提前取出，由调用方检查真实到期时间后重新放入。
+    """
+
+    def __init__(self, tick: float, span: float):
+        self.tick = tick
+        self._slots: List[Set[Hashable]] = [set() for _ in range(int(math.ceil(span / tick)) + 1)]
+        # 对象 -> 所在槽位
+        self._slot_of: Dict[Hashable, int] = {}
+        self._current = int(time.monotonic() / tick)
+
+    def schedule(self, item: Hashable, deadline: float):
+        self.remove(item)
+        # 最早放到下一个刻度，避免放进正在处理的槽位
+        index = max(int(math.ceil(deadline / self.tick)), self._current + 1)
+        slot = index % len(self._slots)
+        self._slots[slot].add(item)
+        self._slot_of[item] = slot
+
+    def remove(self, item: Hashable):
+        slot = self._slot_of.pop(item, None)
+        if slot is not None:
+            self._slots[slot].discard(item)
+
+    def advance(self, now: float) -> List[Hashable]:
+        """推进到 now，返回经过的槽位中的全部对象"""
+        target = int(now / self.tick)
+        steps = min(target - self._current, len(self._slots))
+        due: List[Hashable] = []
+        for step in range(1, steps + 1):
+            slot = (self._current + step) % len(self._slots)
+            items = self._slots[slot]
+            if items:
+                for item in items:
+                    del self._slot_of[item]
+                due.extend(items)
+                self._slots[slot] = set()
+        self._current = max(self._current, target)
+        return due
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+
+class WebSocketConnection:
+    """推送中心中的一个 WebSocket 连接：按协商的格式接收已编码的消息，放入发送队列"""
+
+    __slots__ = ("manager", "websocket", "user_id", "chats", "wire")
+
+    def __init__(self, manager: "ConnectionManager", websocket: WebSocket, user_id: str, wire: str):
+        self.manager = manager
+        self.websocket = websocket
+        self.user_id = user_id
+        # 加入的聊天室（由推送中心维护）
+        self.chats: Set[str] = set()
+        self.wire = wire
+
+    def deliver(self, payload: Union[str, bytes]):
+        self.manager._enqueue(self.websocket, payload, time.perf_counter())
+
 
 class ConnectionManager:
     """WebSocket 连接管理器"""
-    
-    def __init__(self):
-        # 用户ID -> WebSocket 连接列表（一个用户可能有多个连接，如多设备登录）
-        self.user_connections: Dict[str, List[WebSocket]] = {}
-        # 聊天室ID -> 用户ID 集合
-        self.chat_rooms: Dict[str, Set[str]] = {}
-        # WebSocket -> 用户信息映射
+
+    def __init__(self, queue_size: int = WS_SEND_QUEUE_SIZE, send_timeout: float = WS_SEND_TIMEOUT,
+                 hub: RealtimeHub = realtime_hub,
+                 heartbeat_interval: float = WS_HEARTBEAT_INTERVAL, idle_timeout: float = WS_IDLE_TIMEOUT,
+                 tick: float = WS_HEARTBEAT_TICK):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        # 心跳与空闲检查共用一个时间轮和一个后台协程
+        self.wheel = TimerWheel(tick, max(heartbeat_interval, idle_timeout))
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self.hub = hub
+        # 两种 WebSocket 消息格式的编码（推送中心每条消息每种格式只调用一次）
+        for codec in (JSON_CODEC, MsgPackCodec()):
+            hub.register_encoder(codec.name, lambda message, event_id, codec=codec: codec.encode(message))
+        # WebSocket -> 连接信息（推送中心中的连接、聊天室、发送队列、写协程）
         self.connection_info: Dict[WebSocket, dict] = {}
-    
+
+        # 指标
+        self.fanout = FanoutMetrics()
+        self.enqueued = 0
+        self.slow_consumers = 0
+        self.send_failures = 0
+        self.heartbeats_sent = 0
+        self.idle_evicted = 0
+
     async def connect(self, websocket: WebSocket, user_id: str):
-        """接受新的 WebSocket 连接"""
-        await websocket.accept()
-        
+        """接受新的 WebSocket 连接，按客户端请求的子协议选择消息格式"""
+        scope = getattr(websocket, "scope", None) or {}
+        codec = negotiate(scope.get("subprotocols") or [])
+        await websocket.accept(subprotocol=codec.subprotocol)
+
         # 记录连接信息
-        if user_id not in self.user_connections:
-            self.user_connections[user_id] = []
-        self.user_connections[user_id].append(websocket)
-        
+        connection = WebSocketConnection(self, websocket, user_id, codec.name)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        send = websocket.send_bytes if codec.binary else websocket.send_text
+        now = time.monotonic()
         self.connection_info[websocket] = {
             "user_id": user_id,
-            "chat_rooms": set()
+            "connection": connection,
+            "chat_rooms": connection.chats,
+            "codec": codec,
+            "queue": queue,
+            "writer": asyncio.create_task(self._writer(websocket, queue, send)),
+            "last_seen": now,
+            "next_heartbeat": now + self.heartbeat_interval
         }
-        
-        logger.info(f"用户 {user_id} 已连接，当前连接数: {len(self.user_connections[user_id])}")
-    
+        self.wheel.schedule(websocket, min(now + self.heartbeat_interval, now + self.idle_timeout))
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        self.hub.register(connection)
+
+        logger.info(f"用户 {user_id} 已连接，当前连接数: {len(self.hub.user_connections[user_id])}")
+
     def disconnect(self, websocket: WebSocket):
         """断开 WebSocket 连接"""
         if websocket not in self.connection_info:
             return
-        
+
         info = self.connection_info[websocket]
         user_id = info["user_id"]
-        
-        # 从所有聊天室中移除
-        for chat_id in info["chat_rooms"]:
-            if chat_id in self.chat_rooms:
-                self.chat_rooms[chat_id].discard(user_id)
-                if not self.chat_rooms[chat_id]:
-                    del self.chat_rooms[chat_id]
-        
-        # 从用户连接列表中移除
-        if user_id in self.user_connections:
-            self.user_connections[user_id].remove(websocket)
-            if not self.user_connections[user_id]:
-                del self.user_connections[user_id]
-        
-        # 删除连接信息
+
+        # 从所有聊天室与用户连接列表中移除
+        self.hub.unregister(info["connection"])
+
+        # 删除连接信息并停止写协程（写协程自身出错调用时不取消自己）
         del self.connection_info[websocket]
-        
+        self.wheel.remove(websocket)
+        writer = info["writer"]
+        if writer is not asyncio.current_task():
+            writer.cancel()
+
         logger.info(f"用户 {user_id} 已断开连接")
-    
+
     def join_chat(self, websocket: WebSocket, chat_id: str):
         """将连接加入指定聊天室"""
         if websocket not in self.connection_info:
             return
-        
+
         info = self.connection_info[websocket]
         user_id = info["user_id"]
-        
-        # 添加到聊天室
-        if chat_id not in self.chat_rooms:
-            self.chat_rooms[chat_id] = set()
-        self.chat_rooms[chat_id].add(user_id)
-        
-        # 记录用户加入的聊天室
-        info["chat_rooms"].add(chat_id)
-        
+
+        # 添加到聊天室（重复加入不重复计数）
+        self.hub.join(info["connection"], chat_id)
+
         logger.info(f"用户 {user_id} 加入聊天室 {chat_id}")
-    
+
     def leave_chat(self, websocket: WebSocket, chat_id: str):
         """将连接从指定聊天室移除"""
         if websocket not in self.connection_info:
             return
-        
+
         info = self.connection_info[websocket]
         user_id = info["user_id"]
-        
+
         # 从聊天室移除
-        if chat_id in self.chat_rooms:
-            self.chat_rooms[chat_id].discard(user_id)
-            if not self.chat_rooms[chat_id]:
-                del self.chat_rooms[chat_id]
-        
-        # 从用户记录中移除
-        info["chat_rooms"].discard(chat_id)
-        
+        self.hub.leave(info["connection"], chat_id)
+
         logger.info(f"用户 {user_id} 离开聊天室 {chat_id}")
-    
-    async def send_to_user(self, user_id: str, message: dict):
-        """向指定用户的所有连接发送消息"""
-        if user_id not in self.user_connections:
-            return
-        
-        json_message = json.dumps(message, ensure_ascii=False)
-        disconnected = []
-        
-        for websocket in self.user_connections[user_id]:
+
+    # ==================== 发送队列 ====================
+
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue, send):
+        """连接的写协程：依次发送队列中已编码的消息"""
+        while True:
+            payload, enqueued_at = await queue.get()
             try:
-                await websocket.send_text(json_message)
+                await asyncio.wait_for(send(payload), timeout=self.send_timeout)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                logger.error(f"发送消息给用户 {user_id} 失败: {e}")
-                disconnected.append(websocket)
-        
-        # 清理断开的连接
-        for websocket in disconnected:
+                self.send_failures += 1
+                info = self.connection_info.get(websocket)
+                logger.error(f"发送消息给用户 {info['user_id'] if info else '?'} 失败: {e}")
+                self.disconnect(websocket)
+                return
+            self.fanout.record(time.perf_counter() - enqueued_at)
+
+    def _enqueue(self, websocket: WebSocket, payload: Union[str, bytes], enqueued_at: float) -> bool:
+        """把已编码的消息放入连接的发送队列，不等待；队列已满时断开该慢客户端"""
+        info = self.connection_info.get(websocket)
+        if info is None:
+            return False
+        try:
+            info["queue"].put_nowait((payload, enqueued_at))
+        except asyncio.QueueFull:
+            self.slow_consumers += 1
+            logger.warning(f"用户 {info['user_id']} 接收过慢（积压 {self.queue_size} 条），断开连接")
             self.disconnect(websocket)
-    
-    async def broadcast_to_chat(self, chat_id: str, message: dict, exclude_user_id: str = None):
-        """向聊天室的所有在线用户广播消息"""
-        if chat_id not in self.chat_rooms:
+            asyncio.ensure_future(self._close_quietly(websocket, WS_SLOW_CONSUMER_CLOSE_CODE))
+            return False
+        self.enqueued += 1
+        return True
+
+    async def _close_quietly(self, websocket: WebSocket, code: int, reason: str = "接收过慢"):
+        try:
+            await websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def send_json(self, websocket: WebSocket, message: dict):
+        """向单个连接发送消息（按连接协商的格式编码，经由发送队列，与广播保持顺序）"""
+        info = self.connection_info.get(websocket)
+        if info is None:
             return
-        
-        json_message = json.dumps(message, ensure_ascii=False)
-        
-        for user_id in self.chat_rooms[chat_id]:
-            # 可以选择排除某个用户（如发送者）
-            if exclude_user_id and user_id == exclude_user_id:
-                continue
-            
-            if user_id in self.user_connections:
-                disconnected = []
-                for websocket in self.user_connections[user_id]:
-                    try:
-                        await websocket.send_text(json_message)
-                    except Exception as e:
-                        logger.error(f"广播消息给用户 {user_id} 失败: {e}")
-                        disconnected.append(websocket)
-                
-                # 清理断开的连接
-                for websocket in disconnected:
-                    self.disconnect(websocket)
-    
+        self._enqueue(websocket, info["codec"].encode(message), time.perf_counter())
+
+    async def receive(self, websocket: WebSocket) -> Union[str, bytes]:
+        """接收一帧原始数据（文本或二进制），连接断开时抛出 WebSocketDisconnect"""
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        info = self.connection_info.get(websocket)
+        if info is not None:
+            # 只更新时间戳，时间轮在到期时再按最新的时间重新排期
+            info["last_seen"] = time.monotonic()
+        if message.get("bytes") is not None:
+            return message["bytes"]
+        return message.get("text") or ""
+
+    async def send_to_user(self, user_id: str, message: dict):
+        """向指定用户的所有连接发送消息（所有 worker、WebSocket 与 SSE）"""
+        await self.hub.send_to_user(user_id, message)
+
+    async def broadcast_to_chat(self, chat_id: str, message: dict, exclude_user_id: str = None):
+        """向加入了该聊天室的所有连接广播消息（所有 worker、WebSocket 与 SSE）"""
+        await self.hub.broadcast_to_chat(chat_id, message, exclude_user_id)
+
     async def broadcast(self, message: dict):
-        """向所有在线用户广播消息"""
-        json_message = json.dumps(message, ensure_ascii=False)
-        disconnected = []
-        
-        for websocket in self.connection_info:
+        """向所有在线连接广播消息（所有 worker、WebSocket 与 SSE）"""
+        await self.hub.broadcast(message)
+
+    # ==================== 心跳与空闲断开 ====================
+
+    async def _heartbeat_loop(self):
+        """按时间轮刻度推进：到期的连接发送心跳，空闲超时的连接批量断开"""
+        while True:
+            await asyncio.sleep(self.wheel.tick)
             try:
-                await websocket.send_text(json_message)
+                self._on_tick(time.monotonic())
             except Exception as e:
-                logger.error(f"广播消息失败: {e}")
-                disconnected.append(websocket)
-        
-        # 清理断开的连接
-        for websocket in disconnected:
-            self.disconnect(websocket)
-    
+                logger.error(f"WebSocket 心跳检查出错: {e}")
+
+    def _on_tick(self, now: float):
+        idle: List[WebSocket] = []
+        heartbeat: List[WebSocket] = []
+        for websocket in self.wheel.advance(now):
+            info = self.connection_info.get(websocket)
+            if info is None:
+                continue
+            idle_deadline = info["last_seen"] + self.idle_timeout
+            if now >= idle_deadline:
+                idle.append(websocket)
+                continue
+            if now >= info["next_heartbeat"]:
+                heartbeat.append(websocket)
+                info["next_heartbeat"] = now + self.heartbeat_interval
+            self.wheel.schedule(websocket, min(info["next_heartbeat"], idle_deadline))
+
+        if heartbeat:
+            # 心跳内容固定，每种消息格式只编码一次；入队时间与扇出延迟统计一样用 perf_counter
+            enqueued_at = time.perf_counter()
+            encoded: Dict[str, Union[str, bytes]] = {}
+            for websocket in heartbeat:
+                codec = self.connection_info[websocket]["codec"]
+                payload = encoded.get(codec.name)
+                if payload is None:
+                    payload = encoded[codec.name] = codec.encode({"type": "heartbeat"})
+                if self._enqueue(websocket, payload, enqueued_at):
+                    self.heartbeats_sent += 1
+
+        if idle:
+            self.idle_evicted += len(idle)
+            logger.info(f"断开 {len(idle)} 个空闲超过 {self.idle_timeout:.0f} 秒的 WebSocket 连接")
+            for websocket in idle:
+                self.disconnect(websocket)
+                asyncio.ensure_future(self._close_quietly(websocket, WS_IDLE_CLOSE_CODE, "连接空闲超时"))
+
+    async def stop(self):
+        """停止心跳协程"""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+
     def get_online_users(self) -> List[str]:
-        """获取所有在线用户ID列表"""
-        return list(self.user_connections.keys())
-    
+        """获取本 worker 上通过 WebSocket 连接的用户ID列表（全局在线用户见在线状态服务）"""
+        return list({info["user_id"] for info in self.connection_info.values()})
+
     def is_user_online(self, user_id: str) -> bool:
-        """检查用户是否在线"""
-        return user_id in self.user_connections and len(self.user_connections[user_id]) > 0
+        """检查用户是否在线（任一 worker、WebSocket 或 SSE）"""
+        return self.hub.is_user_online(user_id)
+
+    def stats(self) -> Dict:
+        """连接与发送队列指标（聊天室与广播见推送中心）"""
+        depths = [info["queue"].qsize() for info in self.connection_info.values()]
+        codecs = Counter(info["codec"].name for info in self.connection_info.values())
+        return {
+            "connections": len(self.connection_info),
+            "codecs": dict(codecs),
+            "queue_size": self.queue_size,
+            "max_queue_depth": max(depths) if depths else 0,
+            "enqueued": self.enqueued,
+            "slow_consumers_disconnected": self.slow_consumers,
+            "send_failures": self.send_failures,
+            "heartbeat_interval": self.heartbeat_interval,
+            "idle_timeout": self.idle_timeout,
+            "heartbeats_sent": self.heartbeats_sent,
+            "idle_evicted": self.idle_evicted,
+            "scheduled": len(self.wheel),
+            "fanout_latency": self.fanout.snapshot(),
+            "hub": self.hub.stats()
+        }
+
+
+class TypingDebouncer:
+    """
+    打字状态合并
+
+    客户端每次按键都可能发送 typing，直接广播会让每个聊天室每秒产生几十次扇出。
+    这里按（聊天室, 用户）记录状态：距上次广播超过 interval 才广播 typing，
+    最后一次 typing 之后空闲 idle 秒（或用户发出消息）时广播一次 typing_stopped。
+    """
+
+    def __init__(self, manager: ConnectionManager, interval: float = WS_TYPING_INTERVAL,
+                 idle: float = WS_TYPING_IDLE):
+        self.manager = manager
+        self.interval = interval
+        self.idle = idle
+        # (聊天室ID, 用户ID) -> 上次广播时间、最后一次 typing 时间、空闲检查定时器
+        self._state: Dict[Tuple[str, str], dict] = {}
+
+        # 指标
+        self.received = 0
+        self.started = 0
+        self.stopped = 0
+
+    async def typing(self, chat_id: str, user_id: str):
+        """收到一次 typing"""
+        self.received += 1
+        now = time.monotonic()
+        key = (chat_id, user_id)
+        state = self._state.get(key)
+        if state is None:
+            state = self._state[key] = {
+                "started_at": None,
+                "seen_at": now,
+                "timer": asyncio.get_running_loop().call_later(self.idle, self._check_idle, key)
+            }
+        state["seen_at"] = now
+
+        if state["started_at"] is None or now - state["started_at"] >= self.interval:
+            state["started_at"] = now
+            self.started += 1
+            await self.manager.broadcast_to_chat(chat_id, {
+                "type": "typing",
+                "chat_id": chat_id,
+                "user_id": user_id
+            }, exclude_user_id=user_id)
+
+    def _check_idle(self, key: Tuple[str, str]):
+        state = self._state.get(key)
+        if state is None:
+            return
+        # 每个（聊天室, 用户）只挂一个定时器，期间又收到 typing 时顺延
+        remaining = state["seen_at"] + self.idle - time.monotonic()
+        if remaining > 0:
+            state["timer"] = asyncio.get_running_loop().call_later(remaining, self._check_idle, key)
+            return
+        asyncio.ensure_future(self.stop(*key))
+
+    async def stop(self, chat_id: str, user_id: str):
+        """结束打字状态（空闲超时或用户已发出消息）；没有进行中的打字状态时不广播"""
+        state = self._state.pop((chat_id, user_id), None)
+        if state is None:
+            return
+        state["timer"].cancel()
+        self.stopped += 1
+        await self.manager.broadcast_to_chat(chat_id, {
+            "type": "typing_stopped",
+            "chat_id": chat_id,
+            "user_id": user_id
+        }, exclude_user_id=user_id)
+
+    def stats(self) -> Dict:
+        return {
+            "interval_seconds": self.interval,
+            "idle_seconds": self.idle,
+            "active": len(self._state),
+            "received": self.received,
+            "broadcast_started": self.started,
+            "broadcast_stopped": self.stopped,
+            "coalesced": self.received - self.started
+        }
 
 
 # 全局连接管理器实例
 manager = ConnectionManager()
+typing_debouncer = TypingDebouncer(manager)
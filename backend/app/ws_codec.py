@@ -0,0 +1,85 @@
+"""
+WebSocket 消息编解码
+
+客户端通过子协议（Sec-WebSocket-Protocol）协商帧格式：
+- pawpal.json: JSON 文本帧（默认，不带子协议的客户端也使用 JSON）
+- pawpal.msgpack: MessagePack 二进制帧，省去重复键名的引号与转义，编解码更快、帧更小
+
+压缩（permessage-deflate）由 uvicorn 在握手时与客户端协商，默认开启，对两种格式都生效，
+可用 uvicorn --ws-per-message-deflate false 关闭。
+
+接收时按帧类型解码：文本帧按 JSON，二进制帧按 MessagePack，与协商结果无关。
+"""
+import os
+import json
+from typing import Any, Dict, List, Optional, Union
+
+try:
+    import msgpack
+    _MSGPACK_AVAILABLE = True
+except ImportError:
+    _MSGPACK_AVAILABLE = False
+
+# 是否允许协商 MessagePack（未安装 msgpack 时自动关闭）
+WS_MSGPACK_ENABLED = os.getenv("WS_MSGPACK_ENABLED", "true").lower() == "true"
+
+WS_SUBPROTOCOL_JSON = "pawpal.json"
+WS_SUBPROTOCOL_MSGPACK = "pawpal.msgpack"
+
+
+class JSONCodec:
+    """JSON 文本帧"""
+
+    name = "json"
+    binary = False
+    format_error = "无效的 JSON 格式"
+
+    def __init__(self, subprotocol: Optional[str] = None):
+        # 客户端未请求子协议时握手不返回子协议
+        self.subprotocol = subprotocol
+
+    def encode(self, message: Dict[str, Any]) -> str:
+        return json.dumps(message, ensure_ascii=False)
+
+
+class MsgPackCodec:
+    """MessagePack 二进制帧"""
+
+    name = "msgpack"
+    binary = True
+    format_error = "无效的 MessagePack 格式"
+    subprotocol = WS_SUBPROTOCOL_MSGPACK
+
+    def encode(self, message: Dict[str, Any]) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+
+JSON_CODEC = JSONCodec()
+
+
+def negotiate(requested: List[str]) -> Union[JSONCodec, MsgPackCodec]:
+    """按客户端请求的子协议顺序选择编解码器，都不支持时使用默认 JSON"""
+    for subprotocol in requested:
+        if subprotocol == WS_SUBPROTOCOL_MSGPACK and WS_MSGPACK_ENABLED and _MSGPACK_AVAILABLE:
+            return MsgPackCodec()
+        if subprotocol == WS_SUBPROTOCOL_JSON:
+            return JSONCodec(WS_SUBPROTOCOL_JSON)
+    return JSON_CODEC
+
+
+def decode(data: Union[str, bytes]) -> Dict[str, Any]:
+    """解码一帧，格式错误或不是对象时抛出 ValueError"""
+    if isinstance(data, str):
+        message = json.loads(data)
+    elif _MSGPACK_AVAILABLE:
+        message = msgpack.unpackb(data, raw=False)
+    else:
+        raise ValueError("服务器不支持二进制帧")
+    if not isinstance(message, dict):
+        raise ValueError("消息必须是对象")
+    return message
+
+
+def format_error(data: Union[str, bytes]) -> str:
+    """解码失败时返回给客户端的提示"""
+    return JSONCodec.format_error if isinstance(data, str) else MsgPackCodec.format_error
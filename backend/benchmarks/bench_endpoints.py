@@ -0,0 +1,174 @@
+"""
+接口基准测试（录制 / 回放数据库流量）
+
+1. 录制：连接真实数据库，把各场景的数据库调用写入录像文件
+
+    cd backend
+    python benchmarks/bench_endpoints.py record --cassette cassette.jsonl --user-id <用户ID>
+
+2. 回放：不访问数据库，按录像返回结果，测量接口自身的耗时
+
+    python benchmarks/bench_endpoints.py run --cassette cassette.jsonl --iterations 200 --output bench.json
+    python benchmarks/bench_endpoints.py run --cassette cassette.jsonl --latency   # 同时模拟录制时的数据库延迟
+
+用 --baseline 对比之前提交的结果，p50 变慢超过 --max-regression 百分比时以非零状态码退出。
+场景: get_chats、get_pets、match（/api/ai/v2/match/recommendations）。
+匹配流程中对 Embedding / 大模型服务的调用不在录像范围内，离线运行时会走各自的降级逻辑。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_ADOPTER_PROFILE = {
+    "living_space": "apartment",
+    "has_yard": False,
+    "experience_level": "first_time",
+    "daily_time_available": 3,
+    "family_status": "couple",
+    "activity_level": "moderate",
+    "other_pets": []
+}
+
+
+def build_scenarios(user_id: str):
+    """场景名 -> (HTTP 方法, 路径, 请求体)"""
+    return {
+        "get_chats": ("GET", f"/api/chats/?user_id={user_id}", None),
+        "get_pets": ("GET", "/api/pets/", None),
+        "match": ("POST", "/api/ai/v2/match/recommendations", {
+            "user_id": user_id,
+            "adopter_profile": DEFAULT_ADOPTER_PROFILE,
+            "limit": 3
+        }),
+    }
+
+
+def create_client():
+    # 环境变量需在导入 app 之前设置好
+    from fastapi.testclient import TestClient
+    from app.main import app
+    return TestClient(app, raise_server_exceptions=False)
+
+
+def call(client, method: str, path: str, body):
+    if method == "GET":
+        return client.get(path)
+    return client.post(path, json=body)
+
+
+def record(args):
+    os.environ["STORAGE_RECORD_PATH"] = args.cassette
+    if os.path.exists(args.cassette):
+        os.remove(args.cassette)
+
+    client = create_client()
+    from app.database import storage_backend
+
+    for name, (method, path, body) in build_scenarios(args.user_id).items():
+        response = call(client, method, path, body)
+        print(f"{name:<12} HTTP {response.status_code}")
+    storage_backend.close()
+    print(f"已录制 {storage_backend.recorded} 次数据库调用 -> {args.cassette}")
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(args):
+    os.environ["STORAGE_BACKEND"] = "replay"
+    os.environ["STORAGE_REPLAY_PATH"] = args.cassette
+    os.environ["STORAGE_REPLAY_LATENCY"] = "true" if args.latency else "false"
+
+    client = create_client()
+    from app.database import storage_backend
+    from app.services.db_metrics import db_metrics
+
+    results = {}
+    for name, (method, path, body) in build_scenarios(args.user_id).items():
+        for _ in range(args.warmup):
+            call(client, method, path, body)
+        db_metrics.reset()
+
+        durations = []
+        statuses = set()
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            response = call(client, method, path, body)
+            durations.append((time.perf_counter() - start) * 1000)
+            statuses.add(response.status_code)
+
+        queries = sum(t["count"] for t in db_metrics.snapshot()["tables"].values())
+        results[name] = {
+            "iterations": args.iterations,
+            "status": sorted(statuses),
+            "p50_ms": round(statistics.median(durations), 3),
+            "p95_ms": round(percentile(durations, 95), 3),
+            "p99_ms": round(percentile(durations, 99), 3),
+            "mean_ms": round(statistics.mean(durations), 3),
+            "queries_per_request": round(queries / args.iterations, 2),
+        }
+
+    print(f"{'场景':<12}{'状态':<10}{'p50':>10}{'p95':>10}{'p99':>10}{'查询/请求':>12}")
+    for name, r in results.items():
+        print(f"{name:<12}{str(r['status']):<10}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}"
+              f"{r['p99_ms']:>10.2f}{r['queries_per_request']:>12}")
+    print(f"录像: {storage_backend.stats()}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"latency": args.latency, "results": results}, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressed = False
+        print("\n与基线对比（p50）:")
+        for name, r in results.items():
+            if name not in baseline:
+                continue
+            before = baseline[name]["p50_ms"]
+            change = (r["p50_ms"] - before) / before * 100 if before else 0.0
+            flag = ""
+            if change > args.max_regression:
+                flag = "  <-- 变慢"
+                regressed = True
+            print(f"  {name:<12}{before:>10.2f} -> {r['p50_ms']:>10.2f} ms ({change:+.1f}%){flag}")
+        if regressed:
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="接口基准测试（录制 / 回放数据库流量）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = sub.add_parser("record", help="连接真实数据库录制各场景")
+    record_parser.add_argument("--cassette", default="cassette.jsonl")
+    record_parser.add_argument("--user-id", required=True)
+
+    run_parser = sub.add_parser("run", help="回放录像并测量接口耗时")
+    run_parser.add_argument("--cassette", default="cassette.jsonl")
+    run_parser.add_argument("--user-id", required=True)
+    run_parser.add_argument("--iterations", type=int, default=100)
+    run_parser.add_argument("--warmup", type=int, default=5)
+    run_parser.add_argument("--latency", action="store_true", help="按录制时的数据库耗时延迟返回")
+    run_parser.add_argument("--output", help="结果写入 JSON 文件")
+    run_parser.add_argument("--baseline", help="对比的基线结果 JSON 文件")
+    run_parser.add_argument("--max-regression", type=float, default=20, help="允许的 p50 变慢百分比")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+事件循环延迟测试
+
+在本地启动一个模拟 PostgREST 的慢速 HTTP 服务（每个请求延迟 --db-latency 毫秒），
+用真实的 supabase 客户端发起查询，同时用一个定时任务测量事件循环的调度延迟：
+
+- sync:  旧写法，在 async 路由中直接调用同步客户端
+- async: 新写法，通过 app.database.AsyncSupabase 异步数据访问层
+
+不访问真实数据库，可离线运行:
+
+    cd backend
+    python benchmarks/bench_event_loop_lag.py --queries 50 --db-latency 50
+
+async 模式的最大延迟超过 --max-lag 毫秒时以非零状态码退出。
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def start_fake_postgrest(latency: float) -> ThreadingHTTPServer:
+    """启动模拟 PostgREST 服务，所有请求延迟 latency 秒后返回空数组"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self):
+            time.sleep(latency)
+            body = json.dumps([]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = do_PATCH = do_DELETE = _reply
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def measure_lag(stop: asyncio.Event, interval: float, samples: list):
+    """每 interval 秒醒来一次，记录实际唤醒时间比预期晚了多少"""
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - expected))
+
+
+async def run(mode: str, queries: int, concurrency: int):
+    from app.database import supabase, async_supabase
+
+    samples = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(measure_lag(stop, 0.005, samples))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def query(i: int):
+        async with semaphore:
+            if mode == "sync":
+                supabase.table("messages").select("*").eq("conversation_id", str(i)).execute()
+            else:
+                await async_supabase.table("messages").select("*").eq("conversation_id", str(i)).execute()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(query(i) for i in range(queries)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+
+    samples.sort()
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))] if samples else 0.0
+    worst = samples[-1] if samples else 0.0
+    print(f"[{mode:5}] {queries} 次查询耗时 {elapsed:.2f}s，事件循环延迟 p99={p99 * 1000:.1f}ms 最大={worst * 1000:.1f}ms")
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据库调用期间的事件循环延迟测试")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--db-latency", type=float, default=50, help="模拟数据库延迟（毫秒）")
+    parser.add_argument("--max-lag", type=float, default=25, help="async 模式允许的最大事件循环延迟（毫秒）")
+    args = parser.parse_args()
+
+    server = start_fake_postgrest(args.db_latency / 1000)
+    os.environ["SUPABASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault("SUPABASE_KEY", "benchmark-key")
+
+    try:
+        asyncio.run(run("sync", args.queries, args.concurrency))
+        worst = asyncio.run(run("async", args.queries, args.concurrency))
+    finally:
+        server.shutdown()
+
+    if worst * 1000 > args.max_lag:
+        print(f"FAIL: async 模式事件循环最大延迟 {worst * 1000:.1f}ms 超过 {args.max_lag}ms")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
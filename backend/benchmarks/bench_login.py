@@ -0,0 +1,103 @@
+"""
+登录吞吐量基准测试
+
+对比两种 bcrypt 执行方式在登录高峰下的表现：
+- inline: 旧实现，在同步路由共用的线程池中直接执行 bcrypt
+- pool:   新实现，在独立的有界进程池中执行（app.services.password_hasher）
+
+同时并发请求一个"轻量接口"（模拟宠物/聊天列表），观察其延迟是否被登录拖慢。
+不访问数据库，可离线运行:
+
+    cd backend
+    python benchmarks/bench_login.py --logins 200 --concurrency 50
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.concurrency import run_in_threadpool
+from app.services.password_hasher import PasswordHasher, hash_password, check_password
+
+PASSWORD = "benchmark-password"
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * pct / 100))
+    return values[index]
+
+
+def _cheap_endpoint():
+    """模拟一个轻量同步接口（例如 get_pets 格式化数据）"""
+    return sum(range(1000))
+
+
+async def run_mode(mode: str, hashed: str, logins: int, concurrency: int, hasher: PasswordHasher):
+    semaphore = asyncio.Semaphore(concurrency)
+    login_latencies = []
+    cheap_latencies = []
+    done = asyncio.Event()
+
+    async def login():
+        async with semaphore:
+            start = time.perf_counter()
+            if mode == "pool":
+                ok = await hasher.verify(PASSWORD, hashed)
+            else:
+                ok = await run_in_threadpool(check_password, PASSWORD, hashed)
+            assert ok
+            login_latencies.append(time.perf_counter() - start)
+
+    async def cheap_traffic():
+        while not done.is_set():
+            start = time.perf_counter()
+            await run_in_threadpool(_cheap_endpoint)
+            cheap_latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)
+
+    probes = [asyncio.create_task(cheap_traffic()) for _ in range(5)]
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await asyncio.gather(*probes)
+
+    print(f"\n[{mode}] {logins} 次登录，并发 {concurrency}")
+    print(f"  吞吐量:         {logins / elapsed:8.1f} 次/秒 (总耗时 {elapsed:.2f}s)")
+    print(f"  登录 p50/p99:   {_percentile(login_latencies, 50) * 1000:8.1f} / {_percentile(login_latencies, 99) * 1000:.1f} ms")
+    print(f"  轻量接口 p50/p99: {_percentile(cheap_latencies, 50) * 1000:6.2f} / {_percentile(cheap_latencies, 99) * 1000:.2f} ms"
+          f" (样本 {len(cheap_latencies)}, 平均 {statistics.mean(cheap_latencies) * 1000:.2f} ms)")
+    if mode == "pool":
+        print(f"  进程池指标:     {hasher.stats()}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="登录吞吐量基准测试")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None, help="进程池大小（默认读取 PASSWORD_HASH_WORKERS）")
+    parser.add_argument("--mode", choices=["inline", "pool", "both"], default="both")
+    args = parser.parse_args()
+
+    hashed = hash_password(PASSWORD)
+    hasher = PasswordHasher(max_pending=args.logins) if args.workers is None \
+        else PasswordHasher(workers=args.workers, max_pending=args.logins)
+
+    try:
+        if args.mode in ("inline", "both"):
+            await run_mode("inline", hashed, args.logins, args.concurrency, hasher)
+        if args.mode in ("pool", "both"):
+            await run_mode("pool", hashed, args.logins, args.concurrency, hasher)
+    finally:
+        hasher.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
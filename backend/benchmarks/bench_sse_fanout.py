@@ -0,0 +1,116 @@
+"""
+SSE 聊天室广播基准测试
+
+用 app.routers.sse 的连接管理器（不走网络）构造 --connections 个连接、--rooms 个聊天室，
+每个连接订阅若干聊天室，对比两种广播写法：
+
+- legacy: 旧写法，每次广播遍历全部连接的订阅集合，并为每个接收者单独 json.dumps
+- indexed: 新写法（SSEManager.broadcast_to_chat，经实时推送中心），按聊天室索引找到订阅者，事件只序列化一次
+
+输出每次广播的耗时与触达的连接数:
+
+    cd backend
+    python benchmarks/bench_sse_fanout.py --connections 20000 --rooms 2000 --broadcasts 2000
+
+两种写法触达的连接数不一致，或 indexed 单次广播 p99 超过 --max-p99 毫秒时以非零状态码退出。
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def summarize(name, samples, touched):
+    print(
+        f"[{name:7}] 广播 {len(samples)} 次  p50={percentile(samples, 50) * 1e6:.1f}us "
+        f"p99={percentile(samples, 99) * 1e6:.1f}us  平均触达连接 {statistics.mean(touched):.1f}"
+    )
+
+
+def drain(connections):
+    for connection in connections:
+        while not connection.queue.empty():
+            connection.queue.get_nowait()
+
+
+async def run(args):
+    from app.routers.sse import sse_manager, connections as registry
+
+    logging.getLogger("app.routers.sse").setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+
+    rooms = [f"chat-{i}" for i in range(args.rooms)]
+    connections = []
+    for i in range(args.connections):
+        connection = sse_manager.connect(f"user-{i}")
+        for chat_id in rng.sample(rooms, args.rooms_per_connection):
+            sse_manager.subscribe(connection.user_id, chat_id, connection.id)
+        connections.append(connection)
+    print(f"连接 {len(connections)}，聊天室 {args.rooms}，每个连接订阅 {args.rooms_per_connection} 个")
+
+    targets = [rng.choice(rooms) for _ in range(args.broadcasts)]
+    message = {"type": "new_message", "chat_id": "", "data": {"content": "你好，今天方便来看看它吗？"}}
+
+    # legacy：遍历全部连接，逐个接收者序列化
+    legacy_samples, legacy_touched = [], []
+    for chat_id in targets:
+        start = time.perf_counter()
+        touched = 0
+        for connection in list(registry.values()):
+            if chat_id in connection.chats:
+                connection.put(f"data: {json.dumps(message, ensure_ascii=False)}\n\n")
+                touched += 1
+        legacy_samples.append(time.perf_counter() - start)
+        legacy_touched.append(touched)
+        drain(connections)
+    summarize("legacy", legacy_samples, legacy_touched)
+
+    # indexed：聊天室索引 + 只序列化一次
+    samples, touched_counts = [], []
+    for chat_id in targets:
+        start = time.perf_counter()
+        await sse_manager.broadcast_to_chat(chat_id, message)
+        samples.append(time.perf_counter() - start)
+        touched_counts.append(sum(1 for connection in connections if not connection.queue.empty()))
+        drain(connections)
+    summarize("indexed", samples, touched_counts)
+
+    for connection in connections:
+        sse_manager.disconnect(connection)
+    return percentile(samples, 99), legacy_touched == touched_counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE 聊天室广播基准测试")
+    parser.add_argument("--connections", type=int, default=20000)
+    parser.add_argument("--rooms", type=int, default=2000)
+    parser.add_argument("--rooms-per-connection", type=int, default=5)
+    parser.add_argument("--broadcasts", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--max-p99", type=float, default=5, help="indexed 单次广播允许的 p99（毫秒）")
+    args = parser.parse_args()
+
+    p99, consistent = asyncio.run(run(args))
+    if not consistent:
+        print("FAIL: 两种写法触达的连接数不一致")
+        sys.exit(1)
+    if p99 * 1000 > args.max_p99:
+        print(f"FAIL: 单次广播 p99 {p99 * 1000:.2f}ms 超过 {args.max_p99}ms")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
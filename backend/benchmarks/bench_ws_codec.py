@@ -0,0 +1,152 @@
+"""
+WebSocket 消息编解码基准测试
+
+用聊天协议中的典型消息（新消息、已读、打字、加入等）对比:
+
+- json:    当前写法，json.dumps(..., ensure_ascii=False) / json.loads，文本帧按 UTF-8 发送
+- msgpack: 子协议 pawpal.msgpack 的 MessagePack 二进制帧
+
+输出每帧编码 / 解码耗时、帧大小，以及经 permessage-deflate 压缩后的大小
+（用 zlib 模拟，分别统计每帧独立压缩与保留上下文（context takeover，浏览器默认）两种情况）:
+
+    cd backend
+    python benchmarks/bench_ws_codec.py --iterations 20000
+
+msgpack 编码或解码比 json 慢时以非零状态码退出。
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import uuid
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHAT_ID = "fe367ca9-c6a2-432e-9136-5b67ab5168e5"
+USER_ID = "e6d6799b-ef4c-42ab-8027-46264e8fc7b9"
+
+
+TEXTS = [
+    "你好，请问这只小狗还在等待领养吗？我们家有院子，周末可以去看看它。",
+    "可以的，它已经打过疫苗了，性格很温顺，周六上午方便吗？",
+    "好的，谢谢！需要带什么材料吗？",
+    "带上身份证就可以，我们会先聊聊你的养宠经验。",
+]
+
+
+def sample_messages(rng: random.Random = None):
+    """聊天协议中的典型下行消息；传入 rng 时随机生成 ID、文本与计数，模拟同一连接上的连续消息"""
+    message_id = str(uuid.UUID(int=rng.getrandbits(128))) if rng else "0b5c7d0e-8f7a-4c56-9d0f-1e2a3b4c5d6e"
+    text = rng.choice(TEXTS) if rng else TEXTS[0]
+    timestamp = f"2026-10-19T08:{rng.randrange(60):02d}:{rng.randrange(60):02d}.{rng.randrange(10 ** 6):06d}+00:00" \
+        if rng else "2026-10-19T08:30:12.345678+00:00"
+    return [
+        {
+            "type": "new_message",
+            "chat_id": CHAT_ID,
+            "message": {
+                "id": message_id,
+                "sender_id": USER_ID,
+                "text": text,
+                "timestamp": timestamp,
+                "isRead": False
+            }
+        },
+        {"type": "typing", "chat_id": CHAT_ID, "user_id": USER_ID},
+        {"type": "typing_stopped", "chat_id": CHAT_ID, "user_id": USER_ID},
+        {"type": "messages_read", "chat_id": CHAT_ID, "user_id": USER_ID, "count": rng.randrange(1, 20) if rng else 3},
+        {"type": "user_joined", "user_id": USER_ID, "chat_id": CHAT_ID},
+        {
+            "type": "message_sent",
+            "chat_id": CHAT_ID,
+            "message_id": message_id,
+            "timestamp": timestamp
+        },
+        {"type": "pong"},
+    ]
+
+
+def json_encode(message):
+    # 文本帧发送时由服务器编码为 UTF-8，一并计入
+    return json.dumps(message, ensure_ascii=False).encode("utf-8")
+
+
+def json_decode(frame):
+    return json.loads(frame.decode("utf-8"))
+
+
+def time_per_frame(fn, inputs, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for item in inputs:
+            fn(item)
+    return (time.perf_counter() - start) / (iterations * len(inputs))
+
+
+def deflated_sizes(encode, frames, rounds: int = 50, seed: int = 42):
+    """permessage-deflate 后的平均帧大小：(每帧独立压缩, 保留上下文)，末尾 4 字节同步标记不计入"""
+    independent = 0
+    for frame in frames:
+        compressor = zlib.compressobj(wbits=-15)
+        independent += len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    # 保留上下文：同一连接上连续发送，后面的帧可以引用前面帧里出现过的键名与 ID
+    rng = random.Random(seed)
+    compressor = zlib.compressobj(wbits=-15)
+    takeover = count = 0
+    for _ in range(rounds):
+        for message in sample_messages(rng):
+            frame = encode(message)
+            takeover += len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+            count += 1
+    return independent / len(frames), takeover / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket 消息编解码基准测试")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    try:
+        import msgpack
+    except ImportError:
+        print("FAIL: 未安装 msgpack（pip install msgpack）")
+        sys.exit(1)
+
+    from app.ws_codec import MsgPackCodec, decode
+
+    messages = sample_messages()
+    codecs = {
+        "json": (json_encode, json_decode),
+        "msgpack": (MsgPackCodec().encode, decode),
+    }
+
+    results = {}
+    for name, (encode, decoder) in codecs.items():
+        frames = [encode(message) for message in messages]
+        assert [decoder(frame) for frame in frames] == messages
+        encode_s = time_per_frame(encode, messages, args.iterations)
+        decode_s = time_per_frame(decoder, frames, args.iterations)
+        raw = sum(len(frame) for frame in frames) / len(frames)
+        independent, takeover = deflated_sizes(encode, frames)
+        results[name] = (encode_s, decode_s)
+        print(
+            f"[{name:7}] 编码 {encode_s * 1e6:.2f}us  解码 {decode_s * 1e6:.2f}us  "
+            f"平均帧 {raw:.0f}B  deflate(逐帧) {independent:.0f}B  deflate(保留上下文) {takeover:.0f}B"
+        )
+
+    json_encode_s, json_decode_s = results["json"]
+    msgpack_encode_s, msgpack_decode_s = results["msgpack"]
+    print(
+        f"msgpack / json: 编码 {msgpack_encode_s / json_encode_s:.2f}x  解码 {msgpack_decode_s / json_decode_s:.2f}x"
+    )
+    if msgpack_encode_s > json_encode_s or msgpack_decode_s > json_decode_s:
+        print("FAIL: msgpack 比 json 慢")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
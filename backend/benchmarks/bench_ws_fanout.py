@@ -0,0 +1,175 @@
+"""
+WebSocket 聊天室广播基准测试
+
+用假连接（不走网络）构造 --sockets 个连接、--rooms 个聊天室，部分用户多设备登录，
+每个连接加入若干聊天室，对比两种聊天室索引：
+
+- legacy: 旧写法，聊天室记录用户ID，广播时发给这些用户的全部连接（包括没加入该聊天室的设备）
+- socket: 新写法（app.websocket.ConnectionManager + 实时推送中心），聊天室直接记录连接
+
+输出每次广播的耗时、触达的连接数与多余投递数，以及加入 / 离开 / 断开的耗时:
+
+    cd backend
+    python benchmarks/bench_ws_fanout.py --sockets 10000 --rooms 1000 --broadcasts 2000
+
+socket 模式出现多余投递，或单次广播 p99 超过 --max-p99 毫秒时以非零状态码退出。
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeWebSocket:
+    """只记录收到的消息数的假连接"""
+
+    __slots__ = ("received",)
+
+    def __init__(self):
+        self.received = 0
+
+    async def accept(self, subprotocol: str = None):
+        pass
+
+    async def send_text(self, text: str):
+        self.received += 1
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def summarize(name, samples, touched, spurious):
+    print(
+        f"[{name:6}] 广播 {len(samples)} 次  p50={percentile(samples, 50) * 1e6:.1f}us "
+        f"p99={percentile(samples, 99) * 1e6:.1f}us  平均触达连接 {statistics.mean(touched):.1f}  "
+        f"多余投递 {spurious}"
+    )
+
+
+async def run(args):
+    from app.services.presence import PresenceService
+    from app.services.realtime_bus import LocalBus
+    from app.services.realtime_hub import RealtimeHub, _EncodedMessage
+    from app.websocket import ConnectionManager
+
+    logging.getLogger("app.websocket").setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+    bus = LocalBus()
+    hub = RealtimeHub(bus, PresenceService(bus))
+    manager = ConnectionManager(queue_size=args.broadcasts + 16, hub=hub)
+
+    # 构造连接：大约一半用户有两个设备
+    sockets = []
+    user_of = {}
+    user_index = 0
+    while len(sockets) < args.sockets:
+        user_id = f"user-{user_index}"
+        user_index += 1
+        for _ in range(2 if rng.random() < 0.5 else 1):
+            websocket = FakeWebSocket()
+            await manager.connect(websocket, user_id)
+            sockets.append(websocket)
+            user_of[websocket] = user_id
+    sockets = sockets[:args.sockets]
+
+    # 加入聊天室
+    rooms = [f"chat-{i}" for i in range(args.rooms)]
+    legacy_rooms = {}
+    socket_rooms = {}
+    join_samples = []
+    for websocket in sockets:
+        for chat_id in rng.sample(rooms, args.rooms_per_socket):
+            start = time.perf_counter()
+            manager.join_chat(websocket, chat_id)
+            join_samples.append(time.perf_counter() - start)
+            legacy_rooms.setdefault(chat_id, set()).add(user_of[websocket])
+            socket_rooms.setdefault(chat_id, set()).add(websocket)
+    print(
+        f"连接 {len(sockets)}，用户 {user_index}，聊天室 {len(hub.chat_rooms)}，"
+        f"join p50={percentile(join_samples, 50) * 1e6:.2f}us"
+    )
+
+    targets = [rng.choice(rooms) for _ in range(args.broadcasts)]
+    message = {"type": "new_message", "data": {"content": "hello", "chat_id": ""}}
+
+    # legacy：聊天室 -> 用户ID -> 用户的全部连接
+    samples, touched, spurious = [], [], 0
+    for chat_id in targets:
+        start = time.perf_counter()
+        recipients = []
+        for user_id in legacy_rooms.get(chat_id, ()):
+            recipients.extend(hub.user_connections.get(user_id, ()))
+        hub._fan_out(recipients, _EncodedMessage(hub, message, None))
+        samples.append(time.perf_counter() - start)
+        touched.append(len(recipients))
+        spurious += sum(1 for c in recipients if c.websocket not in socket_rooms[chat_id])
+        await asyncio.sleep(0)
+    summarize("legacy", samples, touched, spurious)
+
+    # socket：聊天室直接记录连接
+    samples, touched, spurious = [], [], 0
+    for chat_id in targets:
+        enqueued_before = manager.enqueued
+        start = time.perf_counter()
+        await manager.broadcast_to_chat(chat_id, message)
+        samples.append(time.perf_counter() - start)
+        touched.append(manager.enqueued - enqueued_before)
+        spurious += (manager.enqueued - enqueued_before) - len(socket_rooms[chat_id])
+        await asyncio.sleep(0)
+    summarize("socket", samples, touched, spurious)
+    socket_p99 = percentile(samples, 99)
+
+    # 离开与断开
+    leave_samples = []
+    for websocket in sockets[:args.sockets // 2]:
+        chat_id = next(iter(manager.connection_info[websocket]["chat_rooms"]))
+        start = time.perf_counter()
+        manager.leave_chat(websocket, chat_id)
+        leave_samples.append(time.perf_counter() - start)
+    disconnect_samples = []
+    for websocket in sockets:
+        start = time.perf_counter()
+        manager.disconnect(websocket)
+        disconnect_samples.append(time.perf_counter() - start)
+    await asyncio.sleep(0)
+    print(
+        f"leave p50={percentile(leave_samples, 50) * 1e6:.2f}us  "
+        f"disconnect p50={percentile(disconnect_samples, 50) * 1e6:.2f}us "
+        f"p99={percentile(disconnect_samples, 99) * 1e6:.2f}us  剩余聊天室 {len(hub.chat_rooms)}"
+    )
+    return socket_p99, spurious
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket 聊天室广播基准测试")
+    parser.add_argument("--sockets", type=int, default=10000)
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--rooms-per-socket", type=int, default=5)
+    parser.add_argument("--broadcasts", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--max-p99", type=float, default=5, help="socket 模式单次广播允许的 p99（毫秒）")
+    args = parser.parse_args()
+
+    socket_p99, spurious = asyncio.run(run(args))
+    if spurious:
+        print(f"FAIL: socket 模式出现 {spurious} 次多余投递")
+        sys.exit(1)
+    if socket_p99 * 1000 > args.max_p99:
+        print(f"FAIL: 单次广播 p99 {socket_p99 * 1000:.2f}ms 超过 {args.max_p99}ms")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
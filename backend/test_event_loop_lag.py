@@ -0,0 +1,125 @@
+"""
+事件循环延迟测试
+
+用一个每次查询都阻塞 DB_LATENCY 秒的慢速存储后端代替数据库，并发发起查询，
+同时用定时任务测量事件循环的调度延迟：
+
+- 经 AsyncSupabase 异步数据访问层查询时，事件循环延迟必须保持在 MAX_LAG 以内
+- 对照：在协程中直接调用同步客户端，延迟至少接近一次查询的耗时（证明测量本身有效）
+
+不访问真实数据库，可离线运行:
+
+    cd backend
+    python -m pytest -q test_event_loop_lag.py
+    python test_event_loop_lag.py
+"""
+import os
+import time
+import asyncio
+import tempfile
+
+# app.database 导入时按环境变量创建存储后端，这里避免连接真实数据库
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_DB_PATH", os.path.join(tempfile.gettempdir(), "test_event_loop_lag.db"))
+
+from app.database import AsyncSupabase
+from app.storage.base import QueryResult
+
+# 模拟数据库延迟、查询数与并发数
+DB_LATENCY = 0.1
+QUERIES = 40
+CONCURRENCY = 10
+# 异步数据访问层允许的最大事件循环延迟（秒）
+MAX_LAG = 0.05
+# 延迟采样间隔（秒）
+SAMPLE_INTERVAL = 0.005
+
+
+class SlowQuery:
+    """链式调用原样返回自身，execute() 在调用线程中阻塞 latency 秒"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def __getattr__(self, name: str):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        time.sleep(self.latency)
+        return QueryResult(data=[], count=None)
+
+
+class SlowClient:
+    """慢速数据库客户端（接口与同步 supabase 客户端一致）"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.executed = 0
+
+    def table(self, name: str) -> SlowQuery:
+        self.executed += 1
+        return SlowQuery(self.latency)
+
+    def rpc(self, fn: str, params: dict = None) -> SlowQuery:
+        self.executed += 1
+        return SlowQuery(self.latency)
+
+
+async def _measure_lag(stop: asyncio.Event, samples: list):
+    """每 SAMPLE_INTERVAL 秒醒来一次，记录实际唤醒时间比预期晚了多少"""
+    while not stop.is_set():
+        expected = time.perf_counter() + SAMPLE_INTERVAL
+        await asyncio.sleep(SAMPLE_INTERVAL)
+        samples.append(max(0.0, time.perf_counter() - expected))
+
+
+async def _run_queries(query) -> float:
+    """并发执行 QUERIES 次 query，返回期间事件循环的最大延迟（秒）"""
+    samples = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_measure_lag(stop, samples))
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(i: int):
+        async with semaphore:
+            await query(i)
+
+    # 先让监控协程开始采样
+    await asyncio.sleep(SAMPLE_INTERVAL)
+    await asyncio.gather(*(one(i) for i in range(QUERIES)))
+    stop.set()
+    await monitor
+    return max(samples) if samples else 0.0
+
+
+def test_async_data_access_keeps_event_loop_responsive():
+    client = SlowClient(DB_LATENCY)
+    async_client = AsyncSupabase(client)
+
+    async def query(i: int):
+        await async_client.table("messages").select("*").eq("conversation_id", str(i)).execute()
+
+    start = time.perf_counter()
+    worst = asyncio.run(_run_queries(query))
+    elapsed = time.perf_counter() - start
+
+    assert client.executed == QUERIES
+    # 查询确实在并发执行（串行至少需要 QUERIES * DB_LATENCY 秒）
+    assert elapsed < QUERIES * DB_LATENCY / 2
+    assert worst < MAX_LAG, f"事件循环最大延迟 {worst * 1000:.1f}ms 超过 {MAX_LAG * 1000:.0f}ms"
+
+
+def test_sync_client_in_coroutine_blocks_event_loop():
+    client = SlowClient(DB_LATENCY)
+
+    async def query(i: int):
+        client.table("messages").select("*").eq("conversation_id", str(i)).execute()
+
+    worst = asyncio.run(_run_queries(query))
+    assert worst >= DB_LATENCY * 0.8, f"同步调用的事件循环延迟只有 {worst * 1000:.1f}ms，测量无效"
+
+
+if __name__ == "__main__":
+    test_async_data_access_keeps_event_loop_responsive()
+    test_sync_client_in_coroutine_blocks_event_loop()
+    print("OK")
@@ -1,4 +1,4 @@
-import { useState, useCallback, useEffect } from 'react';
+import { useState, useCallback, useEffect, useMemo } from 'react';
 import { useSSE } from './useSSE';
 import { Message } from '../types';
 
@@ -23,6 +23,7 @@ interface UseChatSSEOptions {
   onNewMessage?: (message: Message) => void;
   onMessagesRead?: (userId: string, count: number) => void;
   onChatUpdated?: (chatId: string) => void;
+  onResync?: () => void;
 }
 
 interface UseChatSSEReturn {
@@ -40,7 +41,8 @@ export const useChatSSE = (options: UseChatSSEOptions): UseChatSSEReturn => {
     chatId,
     onNewMessage,
     onMessagesRead,
-    onChatUpdated
+    onChatUpdated,
+    onResync
   } = options;
 
   const [subscribedChats, setSubscribedChats] = useState<Set<string>>(new Set());
@@ -79,6 +81,12 @@ export const useChatSSE = (options: UseChatSSEOptions): UseChatSSEReturn => {
         console.log('[ChatSSE] 连接成功:', sseMessage.user_id);
         break;
 
+      case 'resync':
+        // 断线期间的事件已无法重放，需要全量重新拉取
+        console.log('[ChatSSE] 需要重新同步');
+        onResync?.();
+        break;
+
       case 'error':
         console.error('[ChatSSE] 服务器错误:', sseMessage.message);
         break;
@@ -86,16 +94,20 @@ export const useChatSSE = (options: UseChatSSEOptions): UseChatSSEReturn => {
       default:
         console.log('[ChatSSE] 收到消息:', type);
     }
-  }, [onNewMessage, onMessagesRead, onChatUpdated]);
+  }, [onNewMessage, onMessagesRead, onChatUpdated, onResync]);
 
   // SSE URL
   const baseUrl = import.meta.env.VITE_API_BASE_URL || 'http://localhost:8000';
   const sseUrl = `${baseUrl}/api/sse/connect`;
 
+  // 重连时在连接参数中带上已订阅的聊天室，服务器订阅后重放遗漏的事件
+  const params = useMemo(() => ({ chats: [...subscribedChats].join(',') }), [subscribedChats]);
+
   // 使用基础 SSE hook
   const { status, lastMessage, connect, disconnect } = useSSE({
     url: sseUrl,
     userId,
+    params,
     onMessage: handleMessage,
     reconnect: true,
     reconnectInterval: 3000,
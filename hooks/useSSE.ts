@@ -13,6 +13,7 @@ interface SSEMessage {
 interface UseSSEOptions {
   url: string;
   userId?: string;
+  params?: Record<string, string>;
   onMessage?: (message: SSEMessage) => void;
   onConnect?: () => void;
   onDisconnect?: () => void;
@@ -33,6 +34,7 @@ export const useSSE = (options: UseSSEOptions): UseSSEReturn => {
   const {
     url,
     userId,
+    params,
     onMessage,
     onConnect,
     onDisconnect,
@@ -49,6 +51,8 @@ export const useSSE = (options: UseSSEOptions): UseSSEReturn => {
   const reconnectAttemptsRef = useRef(0);
   const reconnectTimerRef = useRef<NodeJS.Timeout | null>(null);
   const isManualDisconnectRef = useRef(false);
+  // 最后收到的事件 ID，重连时服务器只重放之后的事件
+  const lastEventIdRef = useRef<string>('');
 
   // 构建 SSE URL
   const buildUrl = useCallback(() => {
@@ -56,8 +60,16 @@ export const useSSE = (options: UseSSEOptions): UseSSEReturn => {
     if (userId) {
       sseUrl.searchParams.append('user_id', userId);
     }
+    Object.entries(params || {}).forEach(([key, value]) => {
+      if (value) {
+        sseUrl.searchParams.append(key, value);
+      }
+    });
+    if (lastEventIdRef.current) {
+      sseUrl.searchParams.append('last_event_id', lastEventIdRef.current);
+    }
     return sseUrl.toString();
-  }, [url, userId]);
+  }, [url, userId, params]);
 
   // 断开连接
   const disconnect = useCallback(() => {
@@ -107,6 +119,9 @@ export const useSSE = (options: UseSSEOptions): UseSSEReturn => {
       };
 
       es.onmessage = (event) => {
+        if (event.lastEventId) {
+          lastEventIdRef.current = event.lastEventId;
+        }
         try {
           const data = JSON.parse(event.data);
           console.log('[SSE] 收到消息:', data);